@@ -1,7 +1,15 @@
 # ML_TAB/Steps/Step1/data_collection.py
+from typing import Iterator, List
+
 import pandas as pd
 from pathlib import Path
 
+
+def normalize_column_names(columns) -> List[str]:
+    """Chuẩn hoá tên cột cơ bản (bỏ khoảng trắng, ký tự đặc biệt)."""
+    return [c.strip().replace(" ", "_").replace("-", "_") for c in columns]
+
+
 def load_rawdata(file_path: str):
     """
     Step 1 - Data Collection (Excel & CSV only)
@@ -24,8 +32,25 @@ def load_rawdata(file_path: str):
         raise ValueError("Chỉ hỗ trợ file CSV hoặc Excel (.csv, .xlsx, .xls).")
 
     # Chuẩn hoá tên cột cơ bản
-    Rawdata.columns = [
-        c.strip().replace(" ", "_").replace("-", "_") for c in Rawdata.columns
-    ]
+    Rawdata.columns = normalize_column_names(Rawdata.columns)
 
     return Rawdata
+
+
+def iter_rawdata_chunks(file_path: str, chunksize: int = 200_000) -> Iterator[pd.DataFrame]:
+    """
+    Đọc file CSV theo từng chunk (out-of-core), tên cột chuẩn hoá giống load_rawdata.
+    Index của mỗi chunk là số thứ tự dòng trong file (tiếp nối giữa các chunk),
+    khớp với index của DataFrame do load_rawdata trả về.
+    Excel không đọc theo chunk được nên chỉ hỗ trợ CSV.
+    """
+    path = Path(file_path)
+    if not path.exists():
+        raise FileNotFoundError(f"Không tìm thấy file: {file_path}")
+    if path.suffix.lower() != ".csv":
+        raise ValueError("Chế độ đọc theo chunk chỉ hỗ trợ file CSV (.csv).")
+
+    with pd.read_csv(path, encoding="utf-8", chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk.columns = normalize_column_names(chunk.columns)
+            yield chunk
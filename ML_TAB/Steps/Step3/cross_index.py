@@ -0,0 +1,92 @@
+# ML_TAB/Steps/Step3/cross_index.py
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .result_store import OutlierResultStore
+
+
+class CrossDetectorIndex:
+    """
+    Chỉ mục ngược row_index -> (tab/detector, vị trí kết quả trong store), dạng CSR:
+
+        rows    : row_index duy nhất, tăng dần
+        indptr  : kết quả của rows[j] nằm ở [indptr[j], indptr[j+1]) trong tab_ids / positions
+        tab_ids : mã tab (tra trong `names`)
+        positions: vị trí kết quả trong store của tab đó
+        n_detectors: số detector (không tính tab gộp) gắn cờ cho rows[j]
+
+    Dựng một lần bằng một argsort; tra cứu một dòng = một searchsorted.
+    """
+
+    def __init__(self, stores: Dict[str, OutlierResultStore], derived: Iterable[str] = ()):
+        self.names: List[str] = list(stores.keys())
+        derived = set(derived)
+
+        row_parts, tab_parts, pos_parts = [], [], []
+        for t, name in enumerate(self.names):
+            st = stores[name]
+            n = len(st)
+            if n:
+                row_parts.append(st.row_index.astype(np.int64))
+                tab_parts.append(np.full(n, t, dtype=np.int16))
+                pos_parts.append(np.arange(n, dtype=np.int64))
+
+        if not row_parts:
+            self.rows = np.empty(0, np.int64)
+            self.indptr = np.zeros(1, np.int64)
+            self.tab_ids = np.empty(0, np.int16)
+            self.positions = np.empty(0, np.int64)
+            self.n_detectors = np.empty(0, np.int16)
+            return
+
+        row = np.concatenate(row_parts)
+        tab = np.concatenate(tab_parts)
+        pos = np.concatenate(pos_parts)
+
+        order = np.argsort(row, kind="stable")
+        row, self.tab_ids, self.positions = row[order], tab[order], pos[order]
+        self.rows, starts = np.unique(row, return_index=True)
+        self.indptr = np.append(starts, len(row)).astype(np.int64)
+
+        # đếm số tab (khác nhau, không phải tab gộp) cho mỗi row: bỏ trùng cặp (row, tab)
+        counted = np.array([name not in derived for name in self.names])[self.tab_ids]
+        grp = np.repeat(np.arange(len(self.rows)), np.diff(self.indptr))
+        pair = np.unique(grp[counted] * len(self.names) + self.tab_ids[counted])
+        self.n_detectors = np.bincount(
+            pair // len(self.names), minlength=len(self.rows)
+        ).astype(np.int16)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _slot(self, row_index: int) -> Optional[int]:
+        j = int(np.searchsorted(self.rows, row_index))
+        if j < len(self.rows) and self.rows[j] == row_index:
+            return j
+        return None
+
+    def lookup(self, row_index: int) -> Dict[str, np.ndarray]:
+        """{tên tab: vị trí các kết quả của row_index trong store của tab đó}."""
+        j = self._slot(row_index)
+        if j is None:
+            return {}
+        a, b = self.indptr[j], self.indptr[j + 1]
+        tabs, pos = self.tab_ids[a:b], self.positions[a:b]
+        return {self.names[t]: pos[tabs == t] for t in np.unique(tabs)}
+
+    def counts_for(self, row_index: np.ndarray) -> np.ndarray:
+        """n_detectors cho từng phần tử của mảng row_index (0 nếu không có trong chỉ mục)."""
+        row_index = np.asarray(row_index, dtype=np.int64)
+        out = np.zeros(row_index.shape, dtype=np.int16)
+        if not len(self.rows):
+            return out
+        j = np.minimum(np.searchsorted(self.rows, row_index), len(self.rows) - 1)
+        found = self.rows[j] == row_index
+        out[found] = self.n_detectors[j[found]]
+        return out
+
+    def rows_with_at_least(self, k: int) -> np.ndarray:
+        return self.rows[self.n_detectors >= k]
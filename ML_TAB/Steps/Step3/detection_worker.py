@@ -0,0 +1,112 @@
+# ML_TAB/Steps/Step3/detection_worker.py
+from __future__ import annotations
+
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PySide6.QtCore import QCoreApplication, QObject, QThread, Signal, Slot
+
+from .result_store import OutlierResultStore
+
+# Một task: (tên tab, hàm nhận dict kết quả đã có -> DataFrame kết quả)
+DetectionTask = Tuple[str, Callable[[Dict[str, Any]], Any]]
+
+
+class OutlierDetectionWorker(QObject):
+    """
+    Chạy lần lượt các detector trong một QThread riêng và phát kết quả ngay khi
+    từng detector xong (để dialog điền dần các tab).
+
+    - Task sau có thể dùng kết quả của task trước qua dict `results`
+      (vd "IQR + Z-Score" dùng lại kết quả IQR và Z-score).
+    - Kết quả được chuyển sang OutlierResultStore ngay trong worker,
+      GUI thread chỉ việc gắn model.
+    """
+
+    result_ready = Signal(str, object)   # (tên tab, OutlierResultStore)
+    failed = Signal(str, str)            # (tên tab, thông báo lỗi)
+    finished = Signal()
+
+    def __init__(self, tasks: List[DetectionTask]):
+        super().__init__()
+        self.tasks = tasks
+        self.results: Dict[str, Any] = {}
+        self._cancelled = False
+
+    def cancel(self):
+        """Dừng sau detector đang chạy (không ngắt giữa chừng một detector)."""
+        self._cancelled = True
+
+    @Slot()
+    def run(self):
+        for name, fn in self.tasks:
+            if self._cancelled:
+                break
+            try:
+                res = fn(self.results)
+                self.results[name] = res
+                self.result_ready.emit(name, OutlierResultStore.from_frame(res))
+            except Exception as e:
+                traceback.print_exc()
+                self.failed.emit(name, str(e))
+        self.finished.emit()
+
+
+class BackgroundJobs(QObject):
+    """
+    Giữ các (QThread, worker) của dialog đã đóng khi worker còn chạy dở.
+
+    Dialog đóng không chờ thread (detector / model đang chạy không ngắt giữa chừng được):
+    nó ngắt tín hiệu tới dialog, gọi worker.cancel() rồi giao thread cho đối tượng này
+    (thường do tab sở hữu). Thread tự kết thúc -> thread được deleteLater, worker được huỷ
+    khi bỏ tham chiếu. Khi thoát app mới chờ các thread còn lại (tránh huỷ QThread đang chạy).
+    """
+
+    def __init__(self, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self._jobs: Dict[QThread, QObject] = {}
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.wait_all)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def adopt(self, thread: QThread, worker: QObject):
+        # thread đã dừng: người gọi bỏ tham chiếu là đủ (Python sở hữu cả hai)
+        if not thread.isRunning():
+            return
+        thread.setParent(self)
+        self._jobs[thread] = worker
+        thread.finished.connect(self._on_thread_finished)
+        if thread.isFinished():                 # dừng ngay trước khi kịp nối finished
+            self._release(thread)
+
+    @Slot()
+    def _on_thread_finished(self):
+        # chạy trên GUI thread sau khi thread dừng hẳn -> huỷ worker ở đây là an toàn
+        self._release(self.sender())
+
+    def _release(self, thread: QThread):
+        if self._jobs.pop(thread, None) is not None:
+            thread.deleteLater()
+
+    @Slot()
+    def wait_all(self):
+        for thread, worker in list(self._jobs.items()):
+            if hasattr(worker, "cancel"):
+                worker.cancel()
+            thread.quit()
+            thread.wait()
+        self._jobs.clear()
+
+
+_DEFAULT_JOBS: Optional[BackgroundJobs] = None
+
+
+def default_background_jobs() -> BackgroundJobs:
+    """Nơi giữ mặc định cho dialog mở không kèm BackgroundJobs (sống tới khi thoát app)."""
+    global _DEFAULT_JOBS
+    if _DEFAULT_JOBS is None:
+        _DEFAULT_JOBS = BackgroundJobs()
+    return _DEFAULT_JOBS
@@ -0,0 +1,146 @@
+# ML_TAB/Steps/Step3/feature_matrix.py
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class FeatureMatrix:
+    """
+    Ma trận đặc trưng dùng chung cho các detector row-level
+    (IsolationForest, LOF, ECOD, COPOD, KNN).
+
+    - X        : np.ndarray C-contiguous (n_rows, n_cols), float32 hoặc float64
+    - columns  : tên cột theo thứ tự cột của X
+    - col_pos  : tên cột -> vị trí cột trong X
+    - row_index: nhãn index của df cho từng dòng của X
+    - row_pos  : vị trí dòng trong df cho từng dòng của X
+                 (khác arange khi nan_policy='drop' bỏ bớt dòng)
+    - median / MAD theo cột (giải thích robust-z) tính một lần khi cần, dùng chung mọi detector
+    """
+    X: np.ndarray
+    columns: List[str]
+    row_index: np.ndarray
+    row_pos: np.ndarray
+    nan_policy: str = "median"
+    col_pos: Dict[str, int] = field(init=False)
+    _robust: Optional[Tuple[np.ndarray, np.ndarray]] = field(init=False, default=None, repr=False)
+
+    def __post_init__(self):
+        self.col_pos = {c: j for j, c in enumerate(self.columns)}
+
+    def robust_stats(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(median, MAD) float64 của từng cột, bỏ qua NaN; tính lần đầu rồi giữ lại."""
+        if self._robust is None:
+            m = self.X.shape[1]
+            med = np.empty(m)
+            mad = np.empty(m)
+            for j in range(m):                # từng cột để không tạo thêm bản sao cả ma trận
+                col = self.X[:, j]
+                med[j] = np.nanmedian(col)
+                mad[j] = np.nanmedian(np.abs(col - med[j]))
+            self._robust = (med, mad)
+        return self._robust
+
+    def select(self, columns: List[str]) -> "FeatureMatrix":
+        """
+        Ma trận chỉ gồm các cột columns (theo thứ tự đó), cùng dòng. Trùng đúng các cột hiện có
+        -> trả về chính nó; cột không có trong ma trận -> ValueError.
+        """
+        if list(columns) == self.columns:
+            return self
+        missing = [c for c in columns if c not in self.col_pos]
+        if missing:
+            raise ValueError(f"FeatureMatrix không có cột: {missing}")
+        idx = [self.col_pos[c] for c in columns]
+        sub = FeatureMatrix(X=np.ascontiguousarray(self.X[:, idx]), columns=list(columns),
+                            row_index=self.row_index, row_pos=self.row_pos, nan_policy=self.nan_policy)
+        if self._robust is not None:
+            sub._robust = (self._robust[0][idx], self._robust[1][idx])
+        return sub
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.X.nbytes + self.row_index.nbytes + self.row_pos.nbytes)
+
+    def describe(self) -> str:
+        n, m = self.X.shape
+        return (
+            f"FeatureMatrix {n} x {m} {self.X.dtype} "
+            f"(nan_policy={self.nan_policy}) — {self.nbytes / 1e6:.1f} MB"
+        )
+
+
+def build_feature_matrix(
+    df: pd.DataFrame,
+    columns: Optional[List[str]] = None,
+    dtype: str = "float32",
+    nan_policy: str = "median",
+) -> FeatureMatrix:
+    """
+    Tạo MỘT ma trận C-contiguous từ các cột số của df (ghi thẳng từng cột vào
+    mảng đích, không qua bản sao float64 trung gian của df[cols].astype(float)).
+
+    nan_policy:
+        'median' -> điền NaN bằng median của cột (mặc định, detector sklearn/pyod không nhận NaN)
+        'drop'   -> bỏ các dòng có NaN (row_pos / row_index cho biết dòng nào còn lại)
+        'keep'   -> giữ nguyên NaN
+    """
+    if nan_policy not in ("median", "drop", "keep"):
+        raise ValueError("nan_policy must be 'median', 'drop' or 'keep'")
+
+    if columns:
+        cols = [c for c in columns if c in df.columns]
+    else:
+        cols = df.select_dtypes(include=[np.number]).columns.tolist()
+
+    n = len(df)
+    X = np.empty((n, len(cols)), dtype=dtype, order="C")
+    for j, c in enumerate(cols):
+        X[:, j] = df[c].to_numpy(dtype=dtype, na_value=np.nan)
+
+    row_pos = np.arange(n, dtype=np.int64)
+    if nan_policy == "median":
+        for j in range(len(cols)):
+            col = X[:, j]
+            nan = np.isnan(col)
+            if nan.any():
+                med = np.nanmedian(col) if not nan.all() else 0.0
+                col[nan] = med
+    elif nan_policy == "drop":
+        keep = ~np.isnan(X).any(axis=1)
+        if not keep.all():
+            X = np.ascontiguousarray(X[keep])
+            row_pos = row_pos[keep]
+
+    row_index = df.index.to_numpy()[row_pos]
+    return FeatureMatrix(X=X, columns=cols, row_index=row_index, row_pos=row_pos, nan_policy=nan_policy)
+
+
+# ---------- Cache theo phiên bản dữ liệu ----------
+_FM_CACHE: Dict[Tuple, FeatureMatrix] = {}
+
+
+def get_feature_matrix(
+    df: pd.DataFrame,
+    version: int,
+    columns: Optional[List[str]] = None,
+    dtype: str = "float32",
+    nan_policy: str = "median",
+) -> FeatureMatrix:
+    """
+    Như build_feature_matrix nhưng cache theo (phiên bản dữ liệu, cột, dtype, nan_policy).
+    Khi phiên bản dữ liệu đổi (nạp file mới / xoá dòng), các ma trận cũ bị bỏ.
+    """
+    key = (version, id(df), tuple(columns) if columns else None, str(np.dtype(dtype)), nan_policy)
+    fm = _FM_CACHE.get(key)
+    if fm is None:
+        for k in [k for k in _FM_CACHE if k[:2] != key[:2]]:
+            del _FM_CACHE[k]
+        fm = build_feature_matrix(df, columns, dtype=dtype, nan_policy=nan_policy)
+        _FM_CACHE[key] = fm
+    return fm
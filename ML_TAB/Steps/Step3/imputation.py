@@ -0,0 +1,237 @@
+# ML_TAB/Steps/Step3/imputation.py
+from __future__ import annotations
+
+import warnings
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .outlier_tools import _infer_timestamp_col, _sorted_time_positions
+from .transformers import NumericCleaner
+
+TimeSpan = Union[str, pd.Timedelta, int, None]
+
+IMPUTE_METHODS = ("ffill", "interpolate", "rolling_median")
+
+
+def _to_ns(span: TimeSpan) -> Optional[int]:
+    """'2h' / Timedelta / số nano-giây -> int nano-giây (None giữ nguyên)."""
+    if span is None:
+        return None
+    if isinstance(span, (int, np.integer)):
+        return int(span)
+    return int(pd.Timedelta(span).value)
+
+
+# ---------- Chỉ số điểm hợp lệ gần nhất (theo từng cột, vectorized) ----------
+def _positions(n: int) -> np.ndarray:
+    # int32 đủ cho một khối (kể cả vùng đệm) -> ma trận chỉ số bằng nửa int64
+    return np.arange(n, dtype=np.int32 if n < np.iinfo(np.int32).max else np.int64)
+
+
+def _prev_valid(valid: np.ndarray) -> np.ndarray:
+    """Vị trí dòng hợp lệ gần nhất ở phía trên (kể cả chính nó), -1 nếu không có."""
+    idx = np.where(valid, _positions(valid.shape[0])[:, None], -1)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return idx
+
+
+def _next_valid(valid: np.ndarray) -> np.ndarray:
+    """Vị trí dòng hợp lệ gần nhất ở phía dưới (kể cả chính nó), n nếu không có."""
+    n = valid.shape[0]
+    idx = np.where(valid, _positions(n)[:, None], n)
+    np.minimum.accumulate(idx[::-1], axis=0, out=idx[::-1])
+    return idx
+
+
+# Số ô tối đa (dòng x cột) của một khối impute_time_series: giới hạn các ma trận chỉ số
+# (dòng, cột) của _prev_valid / _next_valid khi có nhiều tag
+_BLOCK_CELLS = 25_000_000
+
+# Số phần tử tối đa của ma trận gom cửa sổ (ô NaN x số dòng trong cửa sổ) cho rolling median
+_GATHER_BUDGET = 20_000_000
+
+
+def _rolling_median_fill(
+    X: np.ndarray, t: np.ndarray, valid: np.ndarray, window: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Median trong cửa sổ [t - window/2, t + window/2] chỉ tại các ô NaN:
+    gom các giá trị trong cửa sổ thành ma trận (ô NaN, K) rồi np.nanmedian theo hàng.
+    Cửa sổ quá nhiều dòng (vượt _GATHER_BUDGET) -> rolling median của pandas trên cả khối.
+    """
+    rows, cols = np.nonzero(~valid)
+    half = window // 2
+    lo = np.searchsorted(t, t - half, side="left")
+    hi = np.searchsorted(t, t + half, side="right")
+    k = int((hi - lo).max())
+
+    if len(rows) * k > _GATHER_BUDGET:
+        med = (
+            pd.DataFrame(X, index=pd.DatetimeIndex(t))
+            .rolling(pd.Timedelta(window, unit="ns"), center=True, min_periods=1, closed="both")
+            .median()
+            .to_numpy()
+        )
+        vals = med[rows, cols]
+    else:
+        start = lo[rows]
+        pos = start[:, None] + np.arange(k)[None, :]
+        inside = pos < hi[rows][:, None]
+        win = X[np.minimum(pos, len(X) - 1), cols[:, None]].astype(np.float64)
+        win[~inside] = np.nan
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)   # cửa sổ toàn NaN
+            vals = np.nanmedian(win, axis=1)
+    ok = ~np.isnan(vals)
+    return rows[ok], cols[ok], vals[ok].astype(X.dtype)
+
+
+def _fill_block(
+    X: np.ndarray, t: np.ndarray, method: str, max_gap: Optional[int], window: Optional[int]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Giá trị điền cho các ô NaN của một khối (X: (n, m), t: int64 ns tăng dần).
+    Chỉ đọc X; trả về (rows, cols, values) để ghi sau -> các khối chồng lấn luôn đọc dữ liệu gốc.
+    """
+    valid = ~np.isnan(X)
+    if valid.all():
+        e = np.empty(0, np.int64)
+        return e, e, np.empty(0, X.dtype)
+
+    if method == "rolling_median":
+        return _rolling_median_fill(X, t, valid, window)
+
+    n = X.shape[0]
+    prev = _prev_valid(valid)
+    if method == "ffill":
+        ok = ~valid & (prev >= 0)
+        rows, cols = np.nonzero(ok)
+        p = prev[rows, cols]
+        if max_gap is not None:
+            keep = (t[rows] - t[p]) <= max_gap
+            rows, cols, p = rows[keep], cols[keep], p[keep]
+        return rows, cols, X[p, cols]
+
+    # interpolate: nội suy tuyến tính theo thời gian giữa hai điểm hợp lệ bao quanh
+    nxt = _next_valid(valid)
+    ok = ~valid & (prev >= 0) & (nxt < n)
+    rows, cols = np.nonzero(ok)
+    p, q = prev[rows, cols], nxt[rows, cols]
+    tp, tq = t[p], t[q]
+    if max_gap is not None:
+        keep = (tq - tp) <= max_gap            # cả khoảng trống (giữa 2 điểm hợp lệ) <= max_gap
+        rows, cols, p, q, tp, tq = rows[keep], cols[keep], p[keep], q[keep], tp[keep], tq[keep]
+    span = (tq - tp).astype(np.float64)
+    w = np.divide((t[rows] - tp).astype(np.float64), span, out=np.zeros(len(rows)), where=span > 0)
+    yp, yq = X[p, cols].astype(np.float64), X[q, cols].astype(np.float64)
+    return rows, cols, (yp + w * (yq - yp)).astype(X.dtype)
+
+
+def impute_time_series(
+    X: np.ndarray,
+    t_ns: np.ndarray,
+    method: str = "interpolate",
+    max_gap: TimeSpan = "2h",
+    window: TimeSpan = "6h",
+    chunk_size: int = 250_000,
+) -> int:
+    """
+    Điền NaN của X (n_rows, n_cols) TẠI CHỖ theo thời gian t_ns (int64 ns, đã sort tăng dần):
+
+        'ffill'          -> giá trị hợp lệ gần nhất phía trước, nếu cách <= max_gap
+        'interpolate'    -> nội suy tuyến tính theo thời gian (không theo số dòng),
+                            chỉ với khoảng trống dài <= max_gap; NaN ở đầu / cuối giữ nguyên
+        'rolling_median' -> median các giá trị hợp lệ trong cửa sổ `window` căn giữa
+
+    Mọi cột xử lý cùng lúc bằng numpy; dữ liệu đi theo khối chunk_size dòng (nhỏ hơn nếu
+    nhiều cột, tối đa _BLOCK_CELLS ô / khối), mỗi khối đọc thêm
+    vùng đệm (max_gap hoặc window/2) ở hai đầu để khoảng trống nằm vắt qua ranh giới khối vẫn
+    được điền đúng. max_gap=None (ffill / interpolate) -> không giới hạn, xử lý cả mảng một lần.
+    Trả về số ô đã điền.
+    """
+    if method not in IMPUTE_METHODS:
+        raise ValueError(f"method must be one of {IMPUTE_METHODS}")
+    if X.ndim != 2 or len(X) != len(t_ns):
+        raise ValueError("X must be 2-D with one row per timestamp")
+    n = len(X)
+    if n == 0:
+        return 0
+
+    gap = _to_ns(max_gap)
+    win = _to_ns(window)
+    if method == "rolling_median":
+        if not win:
+            raise ValueError("rolling_median cần window > 0")
+        left = right = win // 2 + 1
+    elif gap is None:
+        left = right = None
+    else:
+        left = gap
+        right = gap if method == "interpolate" else 0
+
+    fills: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+    step = n if left is None else max(min(int(chunk_size), _BLOCK_CELLS // max(X.shape[1], 1)), 1)
+    for a in range(0, n, step):
+        b = min(a + step, n)
+        # bỏ qua khối không có NaN (phần lớn dữ liệu thực)
+        if not np.isnan(X[a:b]).any():
+            continue
+        ea = a if left is None else int(np.searchsorted(t_ns, t_ns[a] - left, side="left"))
+        eb = b if right is None else int(np.searchsorted(t_ns, t_ns[b - 1] + right, side="right"))
+        rows, cols, vals = _fill_block(X[ea:eb], t_ns[ea:eb], method, gap, win)
+        rows = rows + ea
+        inside = (rows >= a) & (rows < b)      # chỉ ghi phần thuộc khối này
+        fills.append((rows[inside], cols[inside], vals[inside]))
+
+    # ghi sau cùng: các khối sau vẫn thấy NaN gốc trong vùng đệm
+    total = 0
+    for rows, cols, vals in fills:
+        X[rows, cols] = vals
+        total += len(rows)
+    return total
+
+
+class TimeSeriesImputer(NumericCleaner):
+    """
+    Như NumericCleaner (DataFrame -> ma trận float32) nhưng điền NaN theo thời gian
+    bằng impute_time_series (dùng cột Datetime của DataFrame đầu vào).
+    Không có cột thời gian -> giữ nguyên NaN (SimpleImputer phía sau sẽ lo).
+    """
+
+    def __init__(
+        self,
+        columns: Optional[List[str]] = None,
+        dtype: str = "float32",
+        method: str = "interpolate",
+        max_gap: TimeSpan = "2h",
+        window: TimeSpan = "6h",
+        chunk_size: int = 250_000,
+        datetime_col: Optional[str] = None,
+    ):
+        super().__init__(columns=columns, dtype=dtype)
+        self.method = method
+        self.max_gap = max_gap
+        self.window = window
+        self.chunk_size = chunk_size
+        self.datetime_col = datetime_col
+
+    def fit(self, X, y=None):
+        super().fit(X, y)
+        self.datetime_col_ = _infer_timestamp_col(X, self.datetime_col) if isinstance(X, pd.DataFrame) else None
+        return self
+
+    def transform(self, X):
+        out = super().transform(X)
+        if self.datetime_col_ is None or not isinstance(X, pd.DataFrame) or self.datetime_col_ not in X.columns:
+            return out
+        order, t = _sorted_time_positions(X, self.datetime_col_)
+        kw = dict(method=self.method, max_gap=self.max_gap, window=self.window, chunk_size=self.chunk_size)
+        if len(order) == len(out) and (order[1:] > order[:-1]).all():
+            impute_time_series(out, t, **kw)       # đã đúng thứ tự, không NaT: điền tại chỗ
+        else:
+            block = out[order]                     # dòng theo thời gian (bỏ NaT)
+            impute_time_series(block, t, **kw)
+            out[order] = block
+        return out
@@ -1,10 +1,11 @@
 # ML_TAB/Steps/Step3/outlier_dialog.py
 from __future__ import annotations
 
-from typing import Optional, List
+from typing import Optional, List, Dict, Union
 
+import numpy as np
 import pandas as pd
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QThread
 from PySide6.QtWidgets import (
     QDialog,
     QVBoxLayout,
@@ -13,28 +14,45 @@ from PySide6.QtWidgets import (
     QPushButton,
     QTabWidget,
     QWidget,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
+    QHeaderView,
     QMessageBox,
     QComboBox,
+    QFileDialog,
+    QProgressBar,
+    QSpinBox,
+    QDoubleSpinBox,
+    QLineEdit,
 )
-from PySide6.QtCore import Qt
+
+from .result_store import OutlierResultStore
+from .outlier_table_model import OutlierResultsModel, RowSelection
+from .cross_index import CrossDetectorIndex
+from .detection_worker import BackgroundJobs, DetectionTask, OutlierDetectionWorker, default_background_jobs
 
 class OutlierResultsDialog(QDialog):
     """
     Dialog hiển thị kết quả phát hiện outlier ở nhiều tab (IQR + Z-Score, IQR, Z-Score,
     IsolationForest, LOF...).
 
-    - Mỗi tab là một QTableWidget.
-    - Cột 'row_index' có checkbox để chọn những dòng muốn xoá.
+    - Mỗi tab là một QTableView + OutlierResultsModel (đọc thẳng từ OutlierResultStore,
+      chỉ format các dòng đang hiển thị -> mở dialog không phụ thuộc số kết quả).
+    - Tab mở ra với placeholder; view chỉ được dựng khi tab được chọn lần đầu.
+      run_detectors() chạy detector ở background và điền dần kết quả vào tab.
+    - Cột 'row_index' có checkbox để chọn những dòng muốn xoá; trạng thái chọn là một
+      bitset theo row_index dùng chung cho mọi tab (RowSelection).
+    - Sort theo cột (mặc định score giảm dần), lọc theo cột / score / thời gian,
+      chọn hàng loạt: top N theo score, dòng bị >= k detector gắn cờ.
+    - Chọn một dòng ở tab bất kỳ -> kết quả của cùng row_index ở mọi tab được tô nền,
+      cột n_detectors cho biết bao nhiêu detector cùng gắn cờ (CrossDetectorIndex).
     - Khi bấm 'Delete selected rows', dialog sẽ:
-        + Gom tất cả row_index được tick ở mọi tab
+        + Lấy các row_index đang được chọn (một phép np.flatnonzero)
         + Lưu vào self.rows_to_delete (list[int])
         + Trả về Accepted.
     - Nếu bấm 'Close' thì trả về Rejected và không xoá gì.
     """
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, jobs: Optional[BackgroundJobs] = None):
         super().__init__(parent)
         self.setObjectName("OutlierDialog")
         self.setWindowTitle("Outlier Detection — Results")
@@ -82,7 +100,7 @@ class OutlierResultsDialog(QDialog):
         }
 
         /* BẢNG KẾT QUẢ – XANH MINT */
-        #OutlierDialog QTableWidget {
+        #OutlierDialog QTableView {
             background-color: #e6fff5;            /* nền mint nhạt */
             alternate-background-color: #f4fffb;  /* hàng xen kẽ sáng hơn */
             color: #111;
@@ -104,6 +122,24 @@ class OutlierResultsDialog(QDialog):
 
         # Danh sách row_index được tick để xoá
         self.rows_to_delete: List[int] = []
+        # Kết quả dạng cột + model theo từng tab
+        self.stores: Dict[str, OutlierResultStore] = {}
+        self.models: Dict[str, OutlierResultsModel] = {}
+        # Trạng thái từng tab (placeholder / đã dựng view) + thứ tự tab
+        self._pages: Dict[str, dict] = {}
+        self._tab_names: List[str] = []
+        self._thread: Optional[QThread] = None
+        self._worker: Optional[OutlierDetectionWorker] = None
+        # Nhận thread còn chạy khi dialog đóng (tab giữ tham chiếu tới khi thread tự kết thúc)
+        self._jobs = jobs
+        # Tab là kết quả gộp từ tab khác (vd "IQR + Z-Score") -> không tính là một detector riêng
+        self._derived: set = set()
+        # Dòng được chọn để xoá: một bitset theo row_index dùng chung cho mọi tab
+        self.selection = RowSelection(self)
+        self.selection.changed.connect(self._update_selection_label)
+        # Chỉ mục row_index -> (tab, vị trí kết quả), dựng lại mỗi khi có kết quả mới
+        self.cross_index = CrossDetectorIndex({})
+        self.focus_row: Optional[int] = None
 
         outer = QVBoxLayout(self)
 
@@ -112,12 +148,79 @@ class OutlierResultsDialog(QDialog):
 
         header.addStretch(1)
 
+        self.btnExport = QPushButton("Export Parquet")
+        self.btnExport.clicked.connect(self._on_export_parquet)
+        header.addWidget(self.btnExport, 0, Qt.AlignRight)
+
         self.btnDelete = QPushButton("Delete selected rows")
         self.btnDelete.clicked.connect(self._on_delete_selected)
         header.addWidget(self.btnDelete, 0, Qt.AlignRight)
 
         outer.addLayout(header)
 
+        # ===== LỌC (áp cho tab đang mở) =====
+        filt = QHBoxLayout()
+        filt.addWidget(QLabel("Lọc:"))
+        self.cmbColumn = QComboBox()
+        self.cmbColumn.addItem("(tất cả cột)")
+        self.cmbColumn.setMinimumWidth(140)
+        filt.addWidget(self.cmbColumn)
+
+        filt.addWidget(QLabel("score ≥"))
+        self.spnMinScore = QDoubleSpinBox()
+        self.spnMinScore.setRange(-1.0, 1e9)
+        self.spnMinScore.setDecimals(3)
+        self.spnMinScore.setValue(-1.0)
+        self.spnMinScore.setSpecialValueText("—")      # giá trị min = không lọc
+        filt.addWidget(self.spnMinScore)
+
+        filt.addWidget(QLabel("từ"))
+        self.edtStart = QLineEdit()
+        self.edtStart.setPlaceholderText("YYYY-MM-DD HH:MM")
+        filt.addWidget(self.edtStart)
+        filt.addWidget(QLabel("đến"))
+        self.edtEnd = QLineEdit()
+        self.edtEnd.setPlaceholderText("YYYY-MM-DD HH:MM")
+        filt.addWidget(self.edtEnd)
+
+        btnFilter = QPushButton("Áp dụng lọc")
+        btnFilter.clicked.connect(self._on_apply_filter)
+        filt.addWidget(btnFilter)
+        filt.addStretch(1)
+        outer.addLayout(filt)
+
+        # ===== CHỌN HÀNG LOẠT =====
+        bulk = QHBoxLayout()
+        bulk.addWidget(QLabel("Chọn:"))
+        self.spnTopN = QSpinBox()
+        self.spnTopN.setRange(1, 10_000_000)
+        self.spnTopN.setValue(100)
+        bulk.addWidget(self.spnTopN)
+        btnTop = QPushButton("Top N theo score")
+        btnTop.clicked.connect(self._on_select_top_n)
+        bulk.addWidget(btnTop)
+
+        self.spnMinDet = QSpinBox()
+        self.spnMinDet.setRange(1, 64)
+        self.spnMinDet.setValue(2)
+        bulk.addWidget(self.spnMinDet)
+        btnVotes = QPushButton("Dòng bị ≥k detector gắn cờ")
+        btnVotes.clicked.connect(self._on_select_min_detectors)
+        bulk.addWidget(btnVotes)
+
+        btnClear = QPushButton("Bỏ chọn")
+        btnClear.clicked.connect(self.selection.clear)
+        bulk.addWidget(btnClear)
+
+        bulk.addStretch(1)
+        self.lblSelected = QLabel("Đã chọn: 0 dòng")
+        bulk.addWidget(self.lblSelected)
+        outer.addLayout(bulk)
+
+        # Dòng đang chọn: những detector nào cùng gắn cờ
+        self.lblLinked = QLabel("")
+        outer.addWidget(self.lblLinked)
+
 
         # ===== TAB WIDGET =====
         self.tabs = QTabWidget(self)
@@ -126,6 +229,7 @@ class OutlierResultsDialog(QDialog):
         tabbar = self.tabs.tabBar()
         tabbar.setUsesScrollButtons(False)
         tabbar.setExpanding(False)
+        self.tabs.currentChanged.connect(self._on_tab_changed)
 
         outer.addWidget(self.tabs, 1)
         # Không còn layout bottom, nút Delete đã được đưa lên header
@@ -135,115 +239,278 @@ class OutlierResultsDialog(QDialog):
 
 
     # ------------------------------------------------------------------
-    # Thêm một tab kết quả
+    # Tab: placeholder trước, view thật chỉ dựng khi tab được chọn lần đầu
     # ------------------------------------------------------------------
-    def add_tab(self, name: str, df: Optional[pd.DataFrame]):
+    def add_pending_tab(self, name: str, derived: bool = False):
+        """
+        Thêm tab 'name' với placeholder (thanh bận) — kết quả sẽ tới sau qua set_tab_result().
+        derived=True: tab gộp từ kết quả tab khác, không tính khi đếm số detector.
+        """
+        if derived:
+            self._derived.add(name)
+        page = QWidget(self)
+        layout = QVBoxLayout(page)
+
+        placeholder = QWidget(page)
+        ph_layout = QVBoxLayout(placeholder)
+        ph_layout.addStretch(1)
+        label = QLabel("Đang tính...", placeholder)
+        label.setAlignment(Qt.AlignCenter)
+        busy = QProgressBar(placeholder)
+        busy.setRange(0, 0)                    # chế độ "bận" không xác định
+        busy.setTextVisible(False)
+        busy.setMaximumWidth(240)
+        ph_layout.addWidget(label, 0, Qt.AlignCenter)
+        ph_layout.addWidget(busy, 0, Qt.AlignCenter)
+        ph_layout.addStretch(1)
+        layout.addWidget(placeholder)
+
+        self._pages[name] = {
+            "page": page,
+            "layout": layout,
+            "placeholder": placeholder,
+            "label": label,
+            "busy": busy,
+            "built": False,
+        }
+        self._tab_names.append(name)
+        self.tabs.addTab(page, f"{name} ⏳")
+
+    def set_tab_result(self, name: str, df: Optional[Union[pd.DataFrame, OutlierResultStore]]):
+        """Gắn kết quả cho tab; view chỉ được dựng nếu tab đang được chọn."""
+        if name not in self._pages:
+            self.add_pending_tab(name)
+
+        store = df if isinstance(df, OutlierResultStore) else OutlierResultStore.from_frame(df)
+        self.stores[name] = store
+
+        info = self._pages[name]
+        info["busy"].hide()
+        info["label"].setText(f"{len(store)} kết quả — mở tab để xem.")
+        self.tabs.setTabText(self._tab_names.index(name), f"{name} ({len(store)})")
+
+        self._rebuild_cross_index()
+        if self.tabs.currentWidget() is info["page"]:
+            self._materialize(name)
+
+    def set_tab_error(self, name: str, message: str):
+        info = self._pages.get(name)
+        if info is None:
+            return
+        info["busy"].hide()
+        info["label"].setText(f"Lỗi: {message}")
+        self.tabs.setTabText(self._tab_names.index(name), f"{name} ⚠")
+
+    def add_tab(self, name: str, df: Optional[Union[pd.DataFrame, OutlierResultStore]]):
         """
-        Thêm một tab với tên 'name' và dữ liệu 'df'.
+        Thêm một tab với tên 'name' và dữ liệu 'df' (DataFrame kết quả hoặc OutlierResultStore).
         df mong đợi có ít nhất các cột:
             row_index | timestamp | column | value | score | method
-        Nếu có thêm cột 'causes' sẽ hiển thị thêm ở cuối.
+        Detector row-level có giải thích (df.attrs["causes"]) -> hiển thị thêm cột causes ở cuối.
         """
-        widget = QWidget(self)
-        layout = QVBoxLayout(widget)
-
-        base_headers = ["row_index", "timestamp", "column", "value", "score", "method"]
-        headers = base_headers.copy()
+        self.add_pending_tab(name)
+        self.set_tab_result(name, df)
+
+    def _on_tab_changed(self, index: int):
+        if 0 <= index < len(self._tab_names):
+            name = self._tab_names[index]
+            if name in self.stores:
+                self._materialize(name)
+                self._scroll_to_focus(name)
+            self._refresh_column_filter()
+
+    def _materialize(self, name: str):
+        info = self._pages[name]
+        if info["built"]:
+            return
+        info["built"] = True
 
-        # nếu DF có cột 'causes' thì thêm vào
-        if df is not None and ("causes" in df.columns):
-            headers.append("causes")
+        model = OutlierResultsModel(self.stores[name], self.selection, self)
+        model.set_detector_counts(self.cross_index.counts_for(model.store.row_index))
+        model.set_highlight_row(self.focus_row)
+        self.models[name] = model
 
-        table = QTableWidget(widget)
-        table.setColumnCount(len(headers))
-        table.setHorizontalHeaderLabels(headers)
+        table = QTableView(info["page"])
+        table.setModel(model)
         table.setAlternatingRowColors(True)
+        table.setWordWrap(False)
+        table.setSelectionBehavior(QTableView.SelectRows)
+
+        # sort do model làm (argsort trên mảng), mặc định score bất thường nhất lên đầu
+        hh = table.horizontalHeader()
+        hh.setSortIndicator(model.headers.index("score"), Qt.DescendingOrder)
+        table.setSortingEnabled(True)
+
+        # chiều cao dòng cố định -> view không phải đo từng dòng
+        vh = table.verticalHeader()
+        vh.setSectionResizeMode(QHeaderView.Fixed)
+        vh.setDefaultSectionSize(22)
+
+        # chỉ lấy mẫu một ít dòng khi tự co độ rộng cột
+        hh.setResizeContentsPrecision(50)
+        table.resizeColumnsToContents()
+
+        table.selectionModel().currentRowChanged.connect(
+            lambda cur, _prev, m=model: self._on_current_row(m, cur.row())
+        )
+        info["table"] = table
 
-        if df is not None and not df.empty:
-            table.setRowCount(len(df))
-
-            for r, (_, row) in enumerate(df.iterrows()):
-                # --- row_index (checkable) ---
-                ridx = row.get("row_index", "")
-                idx_item = QTableWidgetItem(str(ridx))
-                idx_item.setTextAlignment(Qt.AlignCenter)
-                idx_item.setFlags(idx_item.flags() | Qt.ItemIsUserCheckable)
-                idx_item.setCheckState(Qt.Unchecked)
-                table.setItem(r, 0, idx_item)
-
-                # --- timestamp ---
-                ts = str(row.get("timestamp", ""))
-                table.setItem(r, 1, QTableWidgetItem(ts))
-
-                # --- column ---
-                col_name = str(row.get("column", ""))
-                table.setItem(r, 2, QTableWidgetItem(col_name))
-
-                # --- value ---
-                val = row.get("value", "")
-                if isinstance(val, (int, float)) and not pd.isna(val):
-                    txt_val = f"{val:.6g}"
-                else:
-                    txt_val = "" if pd.isna(val) else str(val)
-                table.setItem(r, 3, QTableWidgetItem(txt_val))
-
-                # --- score ---
-                score = row.get("score", "")
-                if isinstance(score, (int, float)) and not pd.isna(score):
-                    txt_score = f"{score:.6f}"
-                else:
-                    txt_score = "" if pd.isna(score) else str(score)
-                score_item = QTableWidgetItem(txt_score)
-                score_item.setTextAlignment(Qt.AlignCenter)
-                table.setItem(r, 4, score_item)
-
-                # --- method ---
-                method = str(row.get("method", ""))
-                table.setItem(r, 5, QTableWidgetItem(method))
-
-                # --- causes (nếu có) ---
-                if "causes" in headers:
-                    cidx = headers.index("causes")
-                    causes_str = str(row.get("causes", ""))
-                    table.setItem(r, cidx, QTableWidgetItem(causes_str))
-
-            table.resizeColumnsToContents()
-        else:
-            table.setRowCount(0)
-
-        layout.addWidget(table)
-        self.tabs.addTab(widget, name)
+        info["placeholder"].hide()
+        info["layout"].addWidget(table)
+        self._refresh_column_filter()
+
+    # ------------------------------------------------------------------
+    # Liên kết giữa các tab qua chỉ mục row_index
+    # ------------------------------------------------------------------
+    def _rebuild_cross_index(self):
+        self.cross_index = CrossDetectorIndex(self.stores, derived=self._derived)
+        for m in self.models.values():
+            m.set_detector_counts(self.cross_index.counts_for(m.store.row_index))
+
+    def _on_current_row(self, model: OutlierResultsModel, view_row: int):
+        if view_row < 0:
+            return
+        row = int(model.store.row_index[model.visible_positions()[view_row]])
+        if row == self.focus_row:
+            return
+        self.focus_row = row
+        for m in self.models.values():
+            m.set_highlight_row(row)
+
+        hits = self.cross_index.lookup(row)
+        detectors = [f"{n} ({len(p)})" if len(p) > 1 else n for n, p in hits.items()]
+        n_det = int(self.cross_index.counts_for(np.array([row]))[0])
+        self.lblLinked.setText(f"row_index {row}: {n_det} detector — " + ", ".join(detectors))
+
+    def _scroll_to_focus(self, name: str):
+        """Mở tab khác: cuộn tới kết quả đầu tiên của dòng đang chọn (nếu tab đó có)."""
+        if self.focus_row is None:
+            return
+        positions = self.cross_index.lookup(self.focus_row).get(name)
+        table = self._pages[name].get("table")
+        if positions is None or table is None:
+            return
+        rows = self.models[name].view_rows_of(positions)
+        if rows.size:
+            table.scrollTo(self.models[name].index(int(rows[0]), 0))
+
+    # ------------------------------------------------------------------
+    # Lọc / chọn hàng loạt
+    # ------------------------------------------------------------------
+    def _current_model(self) -> Optional[OutlierResultsModel]:
+        index = self.tabs.currentIndex()
+        if 0 <= index < len(self._tab_names):
+            return self.models.get(self._tab_names[index])
+        return None
+
+    def _refresh_column_filter(self):
+        model = self._current_model()
+        self.cmbColumn.blockSignals(True)
+        self.cmbColumn.clear()
+        self.cmbColumn.addItem("(tất cả cột)")
+        if model is not None:
+            self.cmbColumn.addItems(sorted(set(model.store.column_names())))
+        self.cmbColumn.blockSignals(False)
+
+    def _on_apply_filter(self):
+        model = self._current_model()
+        if model is None:
+            return
+        try:
+            start = pd.Timestamp(self.edtStart.text()) if self.edtStart.text().strip() else None
+            end = pd.Timestamp(self.edtEnd.text()) if self.edtEnd.text().strip() else None
+        except ValueError as e:
+            QMessageBox.warning(self, "Thời gian không hợp lệ", str(e))
+            return
+
+        column = self.cmbColumn.currentText() if self.cmbColumn.currentIndex() > 0 else None
+        min_score = self.spnMinScore.value()
+        model.set_filter(
+            column=column,
+            min_score=None if min_score <= self.spnMinScore.minimum() else min_score,
+            start=start,
+            end=end,
+        )
+
+    def _on_select_top_n(self):
+        model = self._current_model()
+        if model is None:
+            return
+        self.selection.set(model.top_rows(self.spnTopN.value()), True)
+
+    def _on_select_min_detectors(self):
+        self.selection.set(self.cross_index.rows_with_at_least(self.spnMinDet.value()), True)
+
+    def _update_selection_label(self):
+        self.lblSelected.setText(f"Đã chọn: {len(self.selection)} dòng")
+
+    # ------------------------------------------------------------------
+    # Chạy detector ở background, điền dần kết quả vào các tab
+    # ------------------------------------------------------------------
+    def run_detectors(self, tasks: List[DetectionTask]):
+        """
+        tasks: [(tên tab, fn(results) -> DataFrame), ...] — chạy lần lượt trong QThread.
+        Tab nào chưa có thì được thêm dạng placeholder theo thứ tự của tasks.
+        """
+        for name, _ in tasks:
+            if name not in self._pages:
+                self.add_pending_tab(name)
+
+        # Không gắn parent là dialog: thread có thể sống lâu hơn dialog (xem done())
+        self._thread = QThread()
+        self._worker = OutlierDetectionWorker(tasks)
+        self._worker.moveToThread(self._thread)
+        self._thread.started.connect(self._worker.run)
+        self._worker.result_ready.connect(self.set_tab_result)
+        self._worker.failed.connect(self.set_tab_error)
+        self._worker.finished.connect(self._thread.quit)
+        self._thread.start()
+
+    def done(self, result: int):
+        # Đóng dialog không chờ detector đang chạy: ngắt tín hiệu tới dialog, worker dừng
+        # sau detector hiện tại; thread + worker được giao cho BackgroundJobs tới khi tự xong
+        if self._thread is not None:
+            self._worker.result_ready.disconnect(self.set_tab_result)
+            self._worker.failed.disconnect(self.set_tab_error)
+            self._worker.cancel()
+            jobs = self._jobs if self._jobs is not None else default_background_jobs()
+            jobs.adopt(self._thread, self._worker)
+            self._thread = self._worker = None
+        super().done(result)
 
     # ------------------------------------------------------------------
     # Gom row_index đã tick ở mọi tab khi bấm Delete selected rows
     # ------------------------------------------------------------------
     def _on_delete_selected(self):
-        rows = set()
-
-        for t_idx in range(self.tabs.count()):
-            page = self.tabs.widget(t_idx)
-            if not page:
-                continue
-
-            table = page.findChild(QTableWidget)
-            if table is None:
-                continue
-
-            # cột 0 = row_index (checkable)
-            for r in range(table.rowCount()):
-                item = table.item(r, 0)
-                if not item:
-                    continue
-                if item.checkState() == Qt.Checked:
-                    try:
-                        ridx = int(item.text())
-                        rows.add(ridx)
-                    except ValueError:
-                        pass
-
-        if not rows:
+        rows = self.selection.rows()
+
+        if rows.size == 0:
             QMessageBox.information(self, "No selection", "Chưa tick dòng nào để xoá.")
             return
 
-        self.rows_to_delete = sorted(rows)
+        self.rows_to_delete = rows.astype(int).tolist()
         self.accept()
+
+    # ------------------------------------------------------------------
+    # Lưu toàn bộ kết quả (mọi tab) ra Parquet dạng cột gọn
+    # ------------------------------------------------------------------
+    def _on_export_parquet(self):
+        if not any(len(st) for st in self.stores.values()):
+            QMessageBox.information(self, "No results", "Không có kết quả để export.")
+            return
+
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Lưu kết quả outlier", "outlier_results.parquet", "Parquet (*.parquet)"
+        )
+        if not path:
+            return
+
+        try:
+            store = OutlierResultStore.concat(list(self.stores.values()))
+            store.to_parquet(path)
+            QMessageBox.information(
+                self, "Export",
+                f"Đã lưu {len(store)} kết quả ({store.nbytes / 1e6:.1f} MB) vào:\n{path}"
+            )
+        except Exception as e:
+            QMessageBox.critical(self, "Lỗi export", str(e))
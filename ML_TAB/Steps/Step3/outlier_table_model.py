@@ -0,0 +1,282 @@
+# ML_TAB/Steps/Step3/outlier_table_model.py
+from __future__ import annotations
+
+from typing import Any, List, Optional
+
+import numpy as np
+import pandas as pd
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QObject, Signal
+from PySide6.QtGui import QColor
+
+from .result_store import OutlierResultStore, NAT_INT64
+
+
+def _to_check_state(value: Any) -> bool:
+    """PySide6 có thể truyền Qt.CheckState hoặc int cho CheckStateRole."""
+    state = value.value if hasattr(value, "value") else int(value)
+    return state == Qt.CheckState.Checked.value
+
+
+class RowSelection(QObject):
+    """
+    Tập dòng được chọn để xoá, dùng chung cho mọi tab:
+    một mảng bool đánh theo row_index (tick một kết quả = tick cả dòng dữ liệu,
+    ở mọi detector). Lấy danh sách dòng cần xoá = một phép np.flatnonzero.
+    """
+
+    changed = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.mask = np.zeros(0, dtype=bool)
+
+    def _ensure(self, rows: np.ndarray):
+        if rows.size:
+            need = int(rows.max()) + 1
+            if need > self.mask.size:
+                grown = np.zeros(max(need, 2 * self.mask.size), dtype=bool)
+                grown[: self.mask.size] = self.mask
+                self.mask = grown
+
+    def contains(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.zeros(rows.shape, dtype=bool)
+        inside = rows < self.mask.size
+        out[inside] = self.mask[rows[inside]]
+        return out
+
+    def set(self, rows, value: bool = True):
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        self._ensure(rows)
+        self.mask[rows] = value
+        self.changed.emit()
+
+    def clear(self):
+        self.mask[:] = False
+        self.changed.emit()
+
+    def rows(self) -> np.ndarray:
+        return np.flatnonzero(self.mask)
+
+    def __len__(self) -> int:
+        return int(self.mask.sum())
+
+
+class OutlierResultsModel(QAbstractTableModel):
+    """
+    Model đọc trực tiếp từ OutlierResultStore (không tạo item cho từng ô):
+    - Chuỗi hiển thị chỉ được format khi view hỏi tới (tức là các dòng đang nhìn thấy).
+    - Sort / filter chỉ thay đổi hoán vị `_order` (vị trí trong store của từng dòng hiển thị).
+    - Trạng thái tick của cột 'row_index' lấy từ RowSelection dùng chung.
+    - 'n_detectors' (số detector cùng gắn cờ dòng đó) lấy từ CrossDetectorIndex;
+      các kết quả của dòng đang được chọn ở bất kỳ tab nào được tô nền.
+    """
+
+    BASE_HEADERS = ["row_index", "timestamp", "column", "value", "score", "method", "n_detectors"]
+    HIGHLIGHT = QColor("#ffe08a")
+
+    def __init__(self, store: OutlierResultStore, selection: Optional[RowSelection] = None, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.headers: List[str] = self.BASE_HEADERS.copy()
+        if store.has_causes:
+            self.headers.append("causes")
+
+        self.severity = store.severity()
+        self.n_detectors = np.zeros(len(store), dtype=np.int16)
+        self.highlight_row: Optional[int] = None
+        self.selection = selection if selection is not None else RowSelection(self)
+        self.selection.changed.connect(self._on_selection_changed)
+
+        self._filtered = np.arange(len(store), dtype=np.int64)   # vị trí qua bộ lọc
+        self._order = self._filtered                               # + đã sort
+        self._sort_col: Optional[int] = None
+        self._sort_desc = True
+
+    # ---------- kích thước ----------
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._order)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    # ---------- dữ liệu ----------
+    def _display(self, i: int, c: int) -> str:
+        s = self.store
+        name = self.headers[c]
+        if name == "row_index":
+            return str(int(s.row_index[i]))
+        if name == "timestamp":
+            ts = s.timestamp[i]
+            return "" if ts == NAT_INT64 else str(pd.Timestamp(int(ts)))
+        if name == "column":
+            return s.columns[s.column_codes[i]]
+        if name == "value":
+            v = float(s.value[i])
+            return "" if np.isnan(v) else f"{v:.6g}"
+        if name == "score":
+            v = float(s.score[i])
+            return "" if np.isnan(v) else f"{v:.6f}"
+        if name == "method":
+            return s.methods[s.method_codes[i]]
+        if name == "n_detectors":
+            return str(int(self.n_detectors[i]))
+        if name == "causes":
+            return s.causes_text(i)
+        return ""
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i, c = int(self._order[index.row()]), index.column()
+
+        if role == Qt.DisplayRole:
+            return self._display(i, c)
+        if role == Qt.CheckStateRole and c == 0:
+            checked = self.selection.contains(self.store.row_index[i:i + 1])[0]
+            return Qt.Checked if checked else Qt.Unchecked
+        if role == Qt.BackgroundRole and self.highlight_row is not None \
+                and self.store.row_index[i] == self.highlight_row:
+            return self.HIGHLIGHT
+        if role == Qt.TextAlignmentRole and self.headers[c] in ("row_index", "score", "n_detectors"):
+            return int(Qt.AlignCenter)
+        return None
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        f = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == 0:
+            f |= Qt.ItemIsUserCheckable
+        return f
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole) -> bool:
+        if not index.isValid() or role != Qt.CheckStateRole or index.column() != 0:
+            return False
+        i = int(self._order[index.row()])
+        self.selection.set(self.store.row_index[i], _to_check_state(value))
+        return True
+
+    def _on_selection_changed(self):
+        if len(self._order):
+            self.dataChanged.emit(
+                self.index(0, 0), self.index(len(self._order) - 1, 0), [Qt.CheckStateRole]
+            )
+
+    # ---------- sort ----------
+    def _sort_key(self, c: int) -> Optional[np.ndarray]:
+        s = self.store
+        name = self.headers[c]
+        if name == "row_index":
+            return s.row_index
+        if name == "timestamp":
+            return s.timestamp
+        if name == "column":
+            # sắp theo tên cột chứ không theo mã
+            rank = np.argsort(np.argsort(np.asarray(s.columns, dtype=object)))
+            return rank[s.column_codes]
+        if name == "value":
+            return s.value
+        if name == "score":
+            return self.severity      # 'score' sắp theo mức bất thường (cùng chiều mọi method)
+        if name == "method":
+            rank = np.argsort(np.argsort(np.asarray(s.methods, dtype=object)))
+            return rank[s.method_codes]
+        if name == "n_detectors":
+            return self.n_detectors
+        return None
+
+    def _apply_sort(self):
+        order = self._filtered
+        if self._sort_col is not None:
+            key = self._sort_key(self._sort_col)
+            if key is not None:
+                k = key[order]
+                if self._sort_desc:
+                    # giảm dần nhưng vẫn ổn định: đảo mảng, argsort ổn định, đảo lại
+                    idx = np.argsort(k[::-1], kind="stable")[::-1]
+                    idx = len(k) - 1 - idx
+                else:
+                    idx = np.argsort(k, kind="stable")
+                order = order[idx]
+        self._order = order
+
+    def sort(self, column: int, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self._sort_col = column
+        self._sort_desc = order == Qt.DescendingOrder
+        self._apply_sort()
+        self.layoutChanged.emit()
+
+    # ---------- filter ----------
+    def set_filter(
+        self,
+        column: Optional[str] = None,
+        min_score: Optional[float] = None,
+        start: Optional[pd.Timestamp] = None,
+        end: Optional[pd.Timestamp] = None,
+    ):
+        """
+        Lọc theo tên cột, ngưỡng score (theo mức bất thường, xem severity) và khoảng thời gian.
+        None = không lọc theo tiêu chí đó.
+        """
+        s = self.store
+        keep = np.ones(len(s), dtype=bool)
+        if column:
+            code = s.columns.index(column) if column in s.columns else -1
+            keep &= s.column_codes == code
+        if min_score is not None:
+            keep &= self.severity >= min_score
+        if start is not None:
+            keep &= (s.timestamp != NAT_INT64) & (s.timestamp >= pd.Timestamp(start).value)
+        if end is not None:
+            keep &= (s.timestamp != NAT_INT64) & (s.timestamp <= pd.Timestamp(end).value)
+
+        self.beginResetModel()
+        self._filtered = np.flatnonzero(keep)
+        self._apply_sort()
+        self.endResetModel()
+
+    # ---------- liên kết giữa các tab ----------
+    def set_detector_counts(self, counts: np.ndarray):
+        """Cập nhật cột n_detectors (mảng theo vị trí trong store, từ CrossDetectorIndex.counts_for)."""
+        self.n_detectors = counts
+        c = self.headers.index("n_detectors")
+        if len(self._order):
+            self.dataChanged.emit(self.index(0, c), self.index(len(self._order) - 1, c), [Qt.DisplayRole])
+
+    def set_highlight_row(self, row_index: Optional[int]):
+        self.highlight_row = row_index
+        if len(self._order):
+            self.dataChanged.emit(
+                self.index(0, 0), self.index(len(self._order) - 1, len(self.headers) - 1),
+                [Qt.BackgroundRole],
+            )
+
+    def view_rows_of(self, positions: np.ndarray) -> np.ndarray:
+        """Dòng hiển thị (sau lọc + sort) của các vị trí store cho trước."""
+        return np.flatnonzero(np.isin(self._order, positions))
+
+    # ---------- tiện ích ----------
+    def visible_positions(self) -> np.ndarray:
+        """Vị trí trong store của các dòng đang hiển thị (đã lọc + sort)."""
+        return self._order
+
+    def top_rows(self, n: int) -> np.ndarray:
+        """row_index của n kết quả bất thường nhất trong các dòng đang hiển thị."""
+        pos = self._order
+        if n < len(pos):
+            pos = pos[np.argpartition(-self.severity[pos], n)[:n]]
+        return np.unique(self.store.row_index[pos])
+
+    def checked_row_indices(self) -> np.ndarray:
+        """row_index của các kết quả (trong tab này) đang được tick."""
+        rows = self.store.row_index
+        return np.unique(rows[self.selection.contains(rows)])
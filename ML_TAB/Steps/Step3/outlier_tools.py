@@ -1,6 +1,7 @@
 # ML_TAB/Steps/Step3/outlier_tools.py
 from __future__ import annotations
 import re
+import time
 import numpy as np
 import pandas as pd
 from typing import Optional, List, Tuple, Dict, Any
@@ -9,6 +10,7 @@ from sklearn.ensemble import IsolationForest
 from sklearn.neighbors import LocalOutlierFactor
 from sklearn.ensemble import IsolationForest
 from sklearn.neighbors import LocalOutlierFactor
+from joblib import Parallel, delayed
 
 # Thêm đoạn này
 
@@ -16,6 +18,9 @@ from pyod.models.ecod import ECOD
 from pyod.models.copod import COPOD
 from pyod.models.knn import KNN
 
+from .feature_matrix import FeatureMatrix, build_feature_matrix
+from .result_store import CAUSES_ATTR, LOWER_IS_WORSE, RowCauses
+
 # ---------- utils ----------
 def _infer_timestamp_col(df: pd.DataFrame, user_col: Optional[str] = None) -> Optional[str]:
     if user_col and user_col in df.columns:
@@ -44,6 +49,50 @@ def _mk_result_df(
         return pd.DataFrame(columns=["row_index","timestamp","column","value","score","method"])
     return pd.DataFrame(rows, columns=["row_index","timestamp","column","value","score","method"])
 
+def _mk_cell_result_df(
+    df: pd.DataFrame,
+    cols: List[str],
+    pos: np.ndarray,
+    col_idx: np.ndarray,
+    values: np.ndarray,
+    scores: np.ndarray,
+    ts_col: Optional[str],
+    method: str,
+) -> pd.DataFrame:
+    """
+    Bản vectorized của _mk_result_df cho detector column-level:
+    pos / col_idx là vị trí dòng / cột của các ô bị gắn cờ (không lặp từng dòng).
+    """
+    if len(pos) == 0:
+        return _mk_result_df([])
+    ts = df[ts_col].to_numpy()[pos] if (ts_col and ts_col in df.columns) else None
+    return pd.DataFrame({
+        "row_index": df.index.to_numpy()[pos].astype(int),
+        "timestamp": ts,
+        "column": np.asarray(cols, dtype=object)[col_idx],
+        "value": values,
+        "score": scores.astype(float),
+        "method": method,
+    })
+
+def _iqr_bounds(q1, q3, factor: float = 1.5):
+    """
+    Biên dưới/trên theo IQR (dùng chung cho IQR global, IQR theo cửa sổ...).
+    Nếu IQR = 0 thì biên chính là Q1/Q3. Nhận scalar hoặc np.ndarray.
+    """
+    iqr = np.subtract(q3, q1)
+    lower = np.where(iqr == 0, q1, q1 - factor * iqr)
+    upper = np.where(iqr == 0, q3, q3 + factor * iqr)
+    if np.ndim(lower) == 0:
+        return float(lower), float(upper)
+    return lower, upper
+
+def _concat_results(parts: List[pd.DataFrame]) -> pd.DataFrame:
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return _mk_result_df([])
+    return pd.concat(parts, ignore_index=True)
+
 # ---------- Detector 1: IQR (điểm/column-level) ----------
 def detect_outliers_iqr(
     df: pd.DataFrame,
@@ -53,30 +102,21 @@ def detect_outliers_iqr(
 ) -> pd.DataFrame:
     cols = _numeric_columns(df, columns)
     ts_col = _infer_timestamp_col(df, timestamp_col)
-    rows: List[Tuple[int, Optional[object], str, object, float, str]] = []
+    parts: List[pd.DataFrame] = []
 
-    for col in cols:
+    for j, col in enumerate(cols):
         q1 = df[col].quantile(0.25)
         q3 = df[col].quantile(0.75)
-        iqr = q3 - q1
-        if pd.isna(iqr):
+        if pd.isna(q3 - q1):
             continue
-        lower = q1 if iqr == 0 else q1 - factor * iqr
-        upper = q3 if iqr == 0 else q3 + factor * iqr
-        mask = (df[col] < lower) | (df[col] > upper)
-        if mask.any():
-            for idx in df.index[mask]:
-                ts = df.loc[idx, ts_col] if (ts_col and ts_col in df.columns) else None
-                val = df.loc[idx, col]
-                # score = độ lệch biên (xa biên -> lớn hơn)
-                if val < lower:
-                    score = float(lower - val)
-                elif val > upper:
-                    score = float(val - upper)
-                else:
-                    score = 0.0
-                rows.append((int(idx), ts, col, val, score, "IQR"))
-    return _mk_result_df(rows)
+        lower, upper = _iqr_bounds(q1, q3, factor)
+        pos = np.flatnonzero(((df[col] < lower) | (df[col] > upper)).to_numpy())
+        if len(pos):
+            val = df[col].to_numpy()[pos]
+            # score = độ lệch biên (xa biên -> lớn hơn)
+            score = np.where(val < lower, lower - val, val - upper)
+            parts.append(_mk_cell_result_df(df, cols, pos, np.full(len(pos), j), val, score, ts_col, "IQR"))
+    return _concat_results(parts)
 
 # ---------- Detector 2: Z-score (điểm/column-level) ----------
 def detect_outliers_zscore(
@@ -88,22 +128,21 @@ def detect_outliers_zscore(
 ) -> pd.DataFrame:
     cols = _numeric_columns(df, columns)
     ts_col = _infer_timestamp_col(df, timestamp_col)
-    rows: List[Tuple[int, Optional[object], str, object, float, str]] = []
+    parts: List[pd.DataFrame] = []
 
-    for col in cols:
+    for j, col in enumerate(cols):
         series = df[col].astype(float)
         mu, sigma = series.mean(), series.std(ddof=ddof)
         if sigma == 0 or np.isnan(sigma):
             continue
-        zscores = (series - mu) / sigma
-        mask = zscores.abs() > z
-        if mask.any():
-            for idx in df.index[mask]:
-                ts = df.loc[idx, ts_col] if (ts_col and ts_col in df.columns) else None
-                val = df.loc[idx, col]
-                score = float(zscores.loc[idx])
-                rows.append((int(idx), ts, col, val, score, "Z-SCORE"))
-    return _mk_result_df(rows)
+        zscores = ((series - mu) / sigma).to_numpy()
+        pos = np.flatnonzero(np.abs(zscores) > z)
+        if len(pos):
+            val = df[col].to_numpy()[pos]
+            parts.append(_mk_cell_result_df(
+                df, cols, pos, np.full(len(pos), j), val, zscores[pos], ts_col, "Z-SCORE"
+            ))
+    return _concat_results(parts)
 
 # ---------- Detector: Modified Z-score (column-level) ----------
 def detect_outliers_modified_zscore(
@@ -122,9 +161,9 @@ def detect_outliers_modified_zscore(
         return _mk_result_df([])
 
     ts_col = _infer_timestamp_col(df, timestamp_col)
-    rows: List[Tuple[int, Optional[object], str, object, float, str]] = []
+    parts: List[pd.DataFrame] = []
 
-    for col in cols:
+    for j, col in enumerate(cols):
         series = df[col].astype(float)
 
         median = series.median()
@@ -134,23 +173,352 @@ def detect_outliers_modified_zscore(
             continue
 
         # Modified Z-score
-        mz = 0.6745 * (series - median) / (mad + 1e-9)
-        mz_abs = mz.abs()
-        mask = mz_abs > threshold
-
-        for idx in series[mask].index:
-            ts = (
-                df.loc[idx, ts_col]
-                if ts_col and ts_col in df.columns
-                else None
-            )
-            val = df.loc[idx, col]
-            score = float(mz_abs.loc[idx])
-            rows.append((int(idx), ts, col, val, score, "MOD_Z"))
-
-    return _mk_result_df(rows)
+        mz_abs = (0.6745 * (series - median) / (mad + 1e-9)).abs().to_numpy()
+        pos = np.flatnonzero(mz_abs > threshold)
+        if len(pos):
+            val = df[col].to_numpy()[pos]
+            parts.append(_mk_cell_result_df(
+                df, cols, pos, np.full(len(pos), j), val, mz_abs[pos], ts_col, "MOD_Z"
+            ))
+
+    return _concat_results(parts)
+
+# ---------- Detector: windowed / time-local (column-level) ----------
+def _sorted_time_positions(df: pd.DataFrame, ts_col: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Trả về (order, t_ns): vị trí dòng gốc theo thứ tự thời gian (bỏ NaT)
+    và thời gian tương ứng dạng int64 nano-giây.
+    """
+    ts = df[ts_col]
+    if not pd.api.types.is_datetime64_any_dtype(ts):
+        ts = pd.to_datetime(ts, errors="coerce")
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert(None)
+    ts_vals = ts.to_numpy(dtype="datetime64[ns]")
+
+    valid = np.flatnonzero(~np.isnat(ts_vals))
+    order = valid[np.argsort(ts_vals[valid], kind="stable")]
+    return order, ts_vals[order].view(np.int64)
+
+
+def _window_quantiles(
+    t_ns: np.ndarray,
+    x: np.ndarray,
+    qs: Tuple[float, ...],
+    window_ns: int,
+    step_ns: int,
+    center: bool,
+    min_periods: int,
+    max_cells: int = 8_000_000,
+) -> np.ndarray:
+    """
+    Quantile theo cửa sổ thời gian, tính theo kiểu "hopping window":
+    trục thời gian chia thành các khối dài `step_ns`; mỗi khối dùng chung ngưỡng
+    tính trên cửa sổ `window_ns` bao quanh khối.
+
+    Các cửa sổ được gom thành ma trận (n_khối, L) bằng fancy-index trên mảng đã
+    sắp xếp (cửa sổ ngắn hơn L được đệm NaN), rồi np.sort theo trục 1 —
+    không có vòng lặp Python theo dòng. Chi phí ~ n * window / step phần tử.
+
+    Trả về mảng (len(qs), n) — ngưỡng cho từng dòng (theo thứ tự của t_ns).
+    """
+    n = len(t_ns)
+    out = np.full((len(qs), n), np.nan)
+    if n == 0:
+        return out
+
+    t0 = t_ns[0]
+    block = (t_ns - t0) // step_ns
+    n_blocks = int(block[-1]) + 1
+    b_start = t0 + np.arange(n_blocks, dtype=np.int64) * step_ns
+    if center:
+        lo = b_start + step_ns // 2 - window_ns // 2
+    else:
+        lo = b_start + step_ns - window_ns
+    hi = lo + window_ns
+    w_start = np.searchsorted(t_ns, lo, side="left")
+    w_len = np.searchsorted(t_ns, hi, side="left") - w_start
+
+    L = max(int(w_len.max()), 1)
+    per_chunk = max(1, max_cells // L)
+    offs = np.arange(L)
+    q_blocks = np.full((len(qs), n_blocks), np.nan)
+
+    for b0 in range(0, n_blocks, per_chunk):
+        sl = slice(b0, b0 + per_chunk)
+        idx = np.minimum(w_start[sl, None] + offs, n - 1)
+        vals = x[idx]
+        vals[offs >= w_len[sl, None]] = np.nan
+        vals.sort(axis=1)                      # NaN dồn về cuối
+        m = np.count_nonzero(~np.isnan(vals), axis=1)
+        ok = m >= max(min_periods, 1)
+        for k, q in enumerate(qs):
+            pos = q * (np.maximum(m, 1) - 1)
+            i_lo = np.floor(pos).astype(np.int64)
+            i_hi = np.minimum(i_lo + 1, np.maximum(m - 1, 0))
+            v_lo = np.take_along_axis(vals, i_lo[:, None], axis=1)[:, 0]
+            v_hi = np.take_along_axis(vals, i_hi[:, None], axis=1)[:, 0]
+            qv = v_lo + (pos - i_lo) * (v_hi - v_lo)
+            q_blocks[k, sl] = np.where(ok, qv, np.nan)
+
+    return q_blocks[:, block]
+
+
+def _window_quartiles_blocks(
+    df: pd.DataFrame,
+    cols: List[str],
+    ts_col: str,
+    window: str,
+    step: Optional[str],
+    min_periods: int,
+    center: bool,
+):
+    """
+    Yield (order, j, x, q1, med, q3) cho từng cột j: x đã sắp theo thời gian,
+    order là vị trí dòng gốc tương ứng.
+    """
+    order, t_ns = _sorted_time_positions(df, ts_col)
+    if len(order) == 0:
+        return
+    window_ns = int(pd.Timedelta(window).value)
+    step_ns = int(pd.Timedelta(step).value) if step else max(window_ns // 4, 1)
+
+    for j, col in enumerate(cols):
+        x = df[col].to_numpy(dtype=float, na_value=np.nan)[order]
+        q1, med, q3 = _window_quantiles(
+            t_ns, x, (0.25, 0.5, 0.75), window_ns, step_ns, center, min_periods
+        )
+        yield order, j, x, q1, med, q3
+
+
+def detect_outliers_iqr_window(
+    df: pd.DataFrame,
+    columns: Optional[List[str]] = None,
+    window: str = "1h",
+    factor: float = 1.5,
+    timestamp_col: Optional[str] = None,
+    step: Optional[str] = None,
+    min_periods: int = 10,
+    center: bool = True,
+) -> pd.DataFrame:
+    """
+    IQR cục bộ theo thời gian: Q1/Q3 tính trên cửa sổ `window` (vd "1h") quanh
+    mỗi điểm thay vì trên toàn bộ lịch sử, nên các đoạn thay đổi tải
+    (NET MW lên/xuống) không bị gắn cờ cả đoạn.
+    Ngưỡng được cập nhật mỗi `step` (mặc định window/4).
+    Trả về DF:
+        row_index | timestamp | column | value | score | method = "ROLL_IQR"
+    """
+    cols = _numeric_columns(df, columns)
+    if not cols:
+        return _mk_result_df([])
+
+    ts_col = _infer_timestamp_col(df, timestamp_col)
+    if ts_col is None:
+        raise ValueError("Detector theo cửa sổ thời gian cần cột Datetime.")
+
+    parts: List[pd.DataFrame] = []
+    for order, j, x, q1, _, q3 in _window_quartiles_blocks(
+        df, cols, ts_col, window, step, min_periods, center
+    ):
+        lower, upper = _iqr_bounds(q1, q3, factor)
+        with np.errstate(invalid="ignore"):
+            low = x < lower
+            high = x > upper
+        ri = np.flatnonzero(low | high)
+        # score = độ lệch biên (xa biên -> lớn hơn)
+        score = np.where(low[ri], lower[ri] - x[ri], x[ri] - upper[ri])
+        parts.append(_mk_cell_result_df(
+            df, cols, order[ri], np.full(len(ri), j), x[ri], score, ts_col, "ROLL_IQR"
+        ))
+
+    return _concat_results(parts)
+
+
+def detect_outliers_robust_z_window(
+    df: pd.DataFrame,
+    columns: Optional[List[str]] = None,
+    window: str = "1h",
+    threshold: float = 3.5,
+    timestamp_col: Optional[str] = None,
+    step: Optional[str] = None,
+    min_periods: int = 10,
+    center: bool = True,
+) -> pd.DataFrame:
+    """
+    Robust z-score cục bộ theo thời gian: (x - rolling median) / sigma,
+    với sigma = rolling IQR / 1.349 (ước lượng robust, tương đương MAD / 0.6745
+    với phân phối chuẩn) nên cùng ngưỡng 3.5 như Modified Z-score.
+    Trả về DF:
+        row_index | timestamp | column | value | score | method = "ROLL_RZ"
+    """
+    cols = _numeric_columns(df, columns)
+    if not cols:
+        return _mk_result_df([])
+
+    ts_col = _infer_timestamp_col(df, timestamp_col)
+    if ts_col is None:
+        raise ValueError("Detector theo cửa sổ thời gian cần cột Datetime.")
+
+    parts: List[pd.DataFrame] = []
+    for order, j, x, q1, med, q3 in _window_quartiles_blocks(
+        df, cols, ts_col, window, step, min_periods, center
+    ):
+        sigma = (q3 - q1) / 1.349
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rz_abs = np.abs(x - med) / sigma
+        # sigma = 0 (đoạn phẳng) hoặc thiếu dữ liệu -> không kết luận
+        rz_abs[~(sigma > 0)] = np.nan
+        with np.errstate(invalid="ignore"):
+            ri = np.flatnonzero(rz_abs > threshold)
+        parts.append(_mk_cell_result_df(
+            df, cols, order[ri], np.full(len(ri), j), x[ri], rz_abs[ri], ts_col, "ROLL_RZ"
+        ))
+
+    return _concat_results(parts)
+
+# ---------- Row-level helpers (dùng chung FeatureMatrix) ----------
+def _resolve_feature_matrix(
+    df: pd.DataFrame,
+    columns: Optional[List[str]],
+    fm: Optional[FeatureMatrix],
+) -> FeatureMatrix:
+    """
+    Dùng FeatureMatrix được truyền vào (zero-copy, chia sẻ giữa các detector), thu về
+    đúng `columns` nếu có chỉ định (ValueError nếu fm thiếu cột);
+    nếu không có thì tạo tạm một ma trận float64 giữ nguyên NaN như df[cols].astype(float).
+    """
+    if fm is not None:
+        return fm.select(_numeric_columns(df, columns)) if columns else fm
+    return build_feature_matrix(df, _numeric_columns(df, columns), dtype="float64", nan_policy="keep")
+
+
+def _explain_rows(
+    fm: FeatureMatrix,
+    sel: np.ndarray,
+    topk: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Giải thích đa-biến bằng robust-z (top-k) cho các dòng fm.X[sel], vector hoá:
+        rz = |x - median| / (1.4826 * MAD + eps)
+    median / MAD lấy từ fm.robust_stats() (tính một lần cho mọi detector dùng chung fm).
+    Trả về (feat_idx, values, rz) — mỗi mảng shape (len(sel), k).
+    """
+    eps = 1e-9
+    X = fm.X
+    med, mad = fm.robust_stats()
+    scale = 1.4826 * mad + eps
+
+    Xs = X[sel].astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rz = np.abs((Xs - med) / scale)
+    rz[~np.isfinite(rz)] = 0.0
+
+    k = min(max(1, topk), X.shape[1])
+    # stable argsort theo -rz: trùng giá trị thì lấy cột đứng trước (như Series.nlargest)
+    feat_idx = np.argsort(-rz, axis=1, kind="stable")[:, :k]
+    return (
+        feat_idx,
+        np.take_along_axis(Xs, feat_idx, axis=1),
+        np.take_along_axis(rz, feat_idx, axis=1),
+    )
+
+
+def _mk_row_result_df(
+    df: pd.DataFrame,
+    fm: FeatureMatrix,
+    sel: np.ndarray,
+    scores: np.ndarray,
+    method: str,
+    ts_col: Optional[str],
+    topk: Optional[int] = 3,
+    return_json: bool = False,
+) -> pd.DataFrame:
+    """
+    Dựng DF kết quả row-level cho các dòng sel (vị trí trong fm.X):
+        row_index | timestamp | column="<row>" | value=None | score | method | (optional) causes, causes_json
+    Giải thích top-k được gắn dạng mảng ở out.attrs[CAUSES_ATTR] (RowCauses, OutlierResultStore
+    đọc thẳng); return_json=True mới dựng thêm cột causes / causes_json từng dòng (export).
+    topk=None -> không tính giải thích.
+    """
+    if len(sel) == 0:
+        return _mk_result_df([])
+
+    pos = fm.row_pos[sel]
+    out = pd.DataFrame({
+        "row_index": fm.row_index[sel].astype(int),
+        "timestamp": df[ts_col].to_numpy()[pos] if (ts_col and ts_col in df.columns) else None,
+        "column": "<row>",
+        "value": None,
+        "score": np.asarray(scores, dtype=float)[sel],
+        "method": method,
+    })
+    if topk is None:
+        return out
+
+    feat_idx, vals, rz = _explain_rows(fm, sel, topk)
+    out.attrs[CAUSES_ATTR] = RowCauses(
+        row_index=out["row_index"].to_numpy(), features=list(fm.columns),
+        feature=feat_idx, value=vals, rz=rz,
+    )
+    if not return_json:
+        return out
+
+    names = np.asarray(fm.columns, dtype=object)[feat_idx]
+    causes_col: List[str] = []
+    causes_json_col: List[List[Dict[str, Any]]] = []
+    for feats, vs, rs in zip(names, vals.tolist(), rz.tolist()):
+        causes_list = [
+            {"feature": f, "value": float(v), "robust_z": float(r)}
+            for f, v, r in zip(feats, vs, rs)
+        ]
+        # chuỗi gọn cho hiển thị
+        causes_col.append(", ".join(
+            f"{c['feature']}={c['value']:.6g} (|rz|={c['robust_z']:.2f})"
+            for c in causes_list
+        ))
+        causes_json_col.append(causes_list)
+
+    out["causes"] = causes_col
+    out["causes_json"] = causes_json_col
+    return out
 
 # ---------- Detector 3: IsolationForest (hàng/row-level) ----------
+def _score_chunk(score_fn, X_chunk: np.ndarray) -> np.ndarray:
+    return score_fn(X_chunk)
+
+
+def _score_in_chunks(
+    model,
+    X: np.ndarray,
+    chunk_size: int,
+    n_jobs: int = -1,
+) -> Tuple[np.ndarray, float]:
+    """
+    Gọi model.decision_function theo từng chunk cố định (song song nhiều process
+    qua joblib), ghi dần kết quả vào một mảng cấp phát sẵn.
+    Trả về (scores, throughput rows/s).
+    """
+    n = len(X)
+    scores = np.empty(n, dtype=np.float64)
+    bounds = [(s, min(s + chunk_size, n)) for s in range(0, n, max(1, chunk_size))]
+
+    t0 = time.perf_counter()
+    if n_jobs == 1 or len(bounds) <= 1:
+        for s, e in bounds:
+            scores[s:e] = model.decision_function(X[s:e])
+    else:
+        # mỗi worker chấm 1 chunk bằng 1 luồng -> tránh oversubscription
+        model.set_params(n_jobs=1)
+        results = Parallel(n_jobs=n_jobs, return_as="generator")(
+            delayed(_score_chunk)(model.decision_function, X[s:e]) for s, e in bounds
+        )
+        for (s, e), part in zip(bounds, results):
+            scores[s:e] = part
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    return scores, n / elapsed
+
+
 def detect_outliers_isoforest(
     df: pd.DataFrame,
     columns: Optional[List[str]] = None,
@@ -159,76 +527,60 @@ def detect_outliers_isoforest(
     timestamp_col: Optional[str] = None,
     n_estimators: int = 200,
     topk: int = 3,                  # NEW: số biến giải thích
-    return_json: bool = True        # NEW: thêm cột causes_json
+    return_json: bool = True,       # thêm cột causes / causes_json; False: chỉ mảng ở attrs
+    fm: Optional[FeatureMatrix] = None,
+    max_samples="auto",
+    fit_rows: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    n_jobs: int = -1,
 ) -> pd.DataFrame:
     """
     Phát hiện outlier bằng IsolationForest và giải thích đa-biến bằng robust-z (top-k).
+    fm: FeatureMatrix dùng chung (xem feature_matrix.get_feature_matrix); None -> tự tạo.
+
+    Chế độ giới hạn bộ nhớ (dữ liệu lớn):
+    - max_samples: số mẫu cho mỗi cây (truyền thẳng cho IsolationForest)
+    - fit_rows   : chỉ fit (và ước lượng ngưỡng contamination) trên một mẫu ngẫu nhiên
+                   fit_rows dòng thay vì toàn bộ ma trận
+    - chunk_size : chấm điểm toàn bộ dữ liệu theo từng chunk, song song n_jobs process;
+                   tốc độ (rows/s) được ghi vào out.attrs["rows_per_sec"]
+
     Trả về DataFrame có các cột:
-    row_index | timestamp | column | value | score | method | causes | (optional) causes_json
+    row_index | timestamp | column | value | score | method | (optional) causes, causes_json
+    Giải thích top-k dạng mảng ở out.attrs["causes"] (RowCauses).
     """
-    cols = _numeric_columns(df, columns)
-    if not cols:
+    fm = _resolve_feature_matrix(df, columns, fm)
+    if not fm.columns:
         return _mk_result_df([])
 
     ts_col = _infer_timestamp_col(df, timestamp_col)
-    X = df[cols].astype(float)
+    X = fm.X
 
     iso = IsolationForest(
         contamination=contamination,
         random_state=random_state,
         n_estimators=n_estimators,
-        n_jobs=-1
+        max_samples=max_samples,
+        n_jobs=n_jobs
     )
-    pred = iso.fit_predict(X)            # 1 bình thường, -1 outlier
-    scores = iso.decision_function(X)    # càng nhỏ càng bất thường
-
-    # --- robust center & scale cho giải thích ---
-    med = X.median(axis=0)
-    mad = (X - med).abs().median(axis=0)
-    eps = 1e-9
-    scale = 1.4826 * mad + eps
-
-    rows: List[Tuple[int, Optional[object], str, object, float, str]] = []
-    causes_col: List[str] = []
-    causes_json_col: List[List[Dict[str, Any]]] = []
-
-    mask = (pred == -1)
-    if mask.any():
-        for idx in df.index[mask]:
-            ts = df.loc[idx, ts_col] if (ts_col and ts_col in df.columns) else None
-            i = df.index.get_loc(idx)
-
-            # robust-z từng biến cho dòng outlier
-            x = X.loc[idx, cols]
-            rz = ((x - med) / scale).abs()
-            rz = rz.replace([np.inf, -np.inf], np.nan).fillna(0.0)
-
-            # chọn top-k biến
-            top = rz.nlargest(max(1, topk))
-            causes_list = []
-            for feat in top.index:
-                causes_list.append({
-                    "feature": feat,
-                    "value": float(x[feat]),
-                    "robust_z": float(top[feat])
-                })
-
-            # chuỗi gọn cho hiển thị
-            causes_str = ", ".join(
-                f"{c['feature']}={c['value']:.6g} (|rz|={c['robust_z']:.2f})"
-                for c in causes_list
-            )
-
-            rows.append((int(idx), ts, "<row>", None, float(scores[i]), "ISOFOR"))
-            causes_col.append(causes_str)
-            causes_json_col.append(causes_list)
-
-    out = _mk_result_df(rows)
-    if not out.empty:
-        out = out.reset_index(drop=True)
-        out["causes"] = causes_col
-        if return_json:
-            out["causes_json"] = causes_json_col
+    rows_per_sec = None
+    if fit_rows is None and chunk_size is None:
+        pred = iso.fit_predict(X)            # 1 bình thường, -1 outlier
+        scores = iso.decision_function(X)    # càng nhỏ càng bất thường
+    else:
+        if fit_rows is not None and fit_rows < len(X):
+            rng = np.random.default_rng(random_state)
+            X_fit = X[np.sort(rng.choice(len(X), size=fit_rows, replace=False))]
+        else:
+            X_fit = X
+        iso.fit(X_fit)
+        scores, rows_per_sec = _score_in_chunks(iso, X, chunk_size or len(X), n_jobs)
+        pred = np.where(scores < 0, -1, 1)
+
+    sel = np.flatnonzero(pred == -1)
+    out = _mk_row_result_df(df, fm, sel, scores, "ISOFOR", ts_col, topk, return_json)
+    if rows_per_sec is not None:
+        out.attrs["rows_per_sec"] = rows_per_sec
     return out
 
 # ---------- Detector 4: LOF ----------
@@ -237,25 +589,20 @@ def detect_outliers_lof(
     columns=None,
     n_neighbors=20,
     contamination=0.05,
-    timestamp_col=None
+    timestamp_col=None,
+    fm: Optional[FeatureMatrix] = None,
 ):
-    cols = columns or df.select_dtypes(include='number').columns
-    if not len(cols):
+    fm = _resolve_feature_matrix(df, columns, fm)
+    if not fm.columns:
         return pd.DataFrame(columns=["row_index","timestamp","column","value","score","method"])
 
     ts_col = _infer_timestamp_col(df, timestamp_col)
-    X = df[cols].astype(float)
     lof = LocalOutlierFactor(n_neighbors=n_neighbors, contamination=contamination)
-    pred = lof.fit_predict(X)   # -1 là outlier
+    pred = lof.fit_predict(fm.X)   # -1 là outlier
     scores = lof.negative_outlier_factor_
 
-    rows = []
-    for idx, label in zip(df.index, pred):
-        if label == -1:  # chỉ lấy outlier
-            ts = df.loc[idx, ts_col] if ts_col and ts_col in df.columns else None
-            score = float(scores[df.index.get_loc(idx)])
-            rows.append((int(idx), ts, "<row>", None, score, "LOF"))
-    return _mk_result_df(rows)
+    sel = np.flatnonzero(pred == -1)  # chỉ lấy outlier
+    return _mk_row_result_df(df, fm, sel, scores, "LOF", ts_col, topk=None)
 
 def combine_outlier_results(
     df_iqr: pd.DataFrame,
@@ -314,85 +661,230 @@ def combine_outlier_results(
 
     return df_comb
 
-# ---------- Detector: ECOD (row-level) ----------
-def detect_outliers_ecod(
-    df: pd.DataFrame,
-    columns: Optional[List[str]] = None,
-    contamination: float = 0.05,
-    timestamp_col: Optional[str] = None,
-    topk: int = 3,
-    return_json: bool = True,
-) -> pd.DataFrame:
+# ---------- Ensemble N detector (bitset) ----------
+# Các method mà score càng NHỎ càng bất thường (định nghĩa chung ở result_store)
+_LOWER_IS_WORSE = LOWER_IS_WORSE
+
+
+def _score_severity(df: pd.DataFrame) -> np.ndarray:
     """
-    ECOD (Energy-based Outlier Detection) từ PyOD.
-    + Hoạt động theo row-level giống IsolationForest.
-    + Giải thích top-k feature đẩy row thành outlier bằng robust-z.
+    Đưa score của mọi detector về cùng chiều: càng lớn càng bất thường.
+    (Z-score có dấu -> lấy trị tuyệt đối; ISOFOR/LOF -> đổi dấu.)
     """
+    score = pd.to_numeric(df["score"], errors="coerce").to_numpy(dtype=float)
+    lower = df["method"].isin(_LOWER_IS_WORSE).to_numpy()
+    return np.where(lower, -score, np.abs(score))
 
-    cols = _numeric_columns(df, columns)
-    if not cols:
-        return _mk_result_df([])
 
-    ts_col = _infer_timestamp_col(df, timestamp_col)
-    X = df[cols].astype(float)
+def _popcount64(bits: np.ndarray) -> np.ndarray:
+    """Đếm số bit 1 của mảng uint64 (số detector gắn cờ cho mỗi key)."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).astype(np.int64)
+    return np.unpackbits(bits.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
 
-    model = ECOD(contamination=contamination)
-    model.fit(X)
 
-    labels = model.labels_           # 1 = outlier, 0 = normal
-    scores = model.decision_scores_  # càng lớn càng bất thường
+def _is_row_level(df: pd.DataFrame) -> bool:
+    return bool((df["column"] == "<row>").all())
 
-    # robust center + scale cho giải thích
-    med = X.median(axis=0)
-    mad = (X - med).abs().median(axis=0)
-    eps = 1e-9
-    scale = 1.4826 * mad + eps
 
-    rows: List[Tuple[int, Optional[object], str, object, float, str]] = []
-    causes_col: List[str] = []
-    causes_json_col: List[List[Dict[str, Any]]] = []
+def combine_outlier_ensemble(
+    results: Dict[str, Optional[pd.DataFrame]],
+    how: str = "vote",
+    k: int = 2,
+    weights: Optional[Dict[str, float]] = None,
+    level: str = "cell",
+) -> pd.DataFrame:
+    """
+    Kết hợp kết quả của N detector (cả column-level lẫn row-level).
 
-    for idx, label in zip(df.index, labels):
-        if label != 1:
-            continue
+    Mỗi key (row_index hoặc ô (row_index, column)) được mã hoá thành một bitset
+    uint64 — bit d bật nếu detector thứ d gắn cờ key đó — nên mọi phép kết hợp
+    chỉ là thao tác vector trên mảng (np.unique / searchsorted / popcount),
+    không merge DataFrame.
 
-        ts = df.loc[idx, ts_col] if ts_col and ts_col in df.columns else None
-        i = df.index.get_loc(idx)
-
-        x = X.loc[idx, cols]
-        rz = ((x - med) / scale).abs()
-        rz = rz.replace([np.inf, -np.inf], np.nan).fillna(0.0)
-
-        top = rz.nlargest(max(1, topk))
-        causes_list: List[Dict[str, Any]] = []
-        for feat in top.index:
-            causes_list.append(
-                {
-                    "feature": feat,
-                    "value": float(x[feat]),
-                    "robust_z": float(top[feat]),
-                }
-            )
-
-        causes_str = ", ".join(
-            f"{c['feature']}={c['value']:.6g} (|rz|={c['robust_z']:.2f})"
-            for c in causes_list
-        )
+    - level = 'cell': key = (row_index, column) của các detector column-level;
+      detector row-level "bỏ phiếu" cho mọi ô thuộc dòng nó gắn cờ; dòng chỉ detector
+      row-level gắn cờ có key (row_index, "<row>").
+    - level = 'row' : key = row_index (ô bị gắn cờ được gộp về dòng).
 
-        rows.append((int(idx), ts, "<row>", None, float(scores[i]), "ECOD"))
-        causes_col.append(causes_str)
-        causes_json_col.append(causes_list)
+    - how = 'intersection': tất cả detector cùng gắn cờ
+    - how = 'union'       : ít nhất một detector
+    - how = 'vote'        : ít nhất k / N detector
+    - how = 'rank'        : giữ hợp, sắp theo score = trung bình có trọng số
+                            của percentile-rank severity ở từng detector
+
+    Trả về DF:
+        row_index | timestamp | column | value | score | method | n_votes | detectors | source
+    (score = điểm rank-average trong [0, 1], càng lớn càng bất thường)
+    """
+    items = [(name, df) for name, df in results.items() if df is not None and not df.empty]
+    empty_cols = ["row_index", "timestamp", "column", "value", "score", "method",
+                  "n_votes", "detectors", "source"]
+    if not items:
+        return pd.DataFrame(columns=empty_cols)
+    if len(items) > 64:
+        raise ValueError("combine_outlier_ensemble hỗ trợ tối đa 64 detector.")
+    if how not in ("intersection", "union", "vote", "rank"):
+        raise ValueError("how must be 'intersection', 'union', 'vote' or 'rank'")
+    if level not in ("cell", "row"):
+        raise ValueError("level must be 'cell' or 'row'")
+
+    names = [name for name, _ in items]
+    n_det = len(items)
+    w = np.array([(weights or {}).get(name, 1.0) for name in names], dtype=float)
+    row_level = [_is_row_level(df) for _, df in items]
+    if level == "cell" and all(row_level):
+        level = "row"
+
+    # detector "có key" (tạo universe) và detector row-level phát tán về ô
+    keyed = [d for d in range(n_det) if level == "row" or not row_level[d]]
+    spread = [d for d in range(n_det) if d not in keyed]
+    src_cols = ["row_index", "timestamp", "column"] + (["value"] if level == "cell" else [])
+    parts = [items[d][1][src_cols] for d in keyed]
+    if spread:
+        # dòng chỉ detector row-level gắn cờ (không ô nào của nó có trong universe)
+        # -> thêm key (row_index, "<row>") để union / vote không làm mất dòng đó
+        flagged = pd.concat([items[d][1][["row_index", "timestamp"]] for d in spread], ignore_index=True)
+        flagged = flagged.drop_duplicates("row_index")
+        cell_rows = np.concatenate([p["row_index"].to_numpy(dtype=np.int64) for p in parts])
+        orphan = flagged[~np.isin(flagged["row_index"].to_numpy(dtype=np.int64), cell_rows)]
+        if len(orphan):
+            parts.append(orphan.assign(column="<row>", value=np.nan)[src_cols])
+    src = pd.concat(parts, ignore_index=True)
+
+    # --- mã hoá key ---
+    rows_all = src["row_index"].to_numpy(dtype=np.int64)
+    if level == "cell":
+        col_codes, col_names = pd.factorize(src["column"])
+        n_cols = max(len(col_names), 1)
+        src_keys = rows_all * n_cols + col_codes
+    else:
+        n_cols = 1
+        src_keys = rows_all
+
+    universe, first, inv = np.unique(src_keys, return_index=True, return_inverse=True)
+    u_rows = universe // n_cols
+
+    def pct_rank(df: pd.DataFrame) -> np.ndarray:
+        # percentile-rank severity trong chính detector đó (NaN -> thấp nhất)
+        sev = _score_severity(df)
+        sev = np.where(np.isnan(sev), -np.inf, sev)
+        pct = np.empty(len(sev))
+        pct[np.argsort(sev, kind="stable")] = np.arange(1, len(sev) + 1) / len(sev)
+        return pct
+
+    # --- bitset + rank score ---
+    bits = np.zeros(len(universe), dtype=np.uint64)
+    rank_sum = np.zeros(len(universe), dtype=float)
+    offset = 0
+    for d in keyed:
+        df = items[d][1]
+        pos = inv[offset:offset + len(df)]
+        offset += len(df)
+        bits[pos] |= np.uint64(1 << d)
+        best = np.zeros(len(universe))
+        np.maximum.at(best, pos, pct_rank(df))
+        rank_sum += w[d] * best
+
+    for d in spread:
+        # detector row-level "bỏ phiếu" cho mọi ô của dòng nó gắn cờ
+        df = items[d][1]
+        r_uni, r_inv = np.unique(df["row_index"].to_numpy(dtype=np.int64), return_inverse=True)
+        r_pct = np.zeros(len(r_uni))
+        np.maximum.at(r_pct, r_inv, pct_rank(df))
+        pos = np.minimum(np.searchsorted(r_uni, u_rows), len(r_uni) - 1)
+        hit = r_uni[pos] == u_rows
+        bits[hit] |= np.uint64(1 << d)
+        rank_sum[hit] += w[d] * r_pct[pos[hit]]
+
+    votes = _popcount64(bits)
+    score = rank_sum / w.sum()
+
+    if how == "intersection":
+        keep = votes == n_det
+        source = " ∩ ".join(names)
+    elif how == "union":
+        keep = votes >= 1
+        source = " ∪ ".join(names)
+    elif how == "vote":
+        keep = votes >= k
+        source = f"≥{k}/{n_det}: " + ", ".join(names)
+    else:
+        keep = votes >= 1
+        source = "rank-avg: " + ", ".join(names)
+
+    sel = np.flatnonzero(keep)
+    if how == "rank":
+        sel = sel[np.argsort(-score[sel], kind="stable")]
+    if len(sel) == 0:
+        return pd.DataFrame(columns=empty_cols)
+
+    # --- tên detector theo từng mẫu bitset (số mẫu khác nhau rất ít) ---
+    patterns, inv = np.unique(bits[sel], return_inverse=True)
+    labels = np.array(
+        [", ".join(n for d, n in enumerate(names) if int(p) >> d & 1) for p in patterns],
+        dtype=object,
+    )
 
-    out = _mk_result_df(rows)
-    if not out.empty:
-        out = out.reset_index(drop=True)
-        out["causes"] = causes_col
-        if return_json:
-            out["causes_json"] = causes_json_col
+    rep = src.iloc[first[sel]]
+    out = pd.DataFrame({
+        "row_index": rep["row_index"].to_numpy(dtype=np.int64),
+        "timestamp": rep["timestamp"].to_numpy(),
+        "column": rep["column"].to_numpy() if level == "cell" else "<row>",
+        "value": rep["value"].to_numpy() if level == "cell" else None,
+        "score": score[sel],
+        "method": f"ENSEMBLE-{how.upper()}",
+        "n_votes": votes[sel],
+        "detectors": labels[inv],
+        "source": source,
+    })
     return out
 
+# ---------- Detector: ECOD / COPOD / KNN (row-level, PyOD) ----------
+def _detect_outliers_pyod(
+    df: pd.DataFrame,
+    model,
+    method: str,
+    columns: Optional[List[str]],
+    timestamp_col: Optional[str],
+    topk: int,
+    return_json: bool,
+    fm: Optional[FeatureMatrix],
+) -> pd.DataFrame:
+    fm = _resolve_feature_matrix(df, columns, fm)
+    if not fm.columns:
+        return _mk_result_df([])
+
+    ts_col = _infer_timestamp_col(df, timestamp_col)
+    model.fit(fm.X)
+
+    labels = model.labels_           # 1 = outlier, 0 = normal
+    scores = model.decision_scores_  # càng lớn càng bất thường
+
+    sel = np.flatnonzero(labels == 1)
+    return _mk_row_result_df(df, fm, sel, scores, method, ts_col, topk, return_json)
+
+
+def detect_outliers_ecod(
+    df: pd.DataFrame,
+    columns: Optional[List[str]] = None,
+    contamination: float = 0.05,
+    timestamp_col: Optional[str] = None,
+    topk: int = 3,
+    return_json: bool = True,
+    fm: Optional[FeatureMatrix] = None,
+) -> pd.DataFrame:
+    """
+    ECOD (Energy-based Outlier Detection) từ PyOD.
+    + Hoạt động theo row-level giống IsolationForest.
+    + Giải thích top-k feature đẩy row thành outlier bằng robust-z.
+    """
+    return _detect_outliers_pyod(
+        df, ECOD(contamination=contamination), "ECOD",
+        columns, timestamp_col, topk, return_json, fm,
+    )
+
 
-# ---------- Detector: COPOD (row-level) ----------
 def detect_outliers_copod(
     df: pd.DataFrame,
     columns: Optional[List[str]] = None,
@@ -400,76 +892,18 @@ def detect_outliers_copod(
     timestamp_col: Optional[str] = None,
     topk: int = 3,
     return_json: bool = True,
+    fm: Optional[FeatureMatrix] = None,
 ) -> pd.DataFrame:
     """
     COPOD (Copula-based Outlier Detection) từ PyOD.
     Cũng row-level + giải thích top-k feature giống ECOD.
     """
+    return _detect_outliers_pyod(
+        df, COPOD(contamination=contamination), "COPOD",
+        columns, timestamp_col, topk, return_json, fm,
+    )
 
 
-    cols = _numeric_columns(df, columns)
-    if not cols:
-        return _mk_result_df([])
-
-    ts_col = _infer_timestamp_col(df, timestamp_col)
-    X = df[cols].astype(float)
-
-    model = COPOD(contamination=contamination)
-    model.fit(X)
-
-    labels = model.labels_
-    scores = model.decision_scores_
-
-    med = X.median(axis=0)
-    mad = (X - med).abs().median(axis=0)
-    eps = 1e-9
-    scale = 1.4826 * mad + eps
-
-    rows: List[Tuple[int, Optional[object], str, object, float, str]] = []
-    causes_col: List[str] = []
-    causes_json_col: List[List[Dict[str, Any]]] = []
-
-    for idx, label in zip(df.index, labels):
-        if label != 1:
-            continue
-
-        ts = df.loc[idx, ts_col] if ts_col and ts_col in df.columns else None
-        i = df.index.get_loc(idx)
-
-        x = X.loc[idx, cols]
-        rz = ((x - med) / scale).abs()
-        rz = rz.replace([np.inf, -np.inf], np.nan).fillna(0.0)
-
-        top = rz.nlargest(max(1, topk))
-        causes_list: List[Dict[str, Any]] = []
-        for feat in top.index:
-            causes_list.append(
-                {
-                    "feature": feat,
-                    "value": float(x[feat]),
-                    "robust_z": float(top[feat]),
-                }
-            )
-
-        causes_str = ", ".join(
-            f"{c['feature']}={c['value']:.6g} (|rz|={c['robust_z']:.2f})"
-            for c in causes_list
-        )
-
-        rows.append((int(idx), ts, "<row>", None, float(scores[i]), "COPOD"))
-        causes_col.append(causes_str)
-        causes_json_col.append(causes_list)
-
-    out = _mk_result_df(rows)
-    if not out.empty:
-        out = out.reset_index(drop=True)
-        out["causes"] = causes_col
-        if return_json:
-            out["causes_json"] = causes_json_col
-    return out
-
-
-# ---------- Detector: KNN (row-level) ----------
 def detect_outliers_knn(
     df: pd.DataFrame,
     columns: Optional[List[str]] = None,
@@ -478,73 +912,13 @@ def detect_outliers_knn(
     timestamp_col: Optional[str] = None,
     topk: int = 3,
     return_json: bool = True,
+    fm: Optional[FeatureMatrix] = None,
 ) -> pd.DataFrame:
     """
     KNN detector từ PyOD (distance-based).
     Row-level + giải thích feature giống ECOD/COPOD.
     """
-
-
-    cols = _numeric_columns(df, columns)
-    if not cols:
-        return _mk_result_df([])
-
-    ts_col = _infer_timestamp_col(df, timestamp_col)
-    X = df[cols].astype(float)
-
-    model = KNN(
-        n_neighbors=n_neighbors,
-        contamination=contamination,
+    return _detect_outliers_pyod(
+        df, KNN(n_neighbors=n_neighbors, contamination=contamination), "KNN",
+        columns, timestamp_col, topk, return_json, fm,
     )
-    model.fit(X)
-
-    labels = model.labels_
-    scores = model.decision_scores_
-
-    med = X.median(axis=0)
-    mad = (X - med).abs().median(axis=0)
-    eps = 1e-9
-    scale = 1.4826 * mad + eps
-
-    rows: List[Tuple[int, Optional[object], str, object, float, str]] = []
-    causes_col: List[str] = []
-    causes_json_col: List[List[Dict[str, Any]]] = []
-
-    for idx, label in zip(df.index, labels):
-        if label != 1:
-            continue
-
-        ts = df.loc[idx, ts_col] if ts_col and ts_col in df.columns else None
-        i = df.index.get_loc(idx)
-
-        x = X.loc[idx, cols]
-        rz = ((x - med) / scale).abs()
-        rz = rz.replace([np.inf, -np.inf], np.nan).fillna(0.0)
-
-        top = rz.nlargest(max(1, topk))
-        causes_list: List[Dict[str, Any]] = []
-        for feat in top.index:
-            causes_list.append(
-                {
-                    "feature": feat,
-                    "value": float(x[feat]),
-                    "robust_z": float(top[feat]),
-                }
-            )
-
-        causes_str = ", ".join(
-            f"{c['feature']}={c['value']:.6g} (|rz|={c['robust_z']:.2f})"
-            for c in causes_list
-        )
-
-        rows.append((int(idx), ts, "<row>", None, float(scores[i]), "KNN"))
-        causes_col.append(causes_str)
-        causes_json_col.append(causes_list)
-
-    out = _mk_result_df(rows)
-    if not out.empty:
-        out = out.reset_index(drop=True)
-        out["causes"] = causes_col
-        if return_json:
-            out["causes_json"] = causes_json_col
-    return out
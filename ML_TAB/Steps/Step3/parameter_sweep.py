@@ -0,0 +1,133 @@
+# ML_TAB/Steps/Step3/parameter_sweep.py
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.neighbors import NearestNeighbors
+
+from pyod.models.ecod import ECOD
+from pyod.models.copod import COPOD
+
+from .feature_matrix import FeatureMatrix, build_feature_matrix
+
+
+# ---------- Score một lần cho mỗi detector ----------
+def _knn_scores(dist: np.ndarray, k: int) -> np.ndarray:
+    """KNN (PyOD, method='largest'): khoảng cách tới láng giềng thứ k."""
+    return dist[:, k - 1]
+
+
+def _lof_scores(dist: np.ndarray, ind: np.ndarray, k: int) -> np.ndarray:
+    """
+    LOF với k láng giềng, tính lại từ bảng láng giềng của k_max (cùng công thức sklearn):
+        reach(a, b) = max(k_dist(b), d(a, b))
+        lrd(a)      = 1 / (mean_b reach(a, b) + 1e-10)
+        LOF(a)      = mean_b lrd(b) / lrd(a)
+    """
+    d_k, i_k = dist[:, :k], ind[:, :k]
+    k_dist = d_k[:, -1]
+    reach = np.maximum(k_dist[i_k], d_k)
+    lrd = 1.0 / (reach.mean(axis=1) + 1e-10)
+    return lrd[i_k].mean(axis=1) / lrd
+
+
+def _severity_scores(
+    X: np.ndarray,
+    detectors: Sequence[str],
+    n_neighbors: Sequence[int],
+    random_state: int,
+    n_estimators: int,
+) -> Dict[Tuple[str, Optional[int]], np.ndarray]:
+    """
+    Fit mỗi detector đúng MỘT lần, trả về severity (càng lớn càng bất thường)
+    cho từng cấu hình (detector, n_neighbors).
+    KNN / LOF: tính láng giềng một lần cho k lớn nhất rồi cắt bớt cho các k nhỏ hơn.
+    """
+    out: Dict[Tuple[str, Optional[int]], np.ndarray] = {}
+
+    if "ISOFOR" in detectors:
+        iso = IsolationForest(n_estimators=n_estimators, random_state=random_state, n_jobs=-1)
+        iso.fit(X)
+        out[("ISOFOR", None)] = -iso.score_samples(X)
+
+    for name, cls in (("ECOD", ECOD), ("COPOD", COPOD)):
+        if name in detectors:
+            model = cls()
+            model.fit(X)
+            out[(name, None)] = np.asarray(model.decision_scores_, dtype=float)
+
+    if {"KNN", "LOF"} & set(detectors):
+        ks = sorted({min(int(k), len(X) - 1) for k in n_neighbors})
+        nn = NearestNeighbors(n_neighbors=ks[-1], n_jobs=-1).fit(X)
+        dist, ind = nn.kneighbors()          # không tính chính điểm đó
+        for k in ks:
+            if "KNN" in detectors:
+                out[("KNN", k)] = _knn_scores(dist, k)
+            if "LOF" in detectors:
+                out[("LOF", k)] = _lof_scores(dist, ind, k)
+
+    return out
+
+
+# ---------- Sweep ----------
+def sweep_row_detectors(
+    data: Union[FeatureMatrix, pd.DataFrame],
+    contaminations: Sequence[float] = (0.01, 0.02, 0.05, 0.1),
+    n_neighbors: Sequence[int] = (10, 20, 50),
+    detectors: Sequence[str] = ("ISOFOR", "LOF", "ECOD", "COPOD", "KNN"),
+    random_state: int = 42,
+    n_estimators: int = 200,
+) -> pd.DataFrame:
+    """
+    Quét contamination (và n_neighbors cho KNN/LOF) mà không chạy lại detector:
+    mỗi detector fit một lần, nhãn cho từng mức contamination c lấy bằng cách
+    cắt score tại percentile 100*(1-c) (giống cách PyOD đặt threshold_).
+
+    Trả về bảng gọn, mỗi dòng một cấu hình:
+        detector | n_neighbors | contamination | threshold | n_flagged | n_shared | mean_jaccard
+    - n_shared    : số dòng cũng bị ít nhất một detector KHÁC gắn cờ (cùng contamination)
+    - mean_jaccard: Jaccard trung bình với các cấu hình của detector khác (cùng contamination)
+    """
+    fm = data if isinstance(data, FeatureMatrix) else build_feature_matrix(data)
+    if not fm.columns or len(fm.X) < 2:
+        return pd.DataFrame(columns=["detector", "n_neighbors", "contamination", "threshold",
+                                     "n_flagged", "n_shared", "mean_jaccard"])
+
+    scores = _severity_scores(fm.X, detectors, n_neighbors, random_state, n_estimators)
+    configs = list(scores.keys())
+    det_names = np.array([d for d, _ in configs])
+
+    records: List[dict] = []
+    for c in contaminations:
+        thr = np.array([np.percentile(scores[cfg], 100 * (1 - c)) for cfg in configs])
+        # ma trận cờ (n_rows, n_config) -> giao giữa mọi cặp cấu hình bằng một phép nhân ma trận
+        F = np.column_stack([scores[cfg] > t for cfg, t in zip(configs, thr)])
+        Ff = F.astype(np.float32)
+        inter = Ff.T @ Ff
+        n_flag = np.diag(inter)
+        union = n_flag[:, None] + n_flag[None, :] - inter
+        with np.errstate(invalid="ignore", divide="ignore"):
+            jac = np.where(union > 0, inter / union, 0.0)
+
+        # mỗi dòng bị bao nhiêu detector (khác nhau) gắn cờ ở mức c
+        uniq = list(dict.fromkeys(det_names))
+        det_any = np.column_stack([F[:, det_names == d].any(axis=1) for d in uniq])
+        n_det_flag = det_any.sum(axis=1)
+
+        for j, (det, k) in enumerate(configs):
+            other = det_names != det
+            shared = F[:, j] & (n_det_flag - det_any[:, uniq.index(det)] > 0)
+            records.append({
+                "detector": det,
+                "n_neighbors": k,
+                "contamination": c,
+                "threshold": float(thr[j]),
+                "n_flagged": int(n_flag[j]),
+                "n_shared": int(shared.sum()),
+                "mean_jaccard": float(jac[j, other].mean()) if other.any() else np.nan,
+            })
+
+    return pd.DataFrame.from_records(records)
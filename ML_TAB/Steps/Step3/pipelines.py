@@ -1,27 +1,114 @@
 # ML_APP/ML_TAB/Steps/Step3/pipelines.py
 from __future__ import annotations
+
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from joblib import Memory
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import RobustScaler, StandardScaler
-#from feature_engine.outliers import Winsorizer
+from sklearn.preprocessing import RobustScaler
+
+from .transformers import NumericCleaner, ChunkedStandardScaler, Winsorizer
+from .imputation import TimeSeriesImputer
+
+# Thư mục gốc của app (chứa ML_TAB/) -> cache không phụ thuộc thư mục đang chạy (CWD)
+APP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# Thư mục cache mặc định cho pipeline đã fit (joblib.Memory)
+DEFAULT_CACHE_DIR = os.path.join(APP_DIR, "cache", "step3_pipelines")
 
-# dùng NumericCleaner anh đã có sẵn ở utils/transformers.py
-from ML_APP.ML_TAB.utils.transformers import NumericCleaner
 
 def build_numeric_pipeline(
     *,
+    columns: Optional[List[str]] = None,
+    ts_impute: Optional[str] = "interpolate",   # "ffill" | "interpolate" | "rolling_median" | None
+    max_gap: str = "2h",
+    window: str = "6h",
     impute_strategy: str = "median",
     outlier_capping: bool = True,
-    scaler: str = "robust"          # "robust" | "standard" | None
+    capping_method: str = "iqr",        # "iqr" | "quantile" | "mad"
+    iqr_fold: float = 1.5,
+    scaler: Optional[str] = "robust",   # "robust" | "standard" | None
+    chunk_size: int = 200_000,
 ) -> Pipeline:
+    """
+    cleaner (float32) -> imputer -> capping (tuỳ chọn) -> scaler.
+    ts_impute != None: cleaner điền NaN theo cột Datetime trước (TimeSeriesImputer, khoảng trống
+    <= max_gap / cửa sổ window); phần còn lại (đầu / cuối, khoảng trống dài) do SimpleImputer.
+    Capping = Winsorizer native (np.clip tại chỗ); iqr_fold là `fold` của nó
+    (với capping_method="mad" là ngưỡng modified Z-score).
+    Winsorizer và scaler="standard" fit theo từng khối chunk_size dòng.
+    """
+    if ts_impute is None:
+        cleaner = NumericCleaner(columns=columns, dtype="float32")
+    else:
+        cleaner = TimeSeriesImputer(columns=columns, dtype="float32", method=ts_impute,
+                                    max_gap=max_gap, window=window, chunk_size=chunk_size)
     steps = [
-        ("cleaner", NumericCleaner()),
-        ("imputer", SimpleImputer(strategy=impute_strategy)),
+        ("cleaner", cleaner),
+        # keep_empty_features: cột toàn NaN vẫn giữ chỗ -> số cột ra = số cột vào
+        ("imputer", SimpleImputer(strategy=impute_strategy, keep_empty_features=True)),
     ]
     if outlier_capping:
-        steps.append(("outlier", Winsorizer(capping_method="iqr", tail="both", fold=iqr_fold)))
+        steps.append(("outlier", Winsorizer(method=capping_method, fold=iqr_fold, chunk_size=chunk_size)))
     if scaler == "robust":
-        steps.append(("scaler", RobustScaler()))
+        steps.append(("scaler", RobustScaler(copy=False)))
     elif scaler == "standard":
-        steps.append(("scaler", StandardScaler()))
-    return Pipeline(steps=steps)
\ No newline at end of file
+        steps.append(("scaler", ChunkedStandardScaler(chunk_size=chunk_size)))
+    elif scaler is not None:
+        raise ValueError("scaler must be 'robust', 'standard' or None")
+    return Pipeline(steps=steps)
+
+
+def data_fingerprint(df: pd.DataFrame, columns: Optional[List[str]] = None, sample_rows: int = 100_000) -> str:
+    """
+    Dấu vân tay nhanh của dữ liệu dùng để fit: shape, tên cột / dtype, index,
+    tổng từng cột số (đủ một lượt O(n), không copy) và hash của tối đa sample_rows dòng rải đều.
+    """
+    cols = list(columns) if columns else df.columns.tolist()
+    h = hashlib.sha1()
+    h.update(repr((df.shape, cols, [str(df[c].dtype) for c in cols])).encode())
+    if len(df):
+        step = max(len(df) // sample_rows, 1)
+        sample = df[cols].iloc[::step]
+        h.update(pd.util.hash_pandas_object(sample, index=True).to_numpy().tobytes())
+        h.update(np.asarray(df.index[[0, -1]]).astype(str).tobytes())
+        for c in cols:
+            if pd.api.types.is_numeric_dtype(df[c]):
+                h.update(np.float64(np.nansum(df[c].to_numpy(dtype=float, na_value=np.nan))).tobytes())
+    return h.hexdigest()
+
+
+def _fit(df: pd.DataFrame, fingerprint: str, params: Dict) -> Pipeline:
+    # fingerprint + params là key của cache (df được bỏ qua khi hash, xem fit_numeric_pipeline)
+    return build_numeric_pipeline(**params).fit(df)
+
+
+_MEMORIES: Dict[str, Memory] = {}
+
+
+def fit_numeric_pipeline(
+    df: pd.DataFrame,
+    *,
+    cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+    fingerprint: Optional[str] = None,
+    **params,
+) -> Pipeline:
+    """
+    Fit build_numeric_pipeline(**params) trên df, có cache trên đĩa (joblib.Memory):
+    key = (data_fingerprint(df), params) -> cùng dữ liệu + cùng tham số thì chỉ load lại
+    pipeline đã fit, không fit lại. cache_dir=None -> không cache.
+    fingerprint: key dữ liệu tính sẵn (vd. fingerprint cả bảng + vị trí dòng của fold CV),
+    bỏ qua bước hash df.
+    """
+    if cache_dir is None:
+        return build_numeric_pipeline(**params).fit(df)
+    mem = _MEMORIES.get(cache_dir)
+    if mem is None:
+        mem = _MEMORIES[cache_dir] = Memory(cache_dir, verbose=0)
+    fp = fingerprint or data_fingerprint(df, params.get("columns"))
+    return mem.cache(_fit, ignore=["df"])(df, fp, dict(sorted(params.items())))
@@ -0,0 +1,306 @@
+# ML_TAB/Steps/Step3/result_store.py
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# giá trị int64 của NaT (timestamp trống)
+NAT_INT64 = np.iinfo(np.int64).min
+
+RESULT_COLUMNS = ["row_index", "timestamp", "column", "value", "score", "method"]
+
+# Các method mà score càng NHỎ càng bất thường (decision_function / negative_outlier_factor_)
+LOWER_IS_WORSE = frozenset({"ISOFOR", "LOF"})
+
+# Khoá trong DataFrame.attrs nơi detector row-level gắn RowCauses cho DF kết quả
+CAUSES_ATTR = "causes"
+
+
+@dataclass
+class RowCauses:
+    """
+    Top-k biến giải thích của detector row-level, dạng mảng (n, k) theo đúng thứ tự dòng
+    của DF kết quả (gắn ở df.attrs[CAUSES_ATTR]) -> from_frame chép thẳng, không duyệt dòng.
+    row_index dùng để kiểm tra DF chưa bị lọc / sắp lại sau khi gắn.
+    """
+    row_index: np.ndarray
+    features: List[str]
+    feature: np.ndarray     # int, (n, k): vị trí trong features
+    value: np.ndarray       # (n, k)
+    rz: np.ndarray          # (n, k)
+
+    def __deepcopy__(self, memo) -> "RowCauses":
+        # pandas deep-copy attrs mỗi lần lấy cột / lọc dòng -> dùng chung mảng (chỉ đọc)
+        return self
+
+    def matches(self, row_index: np.ndarray) -> bool:
+        return len(self.row_index) == len(row_index) and bool(np.array_equal(self.row_index, row_index))
+
+
+@dataclass
+class OutlierResultStore:
+    """
+    Kết quả outlier dạng cột, gọn bộ nhớ (thay cho list tuple / list dict mỗi dòng):
+
+    - row_index     int32   : nhãn dòng trong df (= số thứ tự dòng của file khi nạp ở Step 1)
+    - column_codes  int16   : mã cột, tra trong `columns` ('<row>' cho detector row-level)
+    - method_codes  int8    : mã method, tra trong `methods`
+    - score         float32
+    - value         float32 : NaN với detector row-level
+    - timestamp     int64   : nano-giây từ epoch, NaT = NAT_INT64
+    - cause_feature int16 (n, k): mã cột của top-k biến giải thích (-1 = trống)
+    - cause_value / cause_rz float32 (n, k)
+    """
+    row_index: np.ndarray
+    column_codes: np.ndarray
+    method_codes: np.ndarray
+    score: np.ndarray
+    value: np.ndarray
+    timestamp: np.ndarray
+    columns: List[str]
+    methods: List[str]
+    cause_feature: np.ndarray = field(default_factory=lambda: np.empty((0, 0), np.int16))
+    cause_value: np.ndarray = field(default_factory=lambda: np.empty((0, 0), np.float32))
+    cause_rz: np.ndarray = field(default_factory=lambda: np.empty((0, 0), np.float32))
+
+    def __len__(self) -> int:
+        return len(self.row_index)
+
+    @property
+    def has_causes(self) -> bool:
+        return self.cause_feature.size > 0
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.row_index, self.column_codes, self.method_codes, self.score,
+                  self.value, self.timestamp, self.cause_feature, self.cause_value, self.cause_rz)
+        return int(sum(a.nbytes for a in arrays))
+
+    # ------------------------------------------------------------------
+    # Tạo store
+    # ------------------------------------------------------------------
+    @classmethod
+    def empty(cls) -> "OutlierResultStore":
+        return cls(
+            row_index=np.empty(0, np.int32),
+            column_codes=np.empty(0, np.int16),
+            method_codes=np.empty(0, np.int8),
+            score=np.empty(0, np.float32),
+            value=np.empty(0, np.float32),
+            timestamp=np.empty(0, np.int64),
+            columns=[],
+            methods=[],
+        )
+
+    @classmethod
+    def from_frame(cls, df: Optional[pd.DataFrame], topk: int = 3) -> "OutlierResultStore":
+        """
+        Chuyển DF kết quả của các detector (row_index | timestamp | column | value | score | method)
+        sang store. Giải thích top-k (nếu có) lấy thẳng từ mảng RowCauses ở df.attrs[CAUSES_ATTR].
+        """
+        if df is None or df.empty:
+            return cls.empty()
+
+        col_codes, columns = pd.factorize(df["column"].astype(str))
+        columns = list(columns)
+        met_codes, methods = pd.factorize(df["method"].astype(str))
+
+        ts = pd.to_datetime(df["timestamp"], errors="coerce")
+        if getattr(ts.dt, "tz", None) is not None:
+            ts = ts.dt.tz_convert(None)
+
+        store = cls(
+            row_index=df["row_index"].to_numpy(dtype=np.int32),
+            column_codes=col_codes.astype(np.int16),
+            method_codes=met_codes.astype(np.int8),
+            score=pd.to_numeric(df["score"], errors="coerce").to_numpy(dtype=np.float32),
+            value=pd.to_numeric(df["value"], errors="coerce").to_numpy(dtype=np.float32),
+            timestamp=ts.to_numpy(dtype="datetime64[ns]").view(np.int64),
+            columns=columns,
+            methods=list(methods),
+        )
+
+        causes = df.attrs.get(CAUSES_ATTR)
+        if isinstance(causes, RowCauses) and causes.matches(store.row_index):
+            code_of = {c: i for i, c in enumerate(columns)}
+            for name in causes.features:
+                if name not in code_of:
+                    code_of[name] = len(columns)
+                    columns.append(name)
+            lut = np.array([code_of[name] for name in causes.features], dtype=np.int16)
+            store.cause_feature = lut[causes.feature[:, :topk]]
+            store.cause_value = causes.value[:, :topk].astype(np.float32)
+            store.cause_rz = causes.rz[:, :topk].astype(np.float32)
+        return store
+
+    @classmethod
+    def concat(cls, stores: Sequence["OutlierResultStore"]) -> "OutlierResultStore":
+        """Gộp nhiều store (mã cột / method được ánh xạ lại về bảng chung)."""
+        stores = [s for s in stores if len(s)]
+        if not stores:
+            return cls.empty()
+
+        columns: List[str] = list(dict.fromkeys(c for s in stores for c in s.columns))
+        methods: List[str] = list(dict.fromkeys(m for s in stores for m in s.methods))
+        col_of = {c: i for i, c in enumerate(columns)}
+        met_of = {m: i for i, m in enumerate(methods)}
+        k = max((s.cause_feature.shape[1] for s in stores if s.has_causes), default=0)
+
+        def remap(codes: np.ndarray, table: List[str], new_of: dict) -> np.ndarray:
+            lut = np.array([new_of[t] for t in table] + [-1], dtype=np.int64)
+            return lut[codes]                          # mã -1 -> phần tử cuối (-1)
+
+        parts_feat, parts_val, parts_rz = [], [], []
+        for s in stores:
+            n = len(s)
+            f = np.full((n, k), -1, np.int16)
+            v = np.full((n, k), np.nan, np.float32)
+            r = np.full((n, k), np.nan, np.float32)
+            if s.has_causes:
+                kk = s.cause_feature.shape[1]
+                f[:, :kk] = remap(s.cause_feature, s.columns, col_of)
+                v[:, :kk] = s.cause_value
+                r[:, :kk] = s.cause_rz
+            parts_feat.append(f)
+            parts_val.append(v)
+            parts_rz.append(r)
+
+        return cls(
+            row_index=np.concatenate([s.row_index for s in stores]),
+            column_codes=np.concatenate([remap(s.column_codes, s.columns, col_of) for s in stores]).astype(np.int16),
+            method_codes=np.concatenate([remap(s.method_codes, s.methods, met_of) for s in stores]).astype(np.int8),
+            score=np.concatenate([s.score for s in stores]),
+            value=np.concatenate([s.value for s in stores]),
+            timestamp=np.concatenate([s.timestamp for s in stores]),
+            columns=columns,
+            methods=methods,
+            cause_feature=np.concatenate(parts_feat) if k else np.empty((0, 0), np.int16),
+            cause_value=np.concatenate(parts_val) if k else np.empty((0, 0), np.float32),
+            cause_rz=np.concatenate(parts_rz) if k else np.empty((0, 0), np.float32),
+        )
+
+    # ------------------------------------------------------------------
+    # Đọc dữ liệu
+    # ------------------------------------------------------------------
+    def timestamps(self) -> np.ndarray:
+        """timestamp dạng datetime64[ns] (view, không copy)."""
+        return self.timestamp.view("datetime64[ns]")
+
+    def column_names(self) -> np.ndarray:
+        return np.asarray(self.columns, dtype=object)[self.column_codes]
+
+    def method_names(self) -> np.ndarray:
+        return np.asarray(self.methods, dtype=object)[self.method_codes]
+
+    def severity(self) -> np.ndarray:
+        """
+        Score đưa về cùng chiều cho mọi method: càng lớn càng bất thường
+        (Z-score có dấu -> trị tuyệt đối; ISOFOR/LOF -> đổi dấu).
+        """
+        lower = np.array([m in LOWER_IS_WORSE for m in self.methods] + [False])[self.method_codes]
+        return np.where(lower, -self.score, np.abs(self.score))
+
+    def causes_text(self, i: int) -> str:
+        """Chuỗi giải thích của dòng i (chỉ format khi cần hiển thị)."""
+        if not self.has_causes:
+            return ""
+        parts = []
+        for f, v, r in zip(self.cause_feature[i], self.cause_value[i], self.cause_rz[i]):
+            if f < 0:
+                break
+            parts.append(f"{self.columns[f]}={float(v):.6g} (|rz|={float(r):.2f})")
+        return ", ".join(parts)
+
+    def causes_records(self, i: int) -> List[Dict[str, Any]]:
+        """Giải thích của dòng i dạng JSON [{feature, value, robust_z}, ...] (dựng khi cần)."""
+        if not self.has_causes:
+            return []
+        return [
+            {"feature": self.columns[f], "value": float(v), "robust_z": float(r)}
+            for f, v, r in zip(self.cause_feature[i], self.cause_value[i], self.cause_rz[i])
+            if f >= 0
+        ]
+
+    def to_frame(self, causes_json: bool = False) -> pd.DataFrame:
+        """
+        Dựng lại DF theo schema của các detector (causes dạng chuỗi nếu có).
+        causes_json=True -> thêm cột causes_json (list dict mỗi dòng) cho export JSON.
+        """
+        if not len(self):
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        out = pd.DataFrame({
+            "row_index": self.row_index.astype(int),
+            "timestamp": self.timestamps(),
+            "column": self.column_names(),
+            "value": self.value.astype(float),
+            "score": self.score.astype(float),
+            "method": self.method_names(),
+        })
+        if self.has_causes:
+            out["causes"] = [self.causes_text(i) for i in range(len(self))]
+            if causes_json:
+                out["causes_json"] = [self.causes_records(i) for i in range(len(self))]
+        return out
+
+    # ------------------------------------------------------------------
+    # Parquet
+    # ------------------------------------------------------------------
+    def to_parquet(self, path: str) -> str:
+        """
+        Lưu store ra Parquet (cần pyarrow). column / method / cause_feature_j được
+        lưu dạng categorical (dictionary encoding) nên file gọn và đọc lại nhanh.
+        """
+        cols = pd.Index(self.columns)
+        data = {
+            "row_index": self.row_index,
+            "column": pd.Categorical.from_codes(self.column_codes, categories=cols),
+            "method": pd.Categorical.from_codes(self.method_codes, categories=pd.Index(self.methods)),
+            "score": self.score,
+            "value": self.value,
+            "timestamp": self.timestamp,
+        }
+        for j in range(self.cause_feature.shape[1] if self.has_causes else 0):
+            data[f"cause_feature_{j}"] = pd.Categorical.from_codes(self.cause_feature[:, j], categories=cols)
+            data[f"cause_value_{j}"] = self.cause_value[:, j]
+            data[f"cause_rz_{j}"] = self.cause_rz[:, j]
+        pd.DataFrame(data).to_parquet(path, index=False)
+        return path
+
+    @classmethod
+    def read_parquet(cls, path: str) -> "OutlierResultStore":
+        df = pd.read_parquet(path)
+        if df.empty:
+            return cls.empty()
+
+        column = df["column"].astype("category")
+        columns = list(column.cat.categories.astype(str))
+        method = df["method"].astype("category")
+
+        k = sum(1 for c in df.columns if c.startswith("cause_feature_"))
+        feats = []
+        for j in range(k):
+            cf = df[f"cause_feature_{j}"].astype(pd.CategoricalDtype(categories=columns))
+            feats.append(cf.cat.codes.to_numpy())
+
+        return cls(
+            row_index=df["row_index"].to_numpy(dtype=np.int32),
+            column_codes=column.cat.codes.to_numpy().astype(np.int16),
+            method_codes=method.cat.codes.to_numpy().astype(np.int8),
+            score=df["score"].to_numpy(dtype=np.float32),
+            value=df["value"].to_numpy(dtype=np.float32),
+            timestamp=df["timestamp"].to_numpy(dtype=np.int64),
+            columns=columns,
+            methods=list(method.cat.categories.astype(str)),
+            cause_feature=np.column_stack(feats).astype(np.int16) if k else np.empty((0, 0), np.int16),
+            cause_value=(
+                np.column_stack([df[f"cause_value_{j}"] for j in range(k)]).astype(np.float32)
+                if k else np.empty((0, 0), np.float32)
+            ),
+            cause_rz=(
+                np.column_stack([df[f"cause_rz_{j}"] for j in range(k)]).astype(np.float32)
+                if k else np.empty((0, 0), np.float32)
+            ),
+        )
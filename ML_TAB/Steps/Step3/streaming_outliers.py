@@ -0,0 +1,235 @@
+# ML_TAB/Steps/Step3/streaming_outliers.py
+from __future__ import annotations
+
+import os
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+import pandas as pd
+
+from ML_TAB.Steps.Step1.data_collection import iter_rawdata_chunks
+from .outlier_tools import _infer_timestamp_col, _iqr_bounds
+
+
+# ---------- Quantile sketch (KLL-style compactor) ----------
+class QuantileSketch:
+    """
+    Sketch quantile kiểu KLL cho 1 cột, bộ nhớ ~ k * số level (không phụ thuộc n).
+
+    - Level h chứa các mẫu có trọng số 2^h.
+    - Khi một level vượt quá k phần tử: sort, giữ lại 1/2 (offset ngẫu nhiên 0/1)
+      đẩy lên level h+1 -> sai số rank ~ O(log(n/k) / k).
+    - update() nhận cả mảng (một chunk) nên mọi thao tác đều là numpy.
+    """
+
+    def __init__(self, k: int = 2048, seed: Optional[int] = 0):
+        self.k = int(k)
+        self.n = 0
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.n += values.size
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self) -> None:
+        h = 0
+        while h < len(self.levels):
+            buf = self.levels[h]
+            if buf.size > self.k:
+                buf = np.sort(buf)
+                # số phần tử chẵn được compact, phần lẻ (nếu có) giữ lại ở level h
+                n_even = buf.size - (buf.size % 2)
+                keep = buf[n_even:]
+                promoted = buf[int(self._rng.integers(2)):n_even:2]
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h] = keep
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(lv.size, 2.0 ** h) for h, lv in enumerate(self.levels)]
+        )
+        return items, weights
+
+    @staticmethod
+    def _weighted_quantiles(items: np.ndarray, weights: np.ndarray, qs) -> np.ndarray:
+        order = np.argsort(items, kind="stable")
+        items, weights = items[order], weights[order]
+        cum = np.cumsum(weights)
+        targets = np.asarray(qs, dtype=float) * cum[-1]
+        pos = np.minimum(np.searchsorted(cum, targets, side="left"), items.size - 1)
+        return items[pos]
+
+    def quantiles(self, qs) -> np.ndarray:
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        items, weights = self._weighted_items()
+        return self._weighted_quantiles(items, weights, qs)
+
+    def mad(self, center: float) -> float:
+        """MAD xấp xỉ = median có trọng số của |x - center| trên các mẫu của sketch."""
+        if self.n == 0 or np.isnan(center):
+            return float("nan")
+        items, weights = self._weighted_items()
+        return float(self._weighted_quantiles(np.abs(items - center), weights, [0.5])[0])
+
+
+# ---------- Moment accumulator ----------
+class MomentAccumulator:
+    """
+    Tích luỹ count / mean / M2 theo cột qua nhiều chunk (gộp kiểu Chan et al.),
+    đủ để tính mean, std cho Z-score mà không cần giữ dữ liệu.
+    """
+
+    def __init__(self, n_cols: int):
+        self.count = np.zeros(n_cols)
+        self.mean = np.zeros(n_cols)
+        self.m2 = np.zeros(n_cols)
+
+    def update(self, X: np.ndarray) -> None:
+        n_b = np.count_nonzero(~np.isnan(X), axis=0).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.nansum(X, axis=0) / n_b
+            m2_b = np.nansum((X - mean_b) ** 2, axis=0)
+        mean_b = np.nan_to_num(mean_b)
+        n = self.count + n_b
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean_b - self.mean
+            self.mean = np.where(n > 0, self.mean + delta * n_b / n, 0.0)
+            self.m2 = np.where(n > 0, self.m2 + m2_b + delta ** 2 * self.count * n_b / n, 0.0)
+        self.count = n
+
+    def std(self, ddof: int = 0) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(self.m2 / (self.count - ddof))
+
+
+# ---------- Out-of-core detector ----------
+def detect_outliers_out_of_core(
+    file_path: str,
+    out_path: str,
+    method: str = "iqr",
+    columns: Optional[List[str]] = None,
+    chunksize: int = 200_000,
+    factor: float = 1.5,
+    threshold: float = 3.5,
+    z: float = 3.0,
+    timestamp_col: Optional[str] = None,
+    sketch_k: int = 2048,
+) -> Dict[str, Any]:
+    """
+    Phát hiện outlier column-level cho file CSV lớn hơn bộ nhớ (2 lượt đọc):
+
+    - Lượt 1: đọc từng chunk, cập nhật QuantileSketch + MomentAccumulator cho mỗi cột.
+    - Ngưỡng: 'iqr'  -> Q1/Q3 từ sketch (cùng _iqr_bounds với detect_outliers_iqr)
+              'modz' -> median + MAD xấp xỉ từ sketch (như detect_outliers_modified_zscore)
+              'zscore' -> mean/std từ moment (như detect_outliers_zscore, ddof=0)
+    - Lượt 2: đọc lại từng chunk, gắn cờ vector hoá và ghi nối tiếp kết quả ra out_path (CSV):
+        row_index | timestamp | column | value | score | method
+      row_index = số thứ tự dòng trong file (khớp index của load_rawdata).
+
+    Trả về dict: n_rows, n_flagged, thresholds (DataFrame theo cột), out_path.
+    """
+    if method not in ("iqr", "modz", "zscore"):
+        raise ValueError("method must be 'iqr', 'modz' or 'zscore'")
+
+    # ===== Lượt 1: sketch + moment =====
+    cols: Optional[List[str]] = None
+    ts_col: Optional[str] = None
+    sketches: List[QuantileSketch] = []
+    moments: Optional[MomentAccumulator] = None
+    n_rows = 0
+
+    for chunk in iter_rawdata_chunks(file_path, chunksize):
+        if cols is None:
+            if columns:
+                cols = [c for c in columns if c in chunk.columns]
+            else:
+                cols = chunk.select_dtypes(include=[np.number]).columns.tolist()
+            ts_col = _infer_timestamp_col(chunk, timestamp_col)
+            sketches = [QuantileSketch(k=sketch_k, seed=j) for j in range(len(cols))]
+            moments = MomentAccumulator(len(cols))
+
+        X = chunk[cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+        for j, sk in enumerate(sketches):
+            sk.update(X[:, j])
+        moments.update(X)
+        n_rows += len(chunk)
+
+    if not cols:
+        return {"n_rows": n_rows, "n_flagged": 0, "thresholds": pd.DataFrame(), "out_path": None}
+
+    # ===== Ngưỡng theo cột =====
+    if method == "iqr":
+        q = np.array([sk.quantiles([0.25, 0.75]) for sk in sketches])
+        lower, upper = _iqr_bounds(q[:, 0], q[:, 1], factor)
+        center = scale = None
+        thresholds = pd.DataFrame({"q1": q[:, 0], "q3": q[:, 1], "lower": lower, "upper": upper}, index=cols)
+        label = "IQR"
+    elif method == "modz":
+        center = np.array([sk.quantiles([0.5])[0] for sk in sketches])
+        mad = np.array([sk.mad(m) for sk, m in zip(sketches, center)])
+        # MAD = 0 / NaN -> bỏ qua cột (giống bản in-memory)
+        scale = np.where((mad > 0), (mad + 1e-9) / 0.6745, np.nan)
+        thresholds = pd.DataFrame({"median": center, "mad": mad}, index=cols)
+        label = "MOD_Z"
+    else:
+        center = moments.mean
+        std = moments.std(ddof=0)
+        scale = np.where(std > 0, std, np.nan)
+        thresholds = pd.DataFrame({"mean": center, "std": std}, index=cols)
+        label = "Z-SCORE"
+
+    # ===== Lượt 2: gắn cờ + ghi ra đĩa =====
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+
+    col_arr = np.asarray(cols, dtype=object)
+    n_flagged = 0
+    header = True
+    for chunk in iter_rawdata_chunks(file_path, chunksize):
+        X = chunk[cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+
+        with np.errstate(invalid="ignore"):
+            if method == "iqr":
+                low = X < lower
+                mask = low | (X > upper)
+                score = np.where(low, lower - X, X - upper)
+            else:
+                zs = (X - center) / scale
+                score = np.abs(zs) if method == "modz" else zs
+                mask = np.abs(zs) > (threshold if method == "modz" else z)
+
+        # duyệt theo cột trước trong mỗi chunk (giống thứ tự của bản in-memory)
+        ci, ri = np.nonzero(mask.T)
+        if len(ri) == 0:
+            continue
+        part = pd.DataFrame({
+            "row_index": chunk.index.to_numpy()[ri],
+            "timestamp": chunk[ts_col].to_numpy()[ri] if ts_col else None,
+            "column": col_arr[ci],
+            "value": X[ri, ci],
+            "score": score[ri, ci],
+            "method": label,
+        })
+        part.to_csv(out_path, mode="a", header=header, index=False)
+        header = False
+        n_flagged += len(part)
+
+    return {
+        "n_rows": n_rows,
+        "n_flagged": n_flagged,
+        "thresholds": thresholds,
+        "out_path": os.path.abspath(out_path) if n_flagged else None,
+    }
@@ -0,0 +1,210 @@
+# ML_TAB/Steps/Step3/transformers.py
+from __future__ import annotations
+
+import warnings
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, OneToOneFeatureMixin, TransformerMixin
+from sklearn.preprocessing import StandardScaler
+from sklearn.utils.validation import check_is_fitted
+
+from .outlier_tools import _iqr_bounds
+from .streaming_outliers import QuantileSketch
+
+
+class NumericCleaner(BaseEstimator, TransformerMixin):
+    """
+    Bước đầu của pipeline số: DataFrame -> ma trận float32 C-contiguous.
+
+    - fit: ghi nhớ danh sách cột số (hoặc `columns` nếu truyền vào)
+    - transform: ghi thẳng từng cột vào mảng đích (như build_feature_matrix, không qua
+      bản sao float64 của cả df), cột chữ được ép số (lỗi -> NaN), ±inf -> NaN
+    """
+
+    def __init__(self, columns: Optional[List[str]] = None, dtype: str = "float32"):
+        self.columns = columns
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        if isinstance(X, pd.DataFrame):
+            if self.columns:
+                missing = [c for c in self.columns if c not in X.columns]
+                if missing:
+                    raise ValueError(f"Thiếu cột: {missing}")
+                self.columns_ = list(self.columns)
+            else:
+                self.columns_ = X.select_dtypes(include=[np.number]).columns.tolist()
+        else:
+            self.columns_ = [f"x{j}" for j in range(np.shape(X)[1])]
+        self.n_features_in_ = len(self.columns_)
+        return self
+
+    def transform(self, X):
+        n = len(X)
+        out = np.empty((n, len(self.columns_)), dtype=self.dtype, order="C")
+        if isinstance(X, pd.DataFrame):
+            for j, c in enumerate(self.columns_):
+                col = X[c]
+                if not pd.api.types.is_numeric_dtype(col):
+                    col = pd.to_numeric(col, errors="coerce")
+                out[:, j] = col.to_numpy(dtype=self.dtype, na_value=np.nan)
+        else:
+            out[...] = np.asarray(X, dtype=self.dtype)
+        out[np.isinf(out)] = np.nan
+        return out
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(self.columns_, dtype=object)
+
+
+class ChunkedStandardScaler(StandardScaler):
+    """
+    StandardScaler fit bằng partial_fit theo từng khối `chunk_size` dòng:
+    mean / var tích luỹ dần, không cần bản sao (và bản sao float64) của cả tập dữ liệu.
+    transform giữ dtype đầu vào (float32) và mặc định ghi đè tại chỗ (copy=False).
+    """
+
+    def __init__(self, *, chunk_size: int = 200_000, copy: bool = False,
+                 with_mean: bool = True, with_std: bool = True):
+        super().__init__(copy=copy, with_mean=with_mean, with_std=with_std)
+        self.chunk_size = chunk_size
+
+    def fit(self, X, y=None, sample_weight=None):
+        # bỏ trạng thái fit cũ (partial_fit cộng dồn)
+        for attr in ("n_samples_seen_", "mean_", "var_", "scale_"):
+            if hasattr(self, attr):
+                delattr(self, attr)
+        step = max(int(self.chunk_size), 1)
+        for a in range(0, len(X), step):
+            sw = None if sample_weight is None else sample_weight[a:a + step]
+            self.partial_fit(X[a:a + step], y, sample_weight=sw)
+        return self
+
+
+class Winsorizer(OneToOneFeatureMixin, TransformerMixin, BaseEstimator):
+    """
+    Chặn (cap) giá trị mỗi cột vào [lower_, upper_] bằng np.clip tại chỗ.
+
+    method:
+        'iqr'      -> Q1 - fold*IQR .. Q3 + fold*IQR (cùng công thức _iqr_bounds với detect_outliers_iqr)
+        'quantile' -> quantile q_low .. q_high
+        'mad'      -> median ± fold * MAD / 0.6745 (ngưỡng modified Z-score = fold)
+
+    Fit:
+        - mặc định: quantile chính xác (np.nanquantile) trên X
+        - X có hơn chunk_size dòng, hoặc gọi partial_fit theo từng chunk: mỗi cột một
+          QuantileSketch (bộ nhớ cố định) -> không cần bản sao thứ hai của dữ liệu lớn.
+          'mad' theo sketch cần thêm một lượt qua dữ liệu; nếu chỉ partial_fit, MAD lấy từ
+          các mẫu của sketch (xấp xỉ).
+    Transform: mảng float C-contiguous được clip tại chỗ (copy=False), NaN giữ nguyên.
+    """
+
+    def __init__(
+        self,
+        method: str = "iqr",
+        fold: float = 1.5,
+        q_low: float = 0.01,
+        q_high: float = 0.99,
+        chunk_size: Optional[int] = 500_000,
+        sketch_k: int = 2048,
+        copy: bool = False,
+    ):
+        self.method = method
+        self.fold = fold
+        self.q_low = q_low
+        self.q_high = q_high
+        self.chunk_size = chunk_size
+        self.sketch_k = sketch_k
+        self.copy = copy
+
+    # ---------- bounds ----------
+    def _probs(self) -> List[float]:
+        if self.method == "iqr":
+            return [0.25, 0.75]
+        if self.method == "quantile":
+            return [self.q_low, self.q_high]
+        if self.method == "mad":
+            return [0.5]
+        raise ValueError("method must be 'iqr', 'quantile' or 'mad'")
+
+    def _bounds(self, q: np.ndarray, mad: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """q: (len(probs), n_cols) -> (lower, upper); cột toàn NaN -> không chặn (±inf)."""
+        if self.method == "iqr":
+            lower, upper = _iqr_bounds(q[0], q[1], self.fold)
+        elif self.method == "quantile":
+            lower, upper = q[0], q[1]
+        else:
+            half = self.fold * np.asarray(mad, dtype=float) / 0.6745
+            lower, upper = q[0] - half, q[0] + half
+        lower = np.where(np.isnan(lower), -np.inf, lower)
+        upper = np.where(np.isnan(upper), np.inf, upper)
+        return np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+
+    @staticmethod
+    def _as_array(X) -> np.ndarray:
+        return X.to_numpy(dtype=float, na_value=np.nan) if isinstance(X, pd.DataFrame) else np.asarray(X)
+
+    # ---------- fit ----------
+    def fit(self, X, y=None):
+        X = self._as_array(X)
+        self.n_features_in_ = X.shape[1]
+        for attr in ("sketches_",):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+        if not self.chunk_size or len(X) <= self.chunk_size:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)   # cột toàn NaN
+                q = np.nanquantile(X, self._probs(), axis=0)
+                mad = np.nanmedian(np.abs(X - q[0]), axis=0) if self.method == "mad" else None
+            self.lower_, self.upper_ = self._bounds(q, mad)
+            return self
+
+        # dữ liệu lớn: sketch theo từng khối dòng (chỉ đọc X, không copy cả mảng)
+        step = int(self.chunk_size)
+        for a in range(0, len(X), step):
+            self.partial_fit(X[a:a + step])
+        if self.method == "mad":
+            # lượt 2: median của |x - median| bằng sketch riêng (vẫn theo khối)
+            center = self.center_
+            dev = [QuantileSketch(self.sketch_k) for _ in range(X.shape[1])]
+            for a in range(0, len(X), step):
+                block = np.abs(np.asarray(X[a:a + step], dtype=float) - center)
+                for j, sk in enumerate(dev):
+                    sk.update(block[:, j])
+            mad = np.array([sk.quantiles([0.5])[0] for sk in dev])
+            self.lower_, self.upper_ = self._bounds(center[None, :], mad)
+        return self
+
+    def partial_fit(self, X, y=None):
+        """Cập nhật sketch của từng cột bằng một chunk rồi tính lại biên."""
+        X = self._as_array(X)
+        if not hasattr(self, "sketches_"):
+            self.n_features_in_ = X.shape[1]
+            self.sketches_ = [QuantileSketch(self.sketch_k) for _ in range(X.shape[1])]
+        for j, sk in enumerate(self.sketches_):
+            sk.update(X[:, j])
+
+        probs = self._probs()
+        q = np.array([sk.quantiles(probs) for sk in self.sketches_]).T
+        mad = None
+        if self.method == "mad":
+            self.center_ = q[0]
+            mad = np.array([sk.mad(c) for sk, c in zip(self.sketches_, q[0])])
+        self.lower_, self.upper_ = self._bounds(q, mad)
+        return self
+
+    # ---------- transform ----------
+    def transform(self, X):
+        check_is_fitted(self, ("lower_", "upper_"))
+        if isinstance(X, pd.DataFrame):
+            X = X.to_numpy(dtype=float, na_value=np.nan)     # đã là bản sao
+        elif self.copy or not (isinstance(X, np.ndarray) and X.dtype.kind == "f"
+                               and X.flags.c_contiguous and X.flags.writeable):
+            X = np.array(X, dtype=np.result_type(X, np.float32), order="C")
+        lower = self.lower_.astype(X.dtype)
+        upper = self.upper_.astype(X.dtype)
+        np.clip(X, lower, upper, out=X)
+        return X
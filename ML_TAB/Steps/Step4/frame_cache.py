@@ -0,0 +1,90 @@
+# file: ML_TAB/Steps/Step4/frame_cache.py
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .line_plot_utils import IGNORED_COLUMNS
+
+
+def find_datetime_col(df: pd.DataFrame) -> Optional[str]:
+    for col in df.columns:
+        if col.lower() in ("datetime", "date_time"):
+            return col
+    return None
+
+
+@dataclass
+class PreparedFrame:
+    """
+    DF nguồn đã chuẩn bị cho Step 4 (một lần cho mỗi phiên bản dữ liệu):
+    - cột Datetime đã parse, bỏ NaT, sort tăng dần
+    - t_ns: Datetime dạng int64 (nano-giây) để searchsorted
+    - numeric_cols: các cột số có thể vẽ
+    """
+    df: pd.DataFrame
+    datetime_col: Optional[str]
+    numeric_cols: List[str]
+    t_ns: Optional[np.ndarray] = None
+
+    @property
+    def time_range(self) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        if self.t_ns is None or not len(self.t_ns):
+            return None
+        return pd.Timestamp(self.t_ns[0]), pd.Timestamp(self.t_ns[-1])
+
+    def time_slice(self, start, end) -> pd.DataFrame:
+        """Các dòng có start <= Datetime <= end: hai phép searchsorted + iloc (không tạo mask)."""
+        if self.t_ns is None:
+            return self.df
+        a = int(np.searchsorted(self.t_ns, pd.Timestamp(start).value, side="left"))
+        b = int(np.searchsorted(self.t_ns, pd.Timestamp(end).value, side="right"))
+        return self.df.iloc[a:b]
+
+
+def prepare_frame(df: pd.DataFrame) -> PreparedFrame:
+    datetime_col = find_datetime_col(df)
+    t_ns = None
+    if datetime_col is not None:
+        dt = pd.to_datetime(df[datetime_col], errors="coerce")
+        if getattr(dt.dt, "tz", None) is not None:
+            dt = dt.dt.tz_convert(None)
+        keep = dt.notna().to_numpy()
+        t = dt.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+        # chỉ copy khi thật sự phải bỏ NaT / sort lại
+        if keep.all() and (len(t) < 2 or (t[1:] >= t[:-1]).all()):
+            df = df.assign(**{datetime_col: dt})
+            t_ns = t
+        else:
+            order = np.flatnonzero(keep)
+            order = order[np.argsort(t[order], kind="stable")]
+            df = df.iloc[order].assign(**{datetime_col: dt.iloc[order]})
+            t_ns = t[order]
+
+    numeric_cols = df.select_dtypes(include=["number"]).columns.tolist()
+    numeric_cols = [c for c in numeric_cols if c.lower() not in IGNORED_COLUMNS]
+    return PreparedFrame(df=df, datetime_col=datetime_col, numeric_cols=numeric_cols, t_ns=t_ns)
+
+
+# ---------- Cache theo (nguồn, phiên bản dữ liệu) ----------
+_FRAME_CACHE: Dict[Tuple, PreparedFrame] = {}
+
+
+def get_prepared_frame(source: str, version: int, df: pd.DataFrame) -> PreparedFrame:
+    """
+    PreparedFrame của df, cache theo (nguồn, version, id(df)).
+    Đổi qua lại Raw / Cleaned không phải parse / sort lại; phiên bản cũ của cùng nguồn bị bỏ.
+    """
+    key = (source, version, id(df))
+    pf = _FRAME_CACHE.get(key)
+    if pf is None:
+        for k in [k for k in _FRAME_CACHE if k[0] == source]:
+            del _FRAME_CACHE[k]
+        pf = prepare_frame(df)
+        _FRAME_CACHE[key] = pf
+    return pf
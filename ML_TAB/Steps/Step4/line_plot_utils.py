@@ -2,14 +2,353 @@
 
 from __future__ import annotations
 
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 
+import numpy as np
 import pandas as pd
+import matplotlib.dates as mdates
+
+from .outlier_overlay import MARKER_COLORS
 
 # Những cột KHÔNG dùng để vẽ trực tiếp
 IGNORED_COLUMNS = {"datetime", "date", "time", "sourcefolder"}
 
 
+# ---------- Decimation min/max (giữ đỉnh) ----------
+def minmax_decimate(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_buckets: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Chia (x, y) thành n_buckets nhóm bằng số điểm, mỗi nhóm giữ điểm min và max của y
+    (theo đúng thứ tự x) -> tối đa 2*n_buckets điểm, spike / outlier không bao giờ bị mất.
+    Nếu số điểm đã ít hơn 2*n_buckets thì trả nguyên dữ liệu.
+    """
+    n = len(y)
+    if n_buckets <= 0 or n <= 2 * n_buckets:
+        return x, y
+
+    size = -(-n // n_buckets)                 # ceil
+    nb = -(-n // size)
+    pad = nb * size - n
+
+    yb = np.concatenate([y, np.full(pad, np.nan)]).reshape(nb, size)
+    valid = ~np.isnan(yb)
+    has = valid.any(axis=1)
+
+    # nanargmin/nanargmax không nhận nhóm toàn NaN -> thay NaN bằng ±inf
+    i_min = np.where(valid, yb, np.inf).argmin(axis=1)
+    i_max = np.where(valid, yb, -np.inf).argmax(axis=1)
+
+    base = np.arange(nb) * size
+    lo = base + np.minimum(i_min, i_max)
+    hi = base + np.maximum(i_min, i_max)
+    idx = np.column_stack([lo, hi])[has].ravel()
+    idx = idx[np.r_[True, idx[1:] != idx[:-1]]]   # min == max -> chỉ giữ một điểm
+    return x[idx], y[idx]
+
+
+def decimate_window(x, y, pyramid, x0: float, x1: float, pixels: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Điểm cần vẽ của một series trong khung [x0, x1] với ~pixels bucket (y chưa scale).
+    Có pyramid thì truy vấn pyramid (O(pixel)), không thì decimate phần nhìn thấy.
+    """
+    if not len(x):
+        return x, y
+    if pyramid is not None:
+        # chỉ trong khoảng x của series (df có thể đã lọc theo thời gian)
+        return pyramid.query(max(x0, x[0]), min(x1, x[-1]), pixels)
+    # lấy thêm một điểm mỗi bên để đường không bị hụt ở mép khung
+    a = max(int(np.searchsorted(x, x0, side="left")) - 1, 0)
+    b = min(int(np.searchsorted(x, x1, side="right")) + 1, len(x))
+    return minmax_decimate(x[a:b], y[a:b], pixels)
+
+
+class LineDecimator:
+    """
+    Giữ dữ liệu gốc (x đã sort, y CHƯA nhân scale) của từng biến và chỉ đưa cho Line2D
+    khoảng ~2 điểm / pixel của vùng đang nhìn. Khi zoom / pan (xlim_changed) thì
+    decimate lại cho đúng vùng hiển thị -> zoom sâu sẽ thấy đủ chi tiết.
+    Khi đã có pyramid (lod_pyramid.SeriesPyramid) cho biến thì truy vấn pyramid, O(pixel).
+
+    Line2D được giữ lại giữa các lần vẽ (sync): chỉ biến nào đổi dữ liệu / scale mới
+    phải tính lại, đổi scale chỉ nhân lại mảng y đang hiển thị.
+
+    renderer (render_worker.AsyncRenderer, tuỳ chọn): decimate trong worker thread,
+    GUI chỉ set_data kết quả của yêu cầu mới nhất.
+
+    overlay (outlier_overlay.OutlierOverlay, tuỳ chọn): marker của Step 3, mỗi detector
+    một PathCollection, decimate cùng lưới pixel và cùng lúc với line.
+
+    bands (tuỳ chọn): dải min–max theo bucket khi vẽ dữ liệu đã resample (resample_cache).
+    """
+
+    def __init__(self, ax):
+        self.ax = ax
+        self.series: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.lines: Dict[str, object] = {}
+        self.scales: Dict[str, float] = {}
+        self.data_keys: Dict[str, object] = {}
+        self.pyramids: Dict[str, object] = {}
+        self.renderer = None
+        self.overlay = None
+        self.markers: Dict[str, object] = {}
+        self._marker_data: Dict[str, tuple] = {}
+        self.bands: Dict[str, object] = {}
+        self._band_data: Dict[str, tuple] = {}
+        self._autoscale_pending = False
+        self._cid = ax.callbacks.connect("xlim_changed", self._on_xlim_changed)
+
+    def _n_buckets(self) -> int:
+        return max(int(self.ax.bbox.width), 100)
+
+    def _render(self, name: str, x0: float, x1: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Điểm cần vẽ của biến `name` trong [x0, x1] (đã nhân scale)."""
+        x, y = self.series[name]
+        xd, yd = decimate_window(x, y, self.pyramids.get(name), x0, x1, self._n_buckets())
+        return xd, yd * self.scales.get(name, 1.0)
+
+    def _schedule(self, names: List[str], x0: float, x1: float, autoscale: bool = False):
+        """
+        Tính lại line của `names` (+ marker của overlay) cho khung [x0, x1]:
+        ngay tại chỗ, hoặc qua renderer. autoscale được giữ tới khi có kết quả được áp dụng
+        (yêu cầu bị thay thế bởi yêu cầu mới hơn không làm mất autoscale).
+        """
+        self._autoscale_pending |= autoscale
+        if self._autoscale_pending:
+            # sắp autoscale -> khung sẽ là toàn bộ dữ liệu, không phải xlim hiện tại
+            ext = [(x[0], x[-1]) for x, _ in self.series.values() if len(x)]
+            if ext:
+                x0, x1 = min(e[0] for e in ext), max(e[1] for e in ext)
+        if self.renderer is None:
+            for name in names:
+                self.lines[name].set_data(*self._render(name, x0, x1))
+            if self.overlay is not None:
+                self._marker_data = self.overlay.query(x0, x1, self._n_buckets())
+                self._apply_markers()
+            self._autoscale_pending = False
+            return
+
+        job = ([(n, *self.series[n], self.pyramids.get(n)) for n in names],
+               x0, x1, self._n_buckets(), self.overlay)
+        overlay = self.overlay
+
+        def apply(out, markers):
+            for name, (xd, yd) in out.items():
+                if name in self.lines:
+                    self.lines[name].set_data(xd, yd * self.scales.get(name, 1.0))
+            if markers is not None and overlay is self.overlay:
+                self._marker_data = markers
+                self._apply_markers()
+            if self._autoscale_pending:
+                self._autoscale_pending = False
+                self.relim()
+            self.ax.figure.canvas.draw_idle()
+
+        self.renderer.submit(job, apply)
+
+    def relim(self):
+        """relim() của matplotlib bỏ qua collection -> cộng thêm dải min–max rồi autoscale."""
+        self.ax.relim()
+        for coll in self.bands.values():
+            self.ax.update_datalim(coll.get_datalim(self.ax.transData))
+        self.ax.autoscale_view()
+
+    # ---------- dải min–max (dữ liệu resample) ----------
+    def set_bands(self, x: np.ndarray, bands: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]]):
+        """bands = {biến: (min, max)} cùng độ dài với x (CHƯA nhân scale); None = bỏ dải."""
+        for coll in self.bands.values():
+            coll.remove()
+        self.bands = {}
+        self._band_data = {}
+        for name, (lo, hi) in (bands or {}).items():
+            if name in self.lines:
+                self._band_data[name] = (x, lo, hi)
+                self._draw_band(name)
+
+    def _draw_band(self, name: str):
+        old = self.bands.pop(name, None)
+        if old is not None:
+            old.remove()
+        x, lo, hi = self._band_data[name]
+        s = self.scales.get(name, 1.0)
+        self.bands[name] = self.ax.fill_between(
+            x, lo * s, hi * s, color=self.lines[name].get_color(), alpha=0.2, linewidth=0, zorder=1
+        )
+
+    # ---------- marker outlier ----------
+    def set_overlay(self, overlay):
+        """Thay overlay (None = bỏ): mỗi detector một scatter, rồi tính marker cho vùng đang nhìn."""
+        for coll in self.markers.values():
+            coll.remove()
+        self.markers = {}
+        self._marker_data = {}
+        self.overlay = overlay
+        if overlay is not None:
+            for i, name in enumerate(overlay.points):
+                self.markers[name] = self.ax.scatter(
+                    [], [], s=14, marker="o", facecolors="none", linewidths=1.0,
+                    edgecolors=MARKER_COLORS[i % len(MARKER_COLORS)],
+                    label=f"⚑ {name}", zorder=3,
+                )
+        self.refresh()
+
+    def _apply_markers(self):
+        if self.overlay is None:
+            return
+        offsets = self.overlay.scaled(self._marker_data, self.scales)
+        for name, coll in self.markers.items():
+            coll.set_offsets(offsets.get(name, np.empty((0, 2))))
+
+    def _set_series(self, name: str, x: np.ndarray, y: np.ndarray):
+        if len(x) > 1 and np.any(x[1:] < x[:-1]):
+            order = np.argsort(x, kind="stable")
+            x, y = x[order], y[order]
+        self.series[name] = (x, y)
+
+    def add(self, name: str, x: np.ndarray, y: np.ndarray, scale: float = 1.0,
+            data_key=None, **plot_kw):
+        """y là dữ liệu CHƯA nhân scale."""
+        self.scales[name] = scale
+        self.data_keys[name] = data_key
+        self._set_series(name, x, y)
+        x = self.series[name][0]
+        xd, yd = self._render(name, x[0], x[-1]) if len(x) else (x, y)
+        (line,) = self.ax.plot(xd, yd, **plot_kw)
+        self.lines[name] = line
+        return line
+
+    def remove(self, name: str):
+        line = self.lines.pop(name, None)
+        if line is not None:
+            line.remove()
+        band = self.bands.pop(name, None)
+        if band is not None:
+            band.remove()
+        for d in (self.series, self.scales, self.data_keys, self._band_data):
+            d.pop(name, None)
+
+    def set_scale(self, name: str, scale: float) -> bool:
+        old = self.scales.get(name, 1.0)
+        if scale == old:
+            return False
+        self.scales[name] = scale
+        line = self.lines[name]
+        if old != 0:
+            line.set_ydata(np.asarray(line.get_ydata(), dtype=float) * (scale / old))
+        else:
+            line.set_data(*self._render(name, *self.ax.get_xlim()))
+        line.set_label(f"{name} (x{scale})")
+        if name in self._band_data:
+            self._draw_band(name)
+        self._apply_markers()
+        return True
+
+    def sync(self, x: np.ndarray, columns: Dict[str, np.ndarray], scales: Dict[str, float],
+             data_key=None) -> bool:
+        """
+        Đưa tập line về đúng `columns` ({biến: y chưa scale}) mà không dựng lại axes:
+        - biến bỏ chọn -> xoá line; biến mới -> thêm line
+        - biến có data_key khác (đổi nguồn / khoảng thời gian) -> set_data
+        - chỉ đổi scale -> nhân lại y đang hiển thị
+        Trả về True nếu có gì thay đổi -> caller nên autoscale lại.
+        """
+        changed = False
+        dirty: List[str] = []
+        for name in [n for n in self.lines if n not in columns]:
+            self.remove(name)
+            changed = True
+
+        x0, x1 = (x[0], x[-1]) if len(x) else self.ax.get_xlim()
+        for name, y in columns.items():
+            scale = scales.get(name, 1.0)
+            if name not in self.lines:
+                self.add(name, x, y, scale=scale, data_key=data_key, label=f"{name} (x{scale})")
+                changed = True
+            elif self.data_keys.get(name) != data_key:
+                self.scales[name] = scale
+                self.data_keys[name] = data_key
+                self._set_series(name, x, y)
+                self.lines[name].set_label(f"{name} (x{scale})")
+                dirty.append(name)
+                changed = True
+            else:
+                changed |= self.set_scale(name, scale)
+        if dirty:
+            self._schedule(dirty, x0, x1, autoscale=True)
+        return changed
+
+    def set_pyramids(self, pyramids: Dict[str, object]):
+        """Gắn pyramid (dựng sẵn trên y chưa scale) rồi vẽ lại vùng đang nhìn."""
+        self.pyramids = pyramids
+        self.refresh()
+
+    def refresh(self):
+        x0, x1 = self.ax.get_xlim()
+        self._schedule(list(self.series), x0, x1)
+
+    def _on_xlim_changed(self, ax):
+        self.refresh()
+
+    def disconnect(self):
+        self.ax.callbacks.disconnect(self._cid)
+
+
+class CursorBlitter:
+    """
+    Đường con trỏ dọc + nhãn giá trị vẽ bằng blitting: nền (đã có mọi line) được chụp
+    sau mỗi lần draw, khi di chuột chỉ khôi phục nền và vẽ lại 2 artist động.
+    """
+
+    def __init__(self, canvas, ax):
+        self.canvas = canvas
+        self.ax = ax
+        self.vline = ax.axvline(ax.get_xlim()[0], color="0.3", lw=0.8, animated=True, visible=False)
+        self.text = ax.text(0.01, 0.98, "", transform=ax.transAxes, va="top",
+                            fontsize=8, animated=True, visible=False)
+        self._bg = None
+        self._cids = [
+            canvas.mpl_connect("draw_event", self._on_draw),
+            canvas.mpl_connect("motion_notify_event", self._on_move),
+        ]
+
+    def _on_draw(self, event):
+        # đang trong lần draw đầy đủ: chỉ chụp nền rồi vẽ artist động lên, không blit
+        self._bg = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.vline)
+        self.ax.draw_artist(self.text)
+
+    def _blit(self):
+        if self._bg is None:
+            return
+        self.canvas.restore_region(self._bg)
+        self.ax.draw_artist(self.vline)
+        self.ax.draw_artist(self.text)
+        self.canvas.blit(self.ax.bbox)
+
+    def _on_move(self, event):
+        inside = event.inaxes is self.ax and event.xdata is not None
+        self.vline.set_visible(inside)
+        self.text.set_visible(inside)
+        if inside:
+            self.vline.set_xdata([event.xdata, event.xdata])
+            label = self.ax.xaxis.get_major_formatter().format_data_short(event.xdata)
+            self.text.set_text(f"x = {label}   y = {event.ydata:.4g}")
+        self._blit()
+
+    def disconnect(self):
+        for cid in self._cids:
+            self.canvas.mpl_disconnect(cid)
+
+
+def plot_x_values(df: pd.DataFrame, datetime_col: Optional[str]) -> Tuple[np.ndarray, bool]:
+    """x dạng float64 (số ngày matplotlib nếu là Datetime) + cờ có phải thời gian không."""
+    if datetime_col is not None and datetime_col in df.columns:
+        return mdates.date2num(df[datetime_col].to_numpy()), True
+    return df.index.to_numpy(dtype=float), False
+
+
 def plot_line_multi(
     ax,
     df: pd.DataFrame,
@@ -17,33 +356,67 @@ def plot_line_multi(
     datetime_col: Optional[str],
     scales: Dict[str, float],
     source_text: str,
-):
+    pyramids: Optional[Dict[str, object]] = None,
+    data_key=None,
+) -> LineDecimator:
     """
     Hàm thuần để vẽ line:
     - x: Datetime (nếu có), ngược lại dùng index
     - y: nhiều biến overlay, có scale từng biến
+    - Mỗi biến chỉ vẽ ~2 điểm / pixel (min/max theo bucket), decimate lại khi zoom / pan.
+      Trả về LineDecimator — caller cần giữ tham chiếu (callback của matplotlib là weakref).
+    - pyramids (tuỳ chọn): {biến: SeriesPyramid} dựng trên cùng df -> vẽ / zoom O(pixel).
+    - data_key (tuỳ chọn): định danh dữ liệu của df, để update_line_multi biết biến nào đổi.
     """
     ax.clear()
 
     # X = Datetime (nếu có), else index
-    if datetime_col is not None and datetime_col in df.columns:
-        x = df[datetime_col]
-        ax.set_xlabel(datetime_col)
-    else:
-        x = df.index
-        ax.set_xlabel("Index")
+    x, is_time = plot_x_values(df, datetime_col)
+    ax.set_xlabel(datetime_col if is_time else "Index")
 
+    dec = LineDecimator(ax)
+    dec.pyramids = pyramids or {}
     for var in variables:
         if var not in df.columns:
             continue
-        y = df[var]
+        y = df[var].to_numpy(dtype=float, na_value=np.nan)
 
         scale = scales.get(var, 1.0)
-        y_plot = y * scale
 
-        ax.plot(x, y_plot, label=f"{var} (x{scale})")
+        dec.add(var, x, y, scale=scale, data_key=data_key, label=f"{var} (x{scale})")
 
+    if is_time:
+        ax.xaxis_date()
     ax.set_ylabel("Value")
     ax.set_title(f"Line chart — {source_text}")
     ax.grid(True)
+    return dec
 
+
+def update_line_multi(
+    dec: LineDecimator,
+    df: pd.DataFrame,
+    variables: List[str],
+    datetime_col: Optional[str],
+    scales: Dict[str, float],
+    source_text: str,
+    data_key=None,
+) -> bool:
+    """
+    Như plot_line_multi nhưng giữ nguyên axes / Line2D đã có (xem LineDecimator.sync).
+    x chỉ được tính lại khi data_key đổi. Trả về True nếu có line thay đổi.
+    """
+    ax = dec.ax
+    cols = [v for v in variables if v in df.columns]
+    need_x = any(dec.data_keys.get(v, object()) != data_key for v in cols)
+    if need_x:
+        x, _ = plot_x_values(df, datetime_col)
+        columns = {v: df[v].to_numpy(dtype=float, na_value=np.nan) for v in cols}
+    else:
+        x = np.empty(0)
+        columns = {v: None for v in cols}      # chỉ đổi scale / bỏ bớt biến
+    changed = dec.sync(x, columns, scales, data_key=data_key)
+    if changed:
+        dec.relim()
+    ax.set_title(f"Line chart — {source_text}")
+    return changed
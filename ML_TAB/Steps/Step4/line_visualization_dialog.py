@@ -5,13 +5,8 @@ from __future__ import annotations
 from typing import Optional, List, Dict
 
 import pandas as pd
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qtagg import (
-    FigureCanvasQTAgg as FigureCanvas,
-    NavigationToolbar2QT as NavigationToolbar,
-)
 
-from PySide6.QtCore import QDateTime, Qt
+from PySide6.QtCore import QDateTime, Qt, QThread, QTimer
 from PySide6.QtWidgets import (
     QDialog,
     QVBoxLayout,
@@ -22,10 +17,17 @@ from PySide6.QtWidgets import (
     QDateTimeEdit,
     QDialogButtonBox,
     QLineEdit,
+    QFileDialog,
+    QCheckBox,
 )
 
+from ML_TAB.Steps.Step3.detection_worker import BackgroundJobs, default_background_jobs
 from .variable_selector_dialog import VariableSelectorDialog
-from .line_plot_utils import plot_line_multi, IGNORED_COLUMNS
+from .line_plot_utils import IGNORED_COLUMNS
+from .plot_backends import HAS_PYQTGRAPH, choose_backend, create_backend
+from .frame_cache import PreparedFrame, get_prepared_frame
+from .lod_pyramid import PyramidBuildWorker, get_cached_pyramids, put_cached_pyramids
+from .resample_cache import base_step_ns, choose_interval, resample_frame
 
 
 class DataLinePlotDialog(QDialog):
@@ -34,7 +36,13 @@ class DataLinePlotDialog(QDialog):
     - Combobox chọn nguồn: Raw data / Cleaned data
     - Chọn nhiều biến để overlay
     - Lọc theo Datetime nếu có
-    - Dùng plot_line_multi() để vẽ
+    - Dùng plot_line_multi() để vẽ (backend matplotlib); dữ liệu lớn có thể vẽ bằng
+      pyqtgraph (Auto theo số điểm), xuất ảnh luôn qua matplotlib
+    - Pyramid min/max/mean cho mỗi nguồn được dựng ở background (cache theo data_version),
+      có rồi thì zoom / pan chỉ tốn O(pixel)
+    - Kết quả Step 3 (outlier_stores, nếu có) được đánh dấu trên line của biến đang vẽ
+    - Resample Auto: khoảng thời gian dài -> vẽ mean + dải min–max theo bucket (1min / 1h / 1D ...)
+      chọn theo độ dài khoảng và bề rộng biểu đồ; aggregate cache LRU theo (biến, khoảng, version)
     """
 
     def __init__(
@@ -42,6 +50,10 @@ class DataLinePlotDialog(QDialog):
         raw_df: Optional[pd.DataFrame],
         cleaned_df: Optional[pd.DataFrame],
         parent=None,
+        data_version: int = 0,
+        memmap_dir: Optional[str] = None,
+        outlier_stores: Optional[Dict[str, object]] = None,
+        jobs: Optional[BackgroundJobs] = None,
     ):
         super().__init__(parent)
         self.setWindowFlags(self.windowFlags() | Qt.WindowMinMaxButtonsHint | Qt.WindowSystemMenuHint)
@@ -50,11 +62,28 @@ class DataLinePlotDialog(QDialog):
 
         self.raw_df = raw_df
         self.cleaned_df = cleaned_df
+        # {detector: OutlierResultStore} của lần Detect Outlier gần nhất (row_index = nhãn dòng)
+        self.outlier_stores = outlier_stores or None
 
         self.current_df: Optional[pd.DataFrame] = None
+        self.prepared: Optional[PreparedFrame] = None
         self.plot_columns: List[str] = []
         self.selected_vars: List[str] = []
         self.scales: Dict[str, float] = {}
+        self.backend = None
+        self._backends: Dict[str, object] = {}
+
+        # LOD pyramid theo (nguồn, data_version); memmap_dir != None -> lưu ra đĩa
+        self.data_version = data_version
+        self.memmap_dir = memmap_dir
+        self.pyramids: Dict[str, object] = {}
+        self._pyr_key = None
+        self._pyr_threads: List[QThread] = []
+        self._pyr_workers: List[PyramidBuildWorker] = []
+        self._pyr_pending: set = set()  # (key, biến) đang dựng ở background
+        self._jobs = jobs               # giữ thread pyramid còn chạy khi dialog đóng
+        self._step_ns = 0               # bước lấy mẫu của nguồn hiện tại
+        self._interval = None           # (nhãn, ns) nếu lần vẽ gần nhất dùng dữ liệu resample
 
         main_layout = QVBoxLayout(self)
 
@@ -97,23 +126,60 @@ class DataLinePlotDialog(QDialog):
         self.btn_scale.clicked.connect(self.open_scale_dialog)
         control_layout.addWidget(self.btn_scale)
 
+        # Backend vẽ: Auto chọn pyqtgraph khi nhiều điểm (nếu có cài)
+        self.cboBackend = QComboBox(self)
+        self.cboBackend.addItem("Auto", userData="auto")
+        self.cboBackend.addItem("Matplotlib", userData="matplotlib")
+        self.cboBackend.addItem("pyqtgraph", userData="pyqtgraph")
+        if not HAS_PYQTGRAPH:
+            self.cboBackend.model().item(2).setEnabled(False)
+        self.cboBackend.currentIndexChanged.connect(self.plot_selected_variables)
+        control_layout.addWidget(QLabel("Backend:"))
+        control_layout.addWidget(self.cboBackend)
+
+        # Resample: Auto (theo độ dài khoảng) / Raw (luôn vẽ dữ liệu gốc)
+        self.cboResample = QComboBox(self)
+        self.cboResample.addItem("Auto", userData="auto")
+        self.cboResample.addItem("Raw", userData="raw")
+        self.cboResample.currentIndexChanged.connect(self.plot_selected_variables)
+        self.lblInterval = QLabel("")
+        control_layout.addWidget(QLabel("Resample:"))
+        control_layout.addWidget(self.cboResample)
+        control_layout.addWidget(self.lblInterval)
+
+        # Marker outlier từ Step 3
+        self.chkOutliers = QCheckBox("⚑ Outliers")
+        self.chkOutliers.setEnabled(self.outlier_stores is not None)
+        self.chkOutliers.setChecked(self.outlier_stores is not None)
+        if self.outlier_stores is None:
+            self.chkOutliers.setToolTip("Chạy Step 3 (Detect Outlier) để có marker.")
+        self.chkOutliers.toggled.connect(self.plot_selected_variables)
+        control_layout.addWidget(self.chkOutliers)
+
+        self.btn_export = QPushButton("💾 Export")
+        self.btn_export.clicked.connect(self._on_export)
+        control_layout.addWidget(self.btn_export)
+
         control_layout.addStretch()
         main_layout.addLayout(control_layout)
 
-        # === MATPLOTLIB CANVAS + TOOLBAR ===
-        self.figure = Figure(figsize=(6, 4))
-        self.canvas = FigureCanvas(self.figure)
-        self._cid_scroll = self.canvas.mpl_connect("scroll_event", self._on_scroll)
-
-        self.ax = self.figure.add_subplot(111)
-
-        self.toolbar = NavigationToolbar(self.canvas, self)
-        main_layout.addWidget(self.toolbar)
-        main_layout.addWidget(self.canvas, 1)
+        # === VÙNG VẼ (widget của backend) ===
+        self.plot_layout = QVBoxLayout()
+        main_layout.addLayout(self.plot_layout, 1)
+        self._set_backend("matplotlib")
 
         # Kết nối signal
         self.cboSource.currentIndexChanged.connect(self._on_source_changed)
 
+        # Sửa khoảng thời gian -> tự vẽ lại, nhưng gom các thay đổi liên tiếp (debounce)
+        self._redraw_timer = QTimer(self)
+        self._redraw_timer.setSingleShot(True)
+        self._redraw_timer.setInterval(300)
+        self._redraw_timer.timeout.connect(self.plot_selected_variables)
+        self._time_sync = False
+        self.start_time_edit.dateTimeChanged.connect(self._on_time_edited)
+        self.end_time_edit.dateTimeChanged.connect(self._on_time_edited)
+
         # Init
         self._on_source_changed()
 
@@ -128,37 +194,29 @@ class DataLinePlotDialog(QDialog):
     def _on_source_changed(self):
         df = self._current_df_raw()
         self.current_df = None
+        self.prepared = None
         self.plot_columns = []
 
         if df is None or df.empty:
             self._clear_plot()
             return
 
-        df = df.copy()
-
-        # Tìm cột Datetime (nếu có)
-        datetime_col = None
-        for col in df.columns:
-            if col.lower() in ("datetime", "date_time"):
-                datetime_col = col
-                break
+        # DF đã parse Datetime + sort, cache theo (nguồn, data_version)
+        pf = get_prepared_frame(self.cboSource.currentData(), self.data_version, df)
+        df = pf.df
 
-        if datetime_col is not None:
-            df[datetime_col] = pd.to_datetime(df[datetime_col], errors="coerce")
-            df = df.dropna(subset=[datetime_col])
-            if not df.empty:
-                min_time = df[datetime_col].min()
-                max_time = df[datetime_col].max()
-                self.start_time_edit.setDateTime(QDateTime(min_time))
-                self.end_time_edit.setDateTime(QDateTime(max_time))
+        time_range = pf.time_range
+        self._time_sync = True          # đặt giá trị bằng code: không kích hoạt debounce
+        if time_range is not None:
+            self.start_time_edit.setDateTime(QDateTime(time_range[0].to_pydatetime()))
+            self.end_time_edit.setDateTime(QDateTime(time_range[1].to_pydatetime()))
         else:
             now = QDateTime.currentDateTime()
             self.start_time_edit.setDateTime(now)
             self.end_time_edit.setDateTime(now)
+        self._time_sync = False
 
-        # Lọc cột numeric
-        numeric_cols = df.select_dtypes(include=["number"]).columns.tolist()
-        numeric_cols = [c for c in numeric_cols if c.lower() not in IGNORED_COLUMNS]
+        numeric_cols = pf.numeric_cols
 
         if not numeric_cols:
             self._clear_plot()
@@ -166,12 +224,17 @@ class DataLinePlotDialog(QDialog):
             return
 
         self.current_df = df
+        self.prepared = pf
         self.plot_columns = numeric_cols
+        self._step_ns = base_step_ns(pf.t_ns)
 
         # Nếu chưa chọn biến -> mặc định chọn hết
         if not self.selected_vars:
             self.selected_vars = numeric_cols.copy()
 
+        self.pyramids = {}
+        self._request_pyramids()
+
         self.plot_selected_variables()
 
     # ---------- Dialog chọn biến ----------
@@ -183,6 +246,7 @@ class DataLinePlotDialog(QDialog):
         dlg = VariableSelectorDialog(self.plot_columns, self.selected_vars, self)
         if dlg.exec():
             self.selected_vars = dlg.get_selected_variables()
+            self._request_pyramids()        # chỉ dựng thêm cho biến mới chọn
             self.plot_selected_variables()
     def open_scale_dialog(self):
         if not self.selected_vars:
@@ -194,10 +258,41 @@ class DataLinePlotDialog(QDialog):
             self.scales = dlg.get_scales()
             self.plot_selected_variables()
 
+    def _on_time_edited(self, *_):
+        if not self._time_sync and self.current_df is not None:
+            self._redraw_timer.start()  # restart -> chỉ lần sửa cuối cùng được vẽ
+
+    # ---------- Backend vẽ ----------
+    def _set_backend(self, name: str):
+        """Mỗi backend chỉ tạo một lần rồi ẩn / hiện (đổi qua lại không phải dựng lại widget)."""
+        if self.backend is not None and self.backend.name == name:
+            return
+        if self.backend is not None:
+            self.backend.widget.hide()
+        if name not in self._backends:
+            self._backends[name] = create_backend(name, self)
+            self.plot_layout.addWidget(self._backends[name].widget)
+        self.backend = self._backends[name]
+        self.backend.widget.show()
+
+    def _on_export(self):
+        if self.backend is None or self.current_df is None:
+            QMessageBox.warning(self, "Chưa có dữ liệu", "Chưa có biểu đồ để xuất.")
+            return
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Lưu biểu đồ", "line_chart.png", "PNG (*.png);;SVG (*.svg);;PDF (*.pdf)"
+        )
+        if not path:
+            return
+        try:
+            self.backend.export(path)
+        except Exception as e:
+            QMessageBox.critical(self, "Lỗi export", str(e))
+
     # ---------- Xóa plot ----------
     def _clear_plot(self):
-        self.figure.clear()
-        self.canvas.draw_idle()
+        for backend in self._backends.values():
+            backend.clear()
 
     # ---------- Vẽ line cho các biến đã chọn ----------
     def plot_selected_variables(self):
@@ -210,89 +305,136 @@ class DataLinePlotDialog(QDialog):
             QMessageBox.information(self, "Thông báo", "Hãy chọn ít nhất 1 biến để vẽ.")
             return
 
-        # Lọc theo thời gian nếu có Datetime
-        datetime_col = None
-        for col in df.columns:
-            if col.lower() in ("datetime", "date_time"):
-                datetime_col = col
-                break
+        # Lọc theo thời gian nếu có Datetime (Datetime đã sort -> searchsorted, lát iloc)
+        datetime_col = self.prepared.datetime_col
 
         df_filtered = df
         if datetime_col is not None:
             start_dt = self.start_time_edit.dateTime().toPython()
             end_dt = self.end_time_edit.dateTime().toPython()
-            mask = (df[datetime_col] >= start_dt) & (df[datetime_col] <= end_dt)
-            df_filtered = df.loc[mask]
+            df_filtered = self.prepared.time_slice(start_dt, end_dt)
             if df_filtered.empty:
                 QMessageBox.information(self, "Thông báo", "Khoảng thời gian không có dữ liệu.")
                 self._clear_plot()
                 return
 
-        # Gọi hàm line riêng
-        self.figure.clear()
-        self.ax = self.figure.add_subplot(111)
-
-        plot_line_multi(
-            ax=self.ax,
-            df=df_filtered,
-            variables=self.selected_vars,
-            datetime_col=datetime_col,
-            scales=self.scales,
-            source_text=self.cboSource.currentText(),
+        # định danh dữ liệu: cùng nguồn + cùng khoảng thời gian -> không phải set_data lại
+        data_key = (self._pyr_key, len(df_filtered),
+                    df_filtered.index[0] if len(df_filtered) else None)
+
+        # Khoảng dài -> vẽ mean theo bucket + dải min–max (aggregate lấy từ cache)
+        plot_df, bands, pyramids = df_filtered, None, self.pyramids
+        self._interval = self._pick_interval(df_filtered, datetime_col)
+        if self._interval is not None:
+            label, ns = self._interval
+            plot_df, bands = resample_frame(
+                self.cboSource.currentData(), self.data_version, self.prepared.t_ns, df,
+                self.selected_vars, datetime_col, ns, start_dt, end_dt,
+            )
+            data_key = (label,) + data_key
+            pyramids = None             # pyramid dựng trên dữ liệu gốc, không dùng cho bảng mean
+            self.lblInterval.setText(f"≈ {label}")
+        else:
+            self.lblInterval.setText("")
+
+        n_points = len(plot_df) * len(self.selected_vars)
+        self._set_backend(choose_backend(n_points, self.cboBackend.currentData()))
+        self.backend.draw(
+            plot_df,
+            self.selected_vars,
+            datetime_col,
+            self.scales,
+            self.cboSource.currentText(),
+            data_key=data_key,
+            pyramids=pyramids,
+            outliers=self.outlier_stores if self.chkOutliers.isChecked() else None,
+            bands=bands,
+            marker_df=df_filtered,
         )
 
-        self.canvas.draw_idle()
-    def _on_scroll(self, event):
+    def _pick_interval(self, df_filtered: pd.DataFrame, datetime_col: Optional[str]):
+        """(nhãn, ns) khi Resample = Auto và khoảng đủ dài so với bề rộng biểu đồ, ngược lại None."""
+        if self.cboResample.currentData() != "auto" or datetime_col is None or len(df_filtered) < 2:
+            return None
+        t = df_filtered[datetime_col]
+        span = int((t.iloc[-1] - t.iloc[0]).value)
+        width = self.backend.widget.width() if self.backend is not None else 0
+        return choose_interval(span, max(width, 400), self._step_ns)
+
+    # ---------- LOD pyramid (background) ----------
+    def _request_pyramids(self):
         """
-        Zoom in/out khi cuộn con lăn chuột trên biểu đồ.
-        - Cuộn lên: zoom in (phóng to)
-        - Cuộn xuống: zoom out (thu nhỏ)
+        Pyramid chỉ cho các biến đang chọn: lấy từ cache LRU, biến còn thiếu dựng ở background
+        (chọn thêm biến sau -> chỉ dựng phần thiếu). Dựng trên PreparedFrame.df (đọc thẳng cột).
         """
-        # Nếu chuột không nằm trên trục vẽ thì bỏ qua
-        if event.inaxes != self.ax:
+        if self.prepared is None:
             return
-
-        base_scale = 1.2  # hệ số zoom
-
-        # Xác định hướng zoom
-        if event.button == "up":
-            scale_factor = 1 / base_scale   # zoom in
-        elif event.button == "down":
-            scale_factor = base_scale       # zoom out
-        else:
+        key = (self.cboSource.currentData(), self.data_version)
+        if key != self._pyr_key:
+            self._pyr_key = key
+            self.pyramids = {}
+        self.pyramids.update(get_cached_pyramids(key, self.selected_vars))
+        missing = [v for v in self.selected_vars
+                   if v not in self.pyramids and (key, v) not in self._pyr_pending]
+        if not missing:
             return
 
-        ax = self.ax
-
-        # Lấy tọa độ điểm mà con trỏ đang hover
-        xdata = event.xdata
-        ydata = event.ydata
-        if xdata is None or ydata is None:
+        self._pyr_pending.update((key, v) for v in missing)
+        thread = QThread()      # không parent: đóng dialog không hủy thread đang chạy
+        worker = PyramidBuildWorker(key, self.prepared.df, missing, self.prepared.datetime_col, self.memmap_dir)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.built.connect(self._on_pyramids_built)
+        worker.failed.connect(self._on_pyramid_failed)
+        worker.finished.connect(thread.quit)
+        thread.finished.connect(self._on_pyramid_thread_done)   # slot của dialog: chạy trên GUI thread
+        thread.start()
+        self._pyr_threads.append(thread)
+        self._pyr_workers.append(worker)
+
+    def _on_pyramid_thread_done(self):
+        thread = self.sender()
+        if thread not in self._pyr_threads:
             return
-
-        # Lấy phạm vi hiện tại
-        x_left, x_right = ax.get_xlim()
-        y_bottom, y_top = ax.get_ylim()
-
-        # Tính kích thước mới theo scale
-        x_range = (x_right - x_left) * scale_factor
-        y_range = (y_top - y_bottom) * scale_factor
-
-        # Tỷ lệ tương đối: thông minh, giữ điểm zoom tại vị trí trỏ chuột
-        relx = (x_right - xdata) / (x_right - x_left)
-        rely = (y_top - ydata) / (y_top - y_bottom)
-
-        new_x_left = xdata - x_range * (1 - relx)
-        new_x_right = xdata + x_range * relx
-        new_y_bottom = ydata - y_range * (1 - rely)
-        new_y_top = ydata + y_range * rely
-
-        # Áp dụng zoom
-        ax.set_xlim(new_x_left, new_x_right)
-        ax.set_ylim(new_y_bottom, new_y_top)
-
-        # Vẽ lại
-        self.canvas.draw_idle()
+        i = self._pyr_threads.index(thread)
+        worker = self._pyr_workers.pop(i)
+        self._pyr_threads.pop(i)
+        self._pyr_pending.difference_update((worker.key, v) for v in worker.variables)
+        self._release_pyramid_thread(thread, worker)
+
+    def _release_pyramid_thread(self, thread: QThread, worker: PyramidBuildWorker):
+        # Thread được deleteLater khi dừng hẳn (ngay, nếu đã dừng); worker chỉ bỏ tham chiếu
+        jobs = self._jobs if self._jobs is not None else default_background_jobs()
+        jobs.adopt(thread, worker)
+
+    def _on_pyramid_failed(self, msg: str):
+        # Pyramid chỉ để vẽ nhanh: lỗi -> vẫn vẽ bằng dữ liệu gốc, báo trên thanh control
+        print(f"[UI] Step 4 - LOD pyramid build failed: {msg}")
+        self.lblInterval.setText("LOD pyramid lỗi — vẽ dữ liệu gốc")
+
+    def _on_pyramids_built(self, key, pyramids):
+        put_cached_pyramids(key, pyramids)
+        if key != self._pyr_key:
+            return                      # nguồn đã đổi trong lúc dựng
+        self.pyramids.update(pyramids)
+        if self.backend is not None and self._interval is None:
+            self.backend.set_pyramids(self.pyramids)
+
+    def done(self, result: int):
+        self._redraw_timer.stop()
+        for backend in self._backends.values():
+            backend.shutdown()
+        # Không chờ pyramid đang dựng: ngắt tín hiệu tới dialog, worker dừng sau biến hiện tại
+        # (kiểm tra cờ cancel giữa các biến); thread + worker giao cho BackgroundJobs tới khi xong
+        for thread, worker in zip(self._pyr_threads, self._pyr_workers):
+            worker.built.disconnect(self._on_pyramids_built)
+            worker.failed.disconnect(self._on_pyramid_failed)
+            thread.finished.disconnect(self._on_pyramid_thread_done)
+            worker.cancel()
+            self._release_pyramid_thread(thread, worker)
+        self._pyr_threads, self._pyr_workers = [], []
+        self._pyr_pending.clear()
+        super().done(result)
 
 
 class SimpleScaleDialog(QDialog):
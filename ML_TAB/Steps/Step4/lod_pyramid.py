@@ -0,0 +1,344 @@
+# file: ML_TAB/Steps/Step4/lod_pyramid.py
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PySide6.QtCore import QObject, Signal, Slot
+
+from .line_plot_utils import minmax_decimate, plot_x_values
+
+# Level 0 gom BASE điểm gốc / bucket, mỗi level sau gom FACTOR bucket của level trước
+BASE = 32
+FACTOR = 4
+
+# Level 0 dựng theo từng khối LEVEL0_CHUNK bucket (bản float64 tạm chỉ ~16 MB mỗi khối)
+LEVEL0_CHUNK = 1 << 16
+
+# Số pyramid (mỗi entry = một biến của một phiên bản dữ liệu) giữ trong cache
+PYRAMID_CACHE_SIZE = 64
+
+
+@dataclass
+class PyramidLevel:
+    """
+    Một level của pyramid (mỗi phần tử là một bucket gồm `size` điểm gốc liên tiếp):
+    - i_min / i_max: vị trí (trong mảng gốc) của điểm min / max -> lấy lại x chính xác
+    - y_min / y_max / y_mean: float32
+    - count: số điểm không NaN (0 = bucket trống)
+    """
+    size: int
+    i_min: np.ndarray
+    i_max: np.ndarray
+    y_min: np.ndarray
+    y_max: np.ndarray
+    y_mean: np.ndarray
+    count: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(a.nbytes for a in (self.i_min, self.i_max, self.y_min,
+                                          self.y_max, self.y_mean, self.count)))
+
+
+def _file_stem(name: str) -> str:
+    """
+    Tên file an toàn cho tên tag bất kỳ (vd. 'AH_O/L_FG_TEMP'): ký tự lạ -> '_',
+    thêm hash ngắn của tên gốc để 'A/B' và 'A_B' không ghi đè nhau.
+    """
+    slug = re.sub(r"[^\w.-]+", "_", name).strip("_.")[:80]
+    return f"{slug}-{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+
+
+def key_memmap_dir(memmap_dir: Optional[str], key: Tuple) -> Optional[str]:
+    """Thư mục con riêng cho mỗi key (nguồn, version) -> các nguồn không ghi đè file của nhau."""
+    if memmap_dir is None:
+        return None
+    return os.path.join(memmap_dir, _file_stem("_".join(map(str, key))))
+
+
+def _store(arr: np.ndarray, memmap_dir: Optional[str], name: str) -> np.ndarray:
+    """Ghi mảng ra file .npy và mở lại dạng memmap (nếu có memmap_dir)."""
+    if memmap_dir is None:
+        return arr
+    os.makedirs(memmap_dir, exist_ok=True)
+    path = os.path.join(memmap_dir, f"{_file_stem(name)}.npy")
+    mm = np.lib.format.open_memmap(path, mode="w+", dtype=arr.dtype, shape=arr.shape)
+    mm[...] = arr
+    mm.flush()
+    return np.load(path, mmap_mode="r")
+
+
+def _column_values(s: pd.Series) -> np.ndarray:
+    """Giá trị của cột, không copy nếu cột đã là numpy số (view vào DataFrame)."""
+    if isinstance(s.dtype, np.dtype) and s.dtype.kind in "fiub":
+        return s.to_numpy()
+    return s.to_numpy(dtype=float, na_value=np.nan)
+
+
+def _level0_block(y: np.ndarray, offset: int) -> PyramidLevel:
+    n = len(y)
+    nb = -(-n // BASE)
+    yb = np.full(nb * BASE, np.nan, dtype=np.float64)
+    yb[:n] = y
+    yb = yb.reshape(nb, BASE)
+
+    valid = ~np.isnan(yb)
+    count = valid.sum(axis=1).astype(np.int32)
+    j_min = np.where(valid, yb, np.inf).argmin(axis=1)
+    j_max = np.where(valid, yb, -np.inf).argmax(axis=1)
+    rows = np.arange(nb)
+    with np.errstate(invalid="ignore"):
+        mean = np.where(valid, yb, 0.0).sum(axis=1) / count
+    return PyramidLevel(
+        size=BASE,
+        i_min=offset + rows * BASE + j_min,
+        i_max=offset + rows * BASE + j_max,
+        y_min=yb[rows, j_min].astype(np.float32),
+        y_max=yb[rows, j_max].astype(np.float32),
+        y_mean=mean.astype(np.float32),
+        count=count,
+    )
+
+
+def _level0(y: np.ndarray) -> PyramidLevel:
+    """Level 0 theo từng khối dòng -> không cần bản float64 của cả cột."""
+    step = BASE * LEVEL0_CHUNK
+    parts = [_level0_block(y[a:a + step], a) for a in range(0, len(y), step)] or [_level0_block(y[:0], 0)]
+    if len(parts) == 1:
+        return parts[0]
+    return PyramidLevel(
+        size=BASE,
+        **{f: np.concatenate([getattr(p, f) for p in parts])
+           for f in ("i_min", "i_max", "y_min", "y_max", "y_mean", "count")},
+    )
+
+
+def _coarsen(lv: PyramidLevel) -> PyramidLevel:
+    """Gom FACTOR bucket liền nhau của level trước thành một bucket."""
+    nb = -(-len(lv.count) // FACTOR)
+    pad = nb * FACTOR - len(lv.count)
+
+    def grp(a, fill):
+        return np.concatenate([a, np.full(pad, fill, dtype=a.dtype)]).reshape(nb, FACTOR)
+
+    cnt = grp(lv.count, 0)
+    empty = cnt == 0
+    ymin = np.where(empty, np.inf, grp(lv.y_min, np.nan))
+    ymax = np.where(empty, -np.inf, grp(lv.y_max, np.nan))
+    j_min = ymin.argmin(axis=1)
+    j_max = ymax.argmax(axis=1)
+    rows = np.arange(nb)
+
+    count = cnt.sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        mean = (np.where(empty, 0.0, grp(lv.y_mean, np.nan)) * cnt).sum(axis=1) / count
+    return PyramidLevel(
+        size=lv.size * FACTOR,
+        i_min=grp(lv.i_min, 0)[rows, j_min],
+        i_max=grp(lv.i_max, 0)[rows, j_max],
+        y_min=ymin[rows, j_min].astype(np.float32),
+        y_max=ymax[rows, j_max].astype(np.float32),
+        y_mean=mean.astype(np.float32),
+        count=count.astype(np.int32),
+    )
+
+
+class SeriesPyramid:
+    """
+    Pyramid min/max/mean đa phân giải cho một biến (x đã sort tăng dần, dùng chung).
+    Truy vấn một khoảng x bất kỳ ở độ phân giải màn hình tốn O(pixel), không phụ thuộc n:
+    chọn level có số bucket trong khoảng nằm trong [pixels, FACTOR*pixels].
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, memmap_dir: Optional[str] = None, name: str = "y"):
+        self.x = x
+        # dữ liệu gốc vẫn cần khi zoom sâu (đọc thẳng vài nghìn điểm): giữ tham chiếu tới
+        # cột của DataFrame đã chuẩn bị (không copy), chỉ ép float cho đoạn được đọc
+        self.y = y
+        self.levels: List[PyramidLevel] = []
+        lv = _level0(y)
+        while True:
+            if memmap_dir is not None:
+                tag = f"{name}_L{len(self.levels)}"
+                lv = PyramidLevel(
+                    size=lv.size,
+                    **{f: _store(getattr(lv, f), memmap_dir, f"{tag}_{f}")
+                       for f in ("i_min", "i_max", "y_min", "y_max", "y_mean", "count")},
+                )
+            self.levels.append(lv)
+            if len(lv.count) <= 256:
+                break
+            lv = _coarsen(lv)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(lv.nbytes for lv in self.levels)
+
+    def query(self, x0: float, x1: float, pixels: int, mode: str = "minmax") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Điểm để vẽ khoảng [x0, x1] với ~pixels bucket:
+            mode='minmax' -> 2 điểm / bucket (giữ đỉnh)
+            mode='mean'   -> 1 điểm / bucket (giữa bucket)
+        """
+        x = self.x
+        a = max(int(np.searchsorted(x, x0, side="left")) - 1, 0)
+        b = min(int(np.searchsorted(x, x1, side="right")) + 1, len(x))
+        n = b - a
+        pixels = max(int(pixels), 1)
+
+        # vùng đủ nhỏ: đọc thẳng dữ liệu gốc (n <= 2*BASE*pixels -> vẫn O(pixel))
+        if n <= 2 * BASE * pixels:
+            return minmax_decimate(x[a:b], np.asarray(self.y[a:b], dtype=float), pixels)
+
+        lv = self.levels[0]
+        for cand in self.levels:
+            if n // cand.size < pixels:
+                break
+            lv = cand
+        ba, bb = a // lv.size, -(-b // lv.size)
+        keep = np.asarray(lv.count[ba:bb]) > 0
+
+        if mode == "mean":
+            start = np.arange(ba, bb)[keep] * lv.size
+            mid = np.minimum(start + lv.size // 2, len(x) - 1)
+            return x[mid], np.asarray(lv.y_mean[ba:bb], dtype=float)[keep]
+
+        i_min = np.asarray(lv.i_min[ba:bb])[keep]
+        i_max = np.asarray(lv.i_max[ba:bb])[keep]
+        y_min = np.asarray(lv.y_min[ba:bb], dtype=float)[keep]
+        y_max = np.asarray(lv.y_max[ba:bb], dtype=float)[keep]
+        min_first = i_min <= i_max
+        idx = np.column_stack([np.where(min_first, i_min, i_max), np.where(min_first, i_max, i_min)]).ravel()
+        yy = np.column_stack([np.where(min_first, y_min, y_max), np.where(min_first, y_max, y_min)]).ravel()
+        # level có thể cho tới FACTOR bucket / pixel -> gom lại còn ~2 điểm / pixel
+        return minmax_decimate(x[idx], yy, pixels)
+
+
+def sorted_x(
+    df: pd.DataFrame, datetime_col: Optional[str], memmap_dir: Optional[str] = None
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """(x đã sort tăng dần, thứ tự dòng | None nếu df đã đúng thứ tự) dùng chung cho mọi biến."""
+    x, _ = plot_x_values(df, datetime_col)
+    order = None
+    if len(x) > 1 and np.any(x[1:] < x[:-1]):
+        order = np.argsort(x, kind="stable")
+        x = x[order]
+    if memmap_dir is not None:
+        x = _store(x, memmap_dir, "x")
+    return x, order
+
+
+def build_pyramids(
+    df: pd.DataFrame,
+    variables: List[str],
+    datetime_col: Optional[str],
+    memmap_dir: Optional[str] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    x_order: Optional[Tuple[np.ndarray, Optional[np.ndarray]]] = None,
+) -> Dict[str, SeriesPyramid]:
+    """
+    Dựng pyramid cho từng biến của df (x = Datetime nếu có, sort một lần dùng chung).
+    df nên là PreparedFrame.df (đã sort) -> mỗi pyramid đọc thẳng cột, không copy.
+    x_order: kết quả sorted_x() đã có (dựng thêm biến cho cùng df không phải tính lại x).
+    should_stop() -> True thì dừng sau biến đang dựng (trả về các biến đã xong).
+    """
+    x, order = x_order if x_order is not None else sorted_x(df, datetime_col, memmap_dir)
+
+    out: Dict[str, SeriesPyramid] = {}
+    for var in variables:
+        if should_stop is not None and should_stop():
+            break
+        if var not in df.columns:
+            continue
+        y = _column_values(df[var])
+        if order is not None:
+            y = y[order]
+        out[var] = SeriesPyramid(x, y, memmap_dir=memmap_dir, name=var)
+    return out
+
+
+# ---------- Cache LRU theo (nguồn, phiên bản dữ liệu, biến) ----------
+_PYRAMID_CACHE: "OrderedDict[Tuple, SeriesPyramid]" = OrderedDict()
+
+
+def get_cached_pyramids(key: Tuple, variables: List[str]) -> Dict[str, SeriesPyramid]:
+    """key = (nguồn, version) -> {biến: pyramid} của các biến đã có trong cache."""
+    out: Dict[str, SeriesPyramid] = {}
+    for var in variables:
+        k = key + (var,)
+        pyr = _PYRAMID_CACHE.get(k)
+        if pyr is not None:
+            _PYRAMID_CACHE.move_to_end(k)
+            out[var] = pyr
+    return out
+
+
+def put_cached_pyramids(key: Tuple, pyramids: Dict[str, SeriesPyramid]):
+    """Thêm pyramid của key = (nguồn, version); phiên bản cũ của cùng nguồn bị bỏ, giữ tối đa
+    PYRAMID_CACHE_SIZE biến (bỏ biến lâu không dùng nhất)."""
+    for k in [k for k in _PYRAMID_CACHE if k[0] == key[0] and k[1] != key[1]]:
+        del _PYRAMID_CACHE[k]
+    for var, pyr in pyramids.items():
+        _PYRAMID_CACHE[key + (var,)] = pyr
+        _PYRAMID_CACHE.move_to_end(key + (var,))
+    while len(_PYRAMID_CACHE) > PYRAMID_CACHE_SIZE:
+        _PYRAMID_CACHE.popitem(last=False)
+
+
+# x dùng chung của phiên bản dữ liệu hiện tại của mỗi nguồn: nguồn -> (version, (x, order))
+_X_CACHE: Dict[str, Tuple[object, Tuple[np.ndarray, Optional[np.ndarray]]]] = {}
+
+
+def shared_sorted_x(key: Tuple, df: pd.DataFrame, datetime_col: Optional[str],
+                    memmap_dir: Optional[str] = None) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """sorted_x() cache theo key = (nguồn, version): mọi pyramid của cùng phiên bản chung một x."""
+    hit = _X_CACHE.get(key[0])
+    if hit is not None and hit[0] == key[1]:
+        return hit[1]
+    xo = sorted_x(df, datetime_col, memmap_dir)
+    _X_CACHE[key[0]] = (key[1], xo)
+    return xo
+
+
+class PyramidBuildWorker(QObject):
+    """
+    Dựng pyramid cho các biến được yêu cầu trong QThread riêng; phát `built(key, pyramids)`
+    khi xong. cancel() -> dừng sau biến đang dựng, không phát built.
+    """
+
+    built = Signal(object, object)
+    failed = Signal(str)
+    finished = Signal()
+
+    def __init__(self, key: Tuple, df: pd.DataFrame, variables: List[str],
+                 datetime_col: Optional[str], memmap_dir: Optional[str] = None):
+        super().__init__()
+        self.key = key
+        self.df = df
+        self.variables = variables
+        self.datetime_col = datetime_col
+        self.memmap_dir = key_memmap_dir(memmap_dir, key)
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    @Slot()
+    def run(self):
+        try:
+            xo = shared_sorted_x(self.key, self.df, self.datetime_col, self.memmap_dir)
+            pyr = build_pyramids(self.df, self.variables, self.datetime_col, self.memmap_dir,
+                                 should_stop=lambda: self._cancelled, x_order=xo)
+            if not self._cancelled:
+                self.built.emit(self.key, pyr)
+        except Exception as e:
+            self.failed.emit(str(e))
+        self.finished.emit()
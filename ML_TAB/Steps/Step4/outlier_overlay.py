@@ -0,0 +1,127 @@
+# file: ML_TAB/Steps/Step4/outlier_overlay.py
+
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# detector row-level (IsolationForest, LOF, ...) ghi column = "<row>": đánh dấu trên mọi biến đang vẽ
+ROW_LEVEL = "<row>"
+
+# Màu / marker cho từng detector (theo thứ tự tab của Step 3)
+MARKER_COLORS = [
+    "#d62728", "#ff7f0e", "#9467bd", "#8c564b", "#e377c2",
+    "#7f7f7f", "#bcbd22", "#17becf", "#1f77b4", "#2ca02c", "#000000",
+]
+
+
+class OutlierOverlay:
+    """
+    Điểm bị gắn cờ ở Step 3 (OutlierResultStore của từng detector) trên các biến đang vẽ.
+
+    Mỗi detector là 3 mảng song song, sort theo x:
+        x    : toạ độ x của điểm (cùng đơn vị với line của backend)
+        y    : giá trị biến tại dòng đó (CHƯA nhân scale)
+        var  : mã biến (chỉ số trong `variables`)
+    Dựng hoàn toàn bằng mảng: row_index -> vị trí trong df bằng Index.get_indexer
+    (dòng đã bị xoá / nằm ngoài khoảng thời gian -> -1 -> bỏ). Không tạo artist cho từng điểm.
+    """
+
+    def __init__(
+        self,
+        stores: Dict[str, object],
+        df: pd.DataFrame,
+        variables: List[str],
+        x_of: Callable[[pd.DataFrame], np.ndarray],
+    ):
+        """x_of(df_con) -> x của các dòng trong df_con (vd. plot_x_values của backend)."""
+        self.variables = [v for v in variables if v in df.columns]
+        self.points: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        if not self.variables or not stores or not df.index.is_unique:
+            return
+
+        var_idx = {v: j for j, v in enumerate(self.variables)}
+        nv = len(self.variables)
+        ys = [df[v].to_numpy(dtype=float, na_value=np.nan) for v in self.variables]
+
+        for name, store in stores.items():
+            if store is None or not len(store):
+                continue
+            pos = df.index.get_indexer(store.row_index)
+
+            # mã cột của store -> mã biến đang vẽ (-1 = không vẽ, -2 = row-level)
+            code_map = np.array(
+                [-2 if c == ROW_LEVEL else var_idx.get(c, -1) for c in store.columns] or [-1],
+                dtype=np.int64,
+            )
+            vcode = code_map[store.column_codes] if len(store.columns) else np.full(len(pos), -1)
+
+            cell = (pos >= 0) & (vcode >= 0)
+            row = (pos >= 0) & (vcode == -2)
+            p = np.concatenate([pos[cell], np.repeat(pos[row], nv)])
+            v = np.concatenate([vcode[cell], np.tile(np.arange(nv), int(row.sum()))])
+            if not len(p):
+                continue
+
+            y = np.empty(len(p), dtype=float)
+            for j in range(nv):
+                m = v == j
+                y[m] = ys[j][p[m]]
+            ok = ~np.isnan(y)
+            p, v, y = p[ok], v[ok], y[ok]
+            if not len(p):
+                continue
+
+            # x chỉ tính cho các dòng bị gắn cờ (unique), không cho cả df
+            upos, inv = np.unique(p, return_inverse=True)
+            x = np.asarray(x_of(df.iloc[upos]), dtype=float)[inv]
+            order = np.argsort(x, kind="stable")
+            self.points[name] = (x[order], y[order], v[order].astype(np.int32))
+
+    def __len__(self) -> int:
+        return sum(len(p[0]) for p in self.points.values())
+
+    def query(
+        self, x0: float, x1: float, pixels: int
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Marker trong khung [x0, x1], decimate theo cùng lưới pixel với line:
+        mỗi (biến, cột pixel) giữ tối đa điểm min và max -> <= 2 * pixels * số biến / detector.
+        Trả về {detector: (x, y chưa scale, mã biến)}.
+        """
+        pixels = max(int(pixels), 1)
+        out: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for name, (x, y, v) in self.points.items():
+            a = int(np.searchsorted(x, x0, side="left"))
+            b = int(np.searchsorted(x, x1, side="right"))
+            xs, ys, vs = x[a:b], y[a:b], v[a:b]
+            if len(xs) > 2 * pixels and x1 > x0:
+                bucket = np.clip(((xs - x0) / (x1 - x0) * pixels).astype(np.int64), 0, pixels - 1)
+                key = vs.astype(np.int64) * pixels + bucket
+                order = np.lexsort((ys, key))
+                k = key[order]
+                edge = k[1:] != k[:-1]
+                keep = order[np.r_[True, edge] | np.r_[edge, True]]   # điểm đầu (min) + cuối (max) mỗi nhóm
+                keep.sort()
+                xs, ys, vs = xs[keep], ys[keep], vs[keep]
+            out[name] = (xs, ys, vs)
+        return out
+
+    def scaled(
+        self, markers: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]], scales: Dict[str, float]
+    ) -> Dict[str, np.ndarray]:
+        """Kết quả query -> {detector: offsets (N, 2)} đã nhân scale của từng biến."""
+        factor = np.array([scales.get(v, 1.0) for v in self.variables] or [1.0], dtype=float)
+        return {
+            name: np.column_stack([xs, ys * factor[vs]]) if len(xs) else np.empty((0, 2))
+            for name, (xs, ys, vs) in markers.items()
+        }
+
+
+def overlay_key(stores: Optional[Dict[str, object]], data_key, variables: List[str]):
+    """Định danh overlay: cùng kết quả Step 3 + cùng dữ liệu + cùng biến -> dùng lại."""
+    if not stores:
+        return None
+    return (id(stores), data_key, tuple(variables))
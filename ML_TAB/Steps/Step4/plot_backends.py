@@ -0,0 +1,402 @@
+# file: ML_TAB/Steps/Step4/plot_backends.py
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_qtagg import (
+    FigureCanvasQTAgg as FigureCanvas,
+    NavigationToolbar2QT as NavigationToolbar,
+)
+from PySide6.QtWidgets import QWidget, QVBoxLayout
+
+from .line_plot_utils import plot_line_multi, update_line_multi, plot_x_values, CursorBlitter
+from .outlier_overlay import MARKER_COLORS, OutlierOverlay, overlay_key
+from .render_worker import AsyncRenderer
+
+# pyqtgraph là tuỳ chọn: không có thì chỉ dùng matplotlib
+try:
+    import pyqtgraph as pg
+    HAS_PYQTGRAPH = True
+except ImportError:
+    pg = None
+    HAS_PYQTGRAPH = False
+
+# Từ bao nhiêu điểm (số dòng x số biến) thì chế độ Auto chuyển sang pyqtgraph
+FAST_BACKEND_MIN_POINTS = 2_000_000
+
+
+def choose_backend(n_points: int, preferred: str = "auto") -> str:
+    """'matplotlib' hoặc 'pyqtgraph' theo lựa chọn của người dùng / số điểm cần vẽ."""
+    if preferred == "pyqtgraph" and HAS_PYQTGRAPH:
+        return "pyqtgraph"
+    if preferred == "auto" and HAS_PYQTGRAPH and n_points >= FAST_BACKEND_MIN_POINTS:
+        return "pyqtgraph"
+    return "matplotlib"
+
+
+def export_figure(
+    path: str,
+    df: pd.DataFrame,
+    variables: List[str],
+    datetime_col: Optional[str],
+    scales: Dict[str, float],
+    source_text: str,
+    size=(12, 5),
+    dpi: int = 150,
+) -> str:
+    """Xuất ảnh chất lượng cao bằng matplotlib (Agg, không cần cửa sổ), dùng cho mọi backend."""
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    plot_line_multi(ax, df, variables, datetime_col, scales, source_text)
+    ax.legend(loc="upper right", fontsize=7)
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+# ---------- Matplotlib (mặc định) ----------
+class MatplotlibBackend:
+    """
+    Figure + toolbar matplotlib: line giữ lại giữa các lần vẽ (LineDecimator),
+    cursor blitting, zoom bằng con lăn. Decimate khi zoom / pan / đổi khoảng thời gian
+    chạy trong worker thread (AsyncRenderer), yêu cầu cũ bị bỏ.
+    Marker outlier của Step 3 (nếu có): một scatter / detector, decimate cùng line.
+    Dữ liệu đã resample: line = mean, kèm dải min–max (bands) mỗi biến.
+    """
+
+    name = "matplotlib"
+
+    def __init__(self, parent=None):
+        self.figure = Figure(figsize=(6, 4))
+        self.canvas = FigureCanvas(self.figure)
+        self.toolbar = NavigationToolbar(self.canvas, parent)
+        self.ax = self.figure.add_subplot(111)
+        self.decimator = None
+        self.cursor: Optional[CursorBlitter] = None
+        self._overlay_key = None
+        self._band_key = None
+        self.canvas.mpl_connect("scroll_event", self._on_scroll)
+
+        self.widget = QWidget(parent)
+        self.renderer = AsyncRenderer(self.widget)
+        layout = QVBoxLayout(self.widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas, 1)
+
+    def draw(self, df, variables, datetime_col, scales, source_text, data_key=None, pyramids=None,
+             outliers=None, bands=None, marker_df=None):
+        """
+        outliers: {detector: OutlierResultStore} của Step 3 (None = không vẽ marker)
+        bands   : {biến: (min, max)} theo từng dòng của df (df là bảng mean đã resample)
+        marker_df: DF gốc để đặt marker khi df là bảng resample (mặc định = df)
+        """
+        new_overlay = self.decimator is None
+        if self.decimator is None:
+            # Lần đầu: dựng axes + line
+            self.figure.clear()
+            self.ax = self.figure.add_subplot(111)
+
+            # giữ tham chiếu: decimator vẽ lại vùng nhìn thấy khi zoom / pan
+            self.decimator = plot_line_multi(
+                ax=self.ax,
+                df=df,
+                variables=variables,
+                datetime_col=datetime_col,
+                scales=scales,
+                source_text=source_text,
+                pyramids=pyramids,
+                data_key=data_key,
+            )
+            self.decimator.renderer = self.renderer
+            self.cursor = CursorBlitter(self.canvas, self.ax)
+            self._overlay_key = None
+            self._band_key = None
+        else:
+            # Các lần sau: giữ axes + Line2D, chỉ cập nhật biến thay đổi
+            self.decimator.pyramids = pyramids or {}
+            changed = update_line_multi(
+                self.decimator,
+                df=df,
+                variables=variables,
+                datetime_col=datetime_col,
+                scales=scales,
+                source_text=source_text,
+                data_key=data_key,
+            )
+            new_overlay = False
+            if not changed and overlay_key(outliers, data_key, variables) == self._overlay_key \
+                    and self._bands_key(bands, data_key, variables) == self._band_key:
+                return
+
+        band_key = self._bands_key(bands, data_key, variables)
+        if band_key != self._band_key:
+            self._band_key = band_key
+            x = plot_x_values(df, datetime_col)[0] if bands else None
+            self.decimator.set_bands(x, bands)
+            self.decimator.relim()
+        self._update_overlay(marker_df if marker_df is not None else df,
+                             variables, datetime_col, outliers, data_key, force=new_overlay)
+        self.canvas.draw_idle()
+
+    @staticmethod
+    def _bands_key(bands, data_key, variables):
+        return (data_key, tuple(variables)) if bands else None
+
+    def _update_overlay(self, df, variables, datetime_col, outliers, data_key, force=False):
+        key = overlay_key(outliers, data_key, variables)
+        if key == self._overlay_key and not force:
+            return
+        self._overlay_key = key
+        overlay = None
+        if key is not None:
+            overlay = OutlierOverlay(outliers, df, variables,
+                                     lambda d: plot_x_values(d, datetime_col)[0])
+        self.decimator.set_overlay(overlay if overlay is not None and len(overlay) else None)
+
+        legend = self.ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        if self.decimator.markers:
+            self.ax.legend(handles=list(self.decimator.markers.values()), loc="upper left", fontsize=7)
+
+    def set_pyramids(self, pyramids):
+        if self.decimator is not None:
+            self.decimator.set_pyramids(pyramids)
+            self.canvas.draw_idle()
+
+    def clear(self):
+        if self.cursor is not None:
+            self.cursor.disconnect()
+        self.decimator = None
+        self.cursor = None
+        self._overlay_key = None
+        self._band_key = None
+        self.figure.clear()
+        self.canvas.draw_idle()
+
+    def export(self, path: str, dpi: int = 150) -> str:
+        self.figure.savefig(path, dpi=dpi)
+        return path
+
+    def shutdown(self):
+        self.renderer.shutdown()
+
+    def _on_scroll(self, event):
+        """
+        Zoom in/out khi cuộn con lăn chuột trên biểu đồ.
+        - Cuộn lên: zoom in (phóng to)
+        - Cuộn xuống: zoom out (thu nhỏ)
+        """
+        # Nếu chuột không nằm trên trục vẽ thì bỏ qua
+        if event.inaxes != self.ax:
+            return
+
+        base_scale = 1.2  # hệ số zoom
+
+        # Xác định hướng zoom
+        if event.button == "up":
+            scale_factor = 1 / base_scale   # zoom in
+        elif event.button == "down":
+            scale_factor = base_scale       # zoom out
+        else:
+            return
+
+        ax = self.ax
+
+        # Lấy tọa độ điểm mà con trỏ đang hover
+        xdata = event.xdata
+        ydata = event.ydata
+        if xdata is None or ydata is None:
+            return
+
+        # Lấy phạm vi hiện tại
+        x_left, x_right = ax.get_xlim()
+        y_bottom, y_top = ax.get_ylim()
+
+        # Tính kích thước mới theo scale
+        x_range = (x_right - x_left) * scale_factor
+        y_range = (y_top - y_bottom) * scale_factor
+
+        # Tỷ lệ tương đối: thông minh, giữ điểm zoom tại vị trí trỏ chuột
+        relx = (x_right - xdata) / (x_right - x_left)
+        rely = (y_top - ydata) / (y_top - y_bottom)
+
+        new_x_left = xdata - x_range * (1 - relx)
+        new_x_right = xdata + x_range * relx
+        new_y_bottom = ydata - y_range * (1 - rely)
+        new_y_top = ydata + y_range * rely
+
+        # Áp dụng zoom
+        ax.set_xlim(new_x_left, new_x_right)
+        ax.set_ylim(new_y_bottom, new_y_top)
+
+        # Vẽ lại
+        self.canvas.draw_idle()
+
+
+# ---------- pyqtgraph (nhanh, vẽ native Qt) ----------
+class PyqtgraphBackend:
+    """
+    PlotWidget của pyqtgraph: tự downsample theo 'peak' (giữ min/max) và chỉ vẽ phần
+    trong khung nhìn (clipToView) -> tương tác mượt với hàng trăm tag.
+    Trục thời gian: giây Unix (DateAxisItem). Xuất ảnh vẫn qua matplotlib (export_figure).
+    Marker outlier: một ScatterPlotItem / detector, query lại overlay khi đổi khoảng x.
+    Dữ liệu đã resample: dải min–max bằng FillBetweenItem.
+    """
+
+    name = "pyqtgraph"
+
+    def __init__(self, parent=None):
+        if not HAS_PYQTGRAPH:
+            raise ImportError("pyqtgraph chưa được cài")
+        self.widget = pg.PlotWidget(parent, axisItems={"bottom": pg.DateAxisItem()})
+        self.widget.setBackground("w")
+        self.plot = self.widget.getPlotItem()
+        self.plot.showGrid(x=True, y=True, alpha=0.3)
+        self.plot.setClipToView(True)
+        self.plot.setDownsampling(auto=True, mode="peak")
+        self.plot.addLegend()
+        self.items: Dict[str, object] = {}
+        self.series: Dict[str, tuple] = {}
+        self.scales: Dict[str, float] = {}
+        self.data_keys: Dict[str, object] = {}
+        self._last = None
+        self.overlay: Optional[OutlierOverlay] = None
+        self.scatters: Dict[str, object] = {}
+        self._overlay_key = None
+        self.bands: Dict[str, object] = {}
+        self.plot.sigXRangeChanged.connect(self._refresh_markers)
+
+    @staticmethod
+    def _x_values(df: pd.DataFrame, datetime_col: Optional[str]) -> np.ndarray:
+        if datetime_col is not None and datetime_col in df.columns:
+            t = df[datetime_col].to_numpy(dtype="datetime64[ns]").view(np.int64)
+            return t / 1e9
+        return df.index.to_numpy(dtype=float)
+
+    def draw(self, df, variables, datetime_col, scales, source_text, data_key=None, pyramids=None,
+             outliers=None, bands=None, marker_df=None):
+        self._last = (df, list(variables), datetime_col, dict(scales), source_text)
+        cols = [v for v in variables if v in df.columns]
+
+        for name in [n for n in self.items if n not in cols]:
+            self.plot.removeItem(self.items.pop(name))
+            for d in (self.series, self.scales, self.data_keys):
+                d.pop(name, None)
+
+        x = None
+        for i, name in enumerate(cols):
+            scale = scales.get(name, 1.0)
+            if name in self.items and self.data_keys.get(name) == data_key:
+                if self.scales.get(name) != scale:
+                    xs, y = self.series[name]
+                    self.items[name].setData(xs, y * scale)
+                    self.scales[name] = scale
+                continue
+            if x is None:
+                x = self._x_values(df, datetime_col)
+            y = df[name].to_numpy(dtype=float, na_value=np.nan)
+            self.series[name], self.scales[name], self.data_keys[name] = (x, y), scale, data_key
+            if name not in self.items:
+                pen = pg.mkPen(pg.intColor(len(self.items), hues=max(len(cols), 9)), width=1)
+                self.items[name] = self.plot.plot(
+                    x, y * scale, pen=pen, name=f"{name} (x{scale})", connect="finite"
+                )
+            else:
+                self.items[name].setData(x, y * scale)
+
+        self.plot.setTitle(f"Line chart — {source_text}")
+        self.plot.setLabel("bottom", datetime_col or "Index")
+        self.plot.setLabel("left", "Value")
+        self._update_bands(df, datetime_col, bands, scales)
+        self._update_overlay(marker_df if marker_df is not None else df,
+                             cols, datetime_col, outliers, data_key)
+
+    def _update_bands(self, df, datetime_col, bands, scales):
+        for item in self.bands.values():
+            self.plot.removeItem(item)
+        self.bands = {}
+        if not bands:
+            return
+        x = self._x_values(df, datetime_col)
+        for name, (lo, hi) in bands.items():
+            if name not in self.items:
+                continue
+            ok = np.isfinite(lo) & np.isfinite(hi)     # FillBetweenItem không chịu NaN
+            s = scales.get(name, 1.0)
+            color = self.items[name].opts["pen"].color()
+            color.setAlpha(50)
+            fill = pg.FillBetweenItem(pg.PlotCurveItem(x[ok], lo[ok] * s),
+                                      pg.PlotCurveItem(x[ok], hi[ok] * s), brush=pg.mkBrush(color))
+            fill.setZValue(-1)
+            self.plot.addItem(fill)
+            self.bands[name] = fill
+
+    # ---------- marker outlier ----------
+    def _update_overlay(self, df, variables, datetime_col, outliers, data_key):
+        key = overlay_key(outliers, data_key, variables)
+        if key != self._overlay_key:
+            self._overlay_key = key
+            for item in self.scatters.values():
+                self.plot.removeItem(item)
+            self.scatters = {}
+            self.overlay = None
+            if key is not None:
+                overlay = OutlierOverlay(outliers, df, variables, lambda d: self._x_values(d, datetime_col))
+                if len(overlay):
+                    self.overlay = overlay
+                    for i, name in enumerate(overlay.points):
+                        color = MARKER_COLORS[i % len(MARKER_COLORS)]
+                        item = pg.ScatterPlotItem(size=6, symbol="o", pen=pg.mkPen(color), brush=None,
+                                                  name=f"⚑ {name}")
+                        self.plot.addItem(item)
+                        self.scatters[name] = item
+        self._refresh_markers()
+
+    def _refresh_markers(self, *_):
+        if self.overlay is None:
+            return
+        x0, x1 = self.plot.viewRange()[0]
+        pixels = max(int(self.plot.vb.width()), 100)
+        offsets = self.overlay.scaled(self.overlay.query(x0, x1, pixels), self.scales)
+        for name, item in self.scatters.items():
+            pos = offsets.get(name)
+            if pos is None or not len(pos):
+                item.clear()
+            else:
+                item.setData(pos=pos)
+
+    def set_pyramids(self, pyramids):
+        pass                            # pyqtgraph tự downsample
+
+    def shutdown(self):
+        pass
+
+    def clear(self):
+        self.plot.clear()
+        self.overlay = None
+        self.scatters = {}
+        self._overlay_key = None
+        self.bands = {}
+        self.items.clear()
+        self.series.clear()
+        self.scales.clear()
+        self.data_keys.clear()
+
+    def export(self, path: str, dpi: int = 150) -> str:
+        if self._last is None:
+            raise ValueError("Chưa có gì để xuất.")
+        return export_figure(path, *self._last, dpi=dpi)
+
+
+def create_backend(name: str, parent=None):
+    if name == "pyqtgraph":
+        return PyqtgraphBackend(parent)
+    return MatplotlibBackend(parent)
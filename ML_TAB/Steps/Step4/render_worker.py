@@ -0,0 +1,78 @@
+# file: ML_TAB/Steps/Step4/render_worker.py
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PySide6.QtCore import QObject, QThread, Signal, Slot
+
+from .line_plot_utils import decimate_window
+
+# Một job: [(tên biến, x, y, pyramid | None), ...] + khung nhìn (x0, x1) + số pixel
+#          + OutlierOverlay | None (marker decimate cùng lưới pixel)
+RenderJob = Tuple[List[Tuple[str, Any, Any, Any]], float, float, int, Any]
+
+
+class DecimationWorker(QObject):
+    """
+    Tính buffer đã decimate (x, y chưa scale) cho từng biến trong QThread riêng.
+    `latest` do GUI thread ghi: job nào có generation cũ hơn thì bỏ ngay
+    (trước khi bắt đầu và giữa các biến) -> không tốn CPU cho lần vẽ đã lỗi thời.
+    """
+
+    ready = Signal(int, object, object)  # (generation, {tên: (xd, yd)}, marker | None)
+
+    def __init__(self):
+        super().__init__()
+        self.latest = 0
+
+    @Slot(int, object)
+    def compute(self, generation: int, job: RenderJob):
+        series, x0, x1, pixels, overlay = job
+        out: Dict[str, tuple] = {}
+        for name, x, y, pyramid in series:
+            if generation != self.latest:
+                return                   # đã có yêu cầu mới hơn
+            out[name] = decimate_window(x, y, pyramid, x0, x1, pixels)
+        markers = overlay.query(x0, x1, pixels) if overlay is not None else None
+        if generation == self.latest:
+            self.ready.emit(generation, out, markers)
+
+
+class AsyncRenderer(QObject):
+    """
+    Phía GUI: giữ thread + worker và bộ đếm generation.
+    submit() tăng generation; chỉ kết quả của yêu cầu mới nhất được gọi callback
+    (GUI chỉ việc set_data / set_offsets + draw_idle).
+    """
+
+    _request = Signal(int, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self._callback: Optional[Callable[[Dict[str, tuple], Any], None]] = None
+
+        self._thread = QThread(self)
+        self._worker = DecimationWorker()
+        self._worker.moveToThread(self._thread)
+        self._request.connect(self._worker.compute)
+        self._worker.ready.connect(self._on_ready)
+        self._thread.start()
+
+    def submit(self, job: RenderJob, callback: Callable[[Dict[str, tuple], Any], None]) -> int:
+        self.generation += 1
+        self._worker.latest = self.generation
+        self._callback = callback
+        self._request.emit(self.generation, job)
+        return self.generation
+
+    def _on_ready(self, generation: int, out: Dict[str, tuple], markers):
+        if generation != self.generation or self._callback is None:
+            return                       # kết quả cũ, đã có yêu cầu mới hơn
+        self._callback(out, markers)
+
+    def shutdown(self):
+        self._worker.latest = -1         # bỏ mọi job đang chờ
+        self._thread.quit()
+        self._thread.wait()
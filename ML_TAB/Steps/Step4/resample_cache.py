@@ -0,0 +1,173 @@
+# file: ML_TAB/Steps/Step4/resample_cache.py
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Thang khoảng resample (nano-giây), từ mịn tới thô
+_S = 1_000_000_000
+INTERVALS: List[Tuple[str, int]] = [
+    ("1s", _S), ("10s", 10 * _S), ("1min", 60 * _S), ("5min", 300 * _S),
+    ("15min", 900 * _S), ("1h", 3600 * _S), ("6h", 6 * 3600 * _S),
+    ("1D", 86400 * _S), ("7D", 7 * 86400 * _S), ("30D", 30 * 86400 * _S),
+]
+
+# Số entry tối đa của cache (mỗi entry = một biến ở một khoảng của một phiên bản dữ liệu)
+RESAMPLE_CACHE_SIZE = 256
+
+
+def base_step_ns(t_ns: np.ndarray) -> int:
+    """Bước lấy mẫu điển hình (median khoảng cách giữa các mốc, tính trên tối đa 100k mốc đầu)."""
+    if t_ns is None or len(t_ns) < 2:
+        return 0
+    d = np.diff(t_ns[:100_001])
+    d = d[d > 0]
+    return int(np.median(d)) if len(d) else 0
+
+
+def choose_interval(span_ns: int, pixels: int, step_ns: int = 0) -> Optional[Tuple[str, int]]:
+    """
+    Khoảng resample nhỏ nhất sao cho span / khoảng <= pixels (~1 bucket / pixel).
+    None = không cần resample: mỗi bucket chỉ gom <= 2 mẫu gốc -> vẽ dữ liệu gốc (min/max decimate).
+    """
+    pixels = max(int(pixels), 1)
+    if span_ns <= 0:
+        return None
+    need = span_ns / pixels
+    chosen = INTERVALS[-1]
+    for label, ns in INTERVALS:
+        if ns >= need:
+            chosen = (label, ns)
+            break
+    if step_ns and chosen[1] <= 2 * step_ns:
+        return None
+    return chosen
+
+
+@dataclass
+class BucketIndex:
+    """Cách chia bucket của trục thời gian (dùng chung cho mọi biến): t đã sort tăng dần."""
+    starts: np.ndarray        # vị trí dòng đầu tiên của mỗi bucket (cho reduceat)
+    t_bucket: np.ndarray      # mốc đầu bucket, int64 nano-giây
+
+
+@dataclass
+class Aggregates:
+    """mean / min / max / count của một biến theo bucket (NaN = bucket không có giá trị)."""
+    mean: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    count: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.mean.nbytes + self.min.nbytes + self.max.nbytes + self.count.nbytes)
+
+
+def bucket_index(t_ns: np.ndarray, interval_ns: int) -> BucketIndex:
+    """t sort tăng dần -> bucket = floor(t / interval); ranh giới bucket = chỗ mã bucket đổi."""
+    code = np.floor_divide(t_ns, interval_ns)
+    if not len(code):
+        return BucketIndex(np.empty(0, np.int64), np.empty(0, np.int64))
+    starts = np.flatnonzero(np.r_[True, code[1:] != code[:-1]])
+    return BucketIndex(starts=starts, t_bucket=code[starts] * interval_ns)
+
+
+def aggregate(y: np.ndarray, bidx: BucketIndex) -> Aggregates:
+    """Group-by vectorized bằng ufunc.reduceat (một lượt qua dữ liệu cho mỗi thống kê)."""
+    y = np.asarray(y, dtype=np.float64)
+    if not len(bidx.starts):
+        e = np.empty(0)
+        return Aggregates(e, e, e, np.empty(0, np.int32))
+    valid = ~np.isnan(y)
+    count = np.add.reduceat(valid.astype(np.int32), bidx.starts)
+    total = np.add.reduceat(np.where(valid, y, 0.0), bidx.starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    # fmin / fmax bỏ qua NaN (bucket toàn NaN -> NaN)
+    return Aggregates(
+        mean=mean,
+        min=np.fmin.reduceat(y, bidx.starts),
+        max=np.fmax.reduceat(y, bidx.starts),
+        count=count,
+    )
+
+
+class ResampleCache:
+    """LRU cho BucketIndex / Aggregates, key = (nguồn, version, biến | None, khoảng)."""
+
+    def __init__(self, maxsize: int = RESAMPLE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Tuple, object]" = OrderedDict()
+
+    def get(self, key: Tuple):
+        val = self._data.get(key)
+        if val is not None:
+            self._data.move_to_end(key)
+        return val
+
+    def put(self, key: Tuple, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def drop_source(self, source: str, keep_version):
+        """Bỏ mọi entry của phiên bản cũ của một nguồn."""
+        for k in [k for k in self._data if k[0] == source and k[1] != keep_version]:
+            del self._data[k]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_RESAMPLE_CACHE = ResampleCache()
+
+
+def resample_frame(
+    source: str,
+    version: int,
+    t_ns: np.ndarray,
+    df: pd.DataFrame,
+    variables: List[str],
+    datetime_col: str,
+    interval_ns: int,
+    start=None,
+    end=None,
+) -> Tuple[pd.DataFrame, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Bảng mean theo bucket (cột datetime_col = mốc đầu bucket) của các biến trong [start, end]
+    + {biến: (min, max)} để vẽ dải. Aggregate tính trên TOÀN BỘ df (t_ns đã sort, khớp df)
+    rồi cắt theo khoảng bằng searchsorted -> đổi khoảng thời gian chỉ dùng lại cache.
+    """
+    cache = _RESAMPLE_CACHE
+    cache.drop_source(source, version)
+
+    bkey = (source, version, None, interval_ns)
+    bidx = cache.get(bkey)
+    if bidx is None:
+        bidx = bucket_index(t_ns, interval_ns)
+        cache.put(bkey, bidx)
+
+    tb = bidx.t_bucket
+    a = 0 if start is None else int(np.searchsorted(tb, (pd.Timestamp(start).value // interval_ns) * interval_ns, "left"))
+    b = len(tb) if end is None else int(np.searchsorted(tb, pd.Timestamp(end).value, "right"))
+
+    cols: Dict[str, np.ndarray] = {datetime_col: pd.to_datetime(tb[a:b])}
+    bands: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for var in variables:
+        if var not in df.columns:
+            continue
+        key = (source, version, var, interval_ns)
+        agg = cache.get(key)
+        if agg is None:
+            agg = aggregate(df[var].to_numpy(dtype=float, na_value=np.nan), bidx)
+            cache.put(key, agg)
+        cols[var] = agg.mean[a:b]
+        bands[var] = (agg.min[a:b], agg.max[a:b])
+    return pd.DataFrame(cols), bands
@@ -2,54 +2,189 @@
 
 from __future__ import annotations
 
-from typing import List, Optional
+import re
+from collections import Counter
+from typing import List, Optional, Tuple
 
+import numpy as np
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
 from PySide6.QtWidgets import (
     QDialog,
     QVBoxLayout,
     QHBoxLayout,
-    QWidget,
-    QScrollArea,
     QDialogButtonBox,
     QCheckBox,
+    QComboBox,
+    QLabel,
+    QLineEdit,
+    QListView,
     QPushButton,
 )
 
+# Ký tự tách tên tag thành các phần khi gom nhóm theo tiền tố
+_TOKEN_SPLIT = re.compile(r"[\s_\-.:]+")
+
+
+def prefix_groups(names: List[str], max_tokens: int = 2, min_size: int = 2) -> List[Tuple[str, int]]:
+    """
+    Các tiền tố chung (1..max_tokens phần đầu của tên, vd. 'AH', 'AH O/L') có >= min_size tag,
+    sắp theo tên. Trả về [(tiền tố, số tag)].
+    """
+    counts: Counter = Counter()
+    for name in names:
+        tokens = [t for t in _TOKEN_SPLIT.split(name.strip()) if t]
+        for k in range(1, min(max_tokens, len(tokens) - 1) + 1):
+            counts[" ".join(tokens[:k])] += 1
+    return sorted(((p, c) for p, c in counts.items() if c >= min_size), key=lambda pc: pc[0].lower())
+
+
+class VariableListModel(QAbstractListModel):
+    """
+    Danh sách biến có ô tick, không tạo widget cho từng biến:
+    - trạng thái tick là một mảng bool (`checked`) theo thứ tự cột gốc
+    - lọc chỉ thay đổi `_visible` (vị trí của các biến đang hiển thị)
+    """
+
+    def __init__(self, names: List[str], checked: Optional[np.ndarray] = None, parent=None):
+        super().__init__(parent)
+        self.names = list(names)
+        self._norm = [_TOKEN_SPLIT.sub(" ", n).strip().lower() for n in self.names]
+        self.checked = np.zeros(len(self.names), dtype=bool) if checked is None else checked.astype(bool)
+        self._visible = np.arange(len(self.names), dtype=np.int64)
+
+    # ---------- kích thước / dữ liệu ----------
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._visible)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i = int(self._visible[index.row()])
+        if role == Qt.DisplayRole:
+            return self.names[i]
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.checked[i] else Qt.Unchecked
+        return None
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole) -> bool:
+        if not index.isValid() or role != Qt.CheckStateRole:
+            return False
+        state = value.value if hasattr(value, "value") else int(value)
+        self.checked[int(self._visible[index.row()])] = state == Qt.CheckState.Checked.value
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    # ---------- lọc ----------
+    def set_filter(self, text: str = "", regex: bool = False):
+        """
+        Lọc theo chuỗi con (không phân biệt hoa thường, bỏ qua khác biệt '_' / '-' / khoảng trắng)
+        hoặc theo regex (re.search, không phân biệt hoa thường). Regex sai -> re.error.
+        """
+        text = text.strip()
+        if not text:
+            keep = range(len(self.names))
+        elif regex:
+            pat = re.compile(text, re.IGNORECASE)
+            keep = [i for i, n in enumerate(self.names) if pat.search(n)]
+        else:
+            needle = _TOKEN_SPLIT.sub(" ", text).strip().lower()
+            keep = [i for i, n in enumerate(self._norm) if needle in n]
+
+        self.beginResetModel()
+        self._visible = np.fromiter(keep, dtype=np.int64)
+        self.endResetModel()
+
+    # ---------- tick hàng loạt ----------
+    def _emit_all(self):
+        if len(self._visible):
+            self.dataChanged.emit(self.index(0), self.index(len(self._visible) - 1), [Qt.CheckStateRole])
+
+    def set_checked(self, positions: np.ndarray, value: bool):
+        self.checked[positions] = value
+        self._emit_all()
+
+    def visible_positions(self) -> np.ndarray:
+        return self._visible
+
+    def prefix_positions(self, prefix: str) -> np.ndarray:
+        """Vị trí các biến có tên bắt đầu bằng tiền tố (theo từng phần, như prefix_groups)."""
+        p = _TOKEN_SPLIT.sub(" ", prefix).strip().lower()
+        return np.fromiter(
+            (i for i, n in enumerate(self._norm) if n == p or n.startswith(p + " ")), dtype=np.int64
+        )
+
+    def selected(self) -> List[str]:
+        return [self.names[i] for i in np.flatnonzero(self.checked)]
+
 
 class VariableSelectorDialog(QDialog):
     """
     Dialog chọn biến để vẽ (nhiều biến cùng lúc).
+    QListView + VariableListModel -> mở / lọc tức thì kể cả với hàng trăm tag:
+    - ô tìm kiếm lọc ngay khi gõ (chuỗi con, hoặc regex nếu bật)
+    - chọn / bỏ cả nhóm tag theo tiền tố (vd. tất cả 'AH O/L ...')
+    - Chọn / Bỏ tất cả áp dụng cho các biến đang hiển thị
     """
     def __init__(self, columns: List[str], selected_vars: Optional[List[str]] = None, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Chọn biến để vẽ")
         self.selected_vars = selected_vars or []
-        self.checkboxes: List[QCheckBox] = []
 
         layout = QVBoxLayout(self)
         self.setMinimumSize(400, 500)
 
-        # Widget chứa checkbox
-        checkbox_widget = QWidget()
-        checkbox_layout = QVBoxLayout(checkbox_widget)
-        checkbox_layout.setContentsMargins(4, 4, 4, 4)
-        checkbox_layout.setSpacing(2)
-
-        for col in columns:
-            cb = QCheckBox(col)
-            # nếu chưa có selected_vars -> chọn hết mặc định
-            cb.setChecked(col in self.selected_vars or not self.selected_vars)
-            checkbox_layout.addWidget(cb)
-            self.checkboxes.append(cb)
-        checkbox_layout.addStretch()
-
-        # Scroll cho danh sách dài
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setWidget(checkbox_widget)
-        scroll.setMinimumHeight(200)
-        scroll.setMaximumHeight(600)
-        layout.addWidget(scroll)
+        # nếu chưa có selected_vars -> chọn hết mặc định
+        chosen = set(self.selected_vars)
+        checked = np.fromiter((c in chosen or not chosen for c in columns), dtype=bool, count=len(columns))
+        self.model = VariableListModel(columns, checked, self)
+
+        # Tìm kiếm
+        search_layout = QHBoxLayout()
+        self.edtSearch = QLineEdit()
+        self.edtSearch.setPlaceholderText("🔍 Tìm biến...")
+        self.edtSearch.setClearButtonEnabled(True)
+        self.chkRegex = QCheckBox("Regex")
+        search_layout.addWidget(self.edtSearch, 1)
+        search_layout.addWidget(self.chkRegex)
+        layout.addLayout(search_layout)
+
+        # gõ liên tục -> chỉ lọc sau khi ngừng gõ một chút
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(120)
+        self._filter_timer.timeout.connect(self._apply_filter)
+        self.edtSearch.textChanged.connect(lambda _: self._filter_timer.start())
+        self.chkRegex.toggled.connect(lambda _: self._apply_filter())
+
+        # Danh sách (chỉ vẽ các dòng đang nhìn thấy)
+        self.view = QListView()
+        self.view.setModel(self.model)
+        self.view.setUniformItemSizes(True)
+        self.view.setSelectionMode(QListView.ExtendedSelection)
+        self.view.setMinimumHeight(200)
+        layout.addWidget(self.view, 1)
+
+        # Nhóm theo tiền tố
+        group_layout = QHBoxLayout()
+        self.cmbGroup = QComboBox()
+        for prefix, count in prefix_groups(columns):
+            self.cmbGroup.addItem(f"{prefix} ({count})", userData=prefix)
+        btn_group_on = QPushButton("Chọn nhóm")
+        btn_group_off = QPushButton("Bỏ nhóm")
+        btn_group_on.clicked.connect(lambda: self._set_group(True))
+        btn_group_off.clicked.connect(lambda: self._set_group(False))
+        for w in (btn_group_on, btn_group_off):
+            w.setEnabled(self.cmbGroup.count() > 0)
+        group_layout.addWidget(QLabel("Nhóm:"))
+        group_layout.addWidget(self.cmbGroup, 1)
+        group_layout.addWidget(btn_group_on)
+        group_layout.addWidget(btn_group_off)
+        layout.addLayout(group_layout)
 
         # Nút check all / uncheck all
         action_layout = QHBoxLayout()
@@ -59,6 +194,8 @@ class VariableSelectorDialog(QDialog):
         btn_uncheck_all.clicked.connect(self.uncheck_all)
         action_layout.addWidget(btn_check_all)
         action_layout.addWidget(btn_uncheck_all)
+        self.lblCount = QLabel("")
+        action_layout.addWidget(self.lblCount)
         layout.addLayout(action_layout)
 
         # OK / Cancel
@@ -67,13 +204,38 @@ class VariableSelectorDialog(QDialog):
         btn_box.rejected.connect(self.reject)
         layout.addWidget(btn_box)
 
+        self.model.dataChanged.connect(lambda *_: self._update_count())
+        self.model.modelReset.connect(self._update_count)
+        self._update_count()
+
+    # ---------- lọc ----------
+    def _apply_filter(self):
+        self._filter_timer.stop()
+        try:
+            self.model.set_filter(self.edtSearch.text(), regex=self.chkRegex.isChecked())
+            self.edtSearch.setStyleSheet("")
+            self.edtSearch.setToolTip("")
+        except re.error as e:
+            # regex đang gõ dở: giữ nguyên kết quả lọc trước
+            self.edtSearch.setStyleSheet("border: 1px solid #d9534f;")
+            self.edtSearch.setToolTip(f"Regex không hợp lệ: {e}")
+
+    def _set_group(self, value: bool):
+        prefix = self.cmbGroup.currentData()
+        if prefix is not None:
+            self.model.set_checked(self.model.prefix_positions(prefix), value)
+
+    def _update_count(self):
+        m = self.model
+        self.lblCount.setText(
+            f"{int(m.checked.sum())} / {len(m.names)} đã chọn — hiển thị {len(m.visible_positions())}"
+        )
+
     def get_selected_variables(self) -> List[str]:
-        return [cb.text() for cb in self.checkboxes if cb.isChecked()]
+        return self.model.selected()
 
     def check_all(self):
-        for cb in self.checkboxes:
-            cb.setChecked(True)
+        self.model.set_checked(self.model.visible_positions(), True)
 
     def uncheck_all(self):
-        for cb in self.checkboxes:
-            cb.setChecked(False)
+        self.model.set_checked(self.model.visible_positions(), False)
@@ -0,0 +1,106 @@
+# ML_TAB/Steps/Step5/classification.py
+from __future__ import annotations
+
+import re
+from typing import Collection, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator
+from sklearn.ensemble import ExtraTreesClassifier, HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import balanced_accuracy_score, f1_score, recall_score, roc_auc_score
+
+from .training_engine import ProbaScorer, Scorer
+
+# Cột có từ 2 tới MAX_CLASSES giá trị khác nhau mới được coi là nhãn lớp
+MAX_CLASSES = 20
+
+# Tên tag trạng thái hay dùng làm target (sootblower, alarm, trip ...)
+_LABEL_HINT = re.compile(r"soot|blow|alarm|trip|state|status|flag|fault", re.I)
+
+# Số dòng tối đa mỗi cây (RandomForest / ExtraTrees) bootstrap trên dữ liệu lớn
+TREE_MAX_SAMPLES = 100_000
+
+
+def _roc_auc(y: np.ndarray, proba: np.ndarray, classes: np.ndarray) -> float:
+    if len(classes) == 2:
+        return roc_auc_score(y == classes[1], proba[:, 1])
+    return roc_auc_score(y, proba, multi_class="ovr", average="macro", labels=classes)
+
+
+# Metric CV. Lớp hiếm quan trọng -> metric cân bằng theo lớp; F1 macro là metric chính
+CLASSIFICATION_SCORERS: Dict[str, Scorer] = {
+    "F1 macro": lambda y, p: f1_score(y, p, average="macro", zero_division=0),
+    "Balanced acc": balanced_accuracy_score,
+    "Min recall": lambda y, p: float(np.min(recall_score(y, p, average=None, zero_division=0))),
+}
+CLASSIFICATION_PROBA_SCORERS: Dict[str, ProbaScorer] = {"ROC AUC": _roc_auc}
+CLASSIFICATION_SORT = ("F1 macro", False)
+
+
+def classification_candidates(n_train: Optional[int] = None, random_state: int = 0) -> Dict[str, BaseEstimator]:
+    """
+    Các model ứng viên. Mất cân bằng lớp xử lý bằng class_weight (trọng số trong loss / khi
+    chia node), không sinh thêm dòng oversampling -> các fold dùng chung không bị nhân bản.
+    Boosting dừng sớm theo validation loss (tách 10% phân tầng từ phần train của fold).
+    n_jobs=1 bên trong: song song ở mức (model, fold) của joblib.
+    """
+    max_samples = None
+    if n_train and n_train > TREE_MAX_SAMPLES:
+        max_samples = TREE_MAX_SAMPLES / n_train
+    return {
+        "LogisticRegression": LogisticRegression(class_weight="balanced", max_iter=1000),
+        "HistGradientBoosting": HistGradientBoostingClassifier(
+            max_iter=1000, learning_rate=0.1, class_weight="balanced",
+            early_stopping=True, validation_fraction=0.1, n_iter_no_change=20,
+            scoring="loss", random_state=random_state,
+        ),
+        "RandomForest": RandomForestClassifier(
+            n_estimators=100, min_samples_leaf=5, max_features="sqrt",
+            class_weight="balanced_subsample", max_samples=max_samples,
+            n_jobs=1, random_state=random_state,
+        ),
+        "ExtraTrees": ExtraTreesClassifier(
+            n_estimators=100, min_samples_leaf=5, max_features="sqrt",
+            class_weight="balanced_subsample", bootstrap=True, max_samples=max_samples,
+            n_jobs=1, random_state=random_state,
+        ),
+    }
+
+
+def label_columns(
+    df: pd.DataFrame, max_classes: int = MAX_CLASSES, ignored: Collection[str] = (), sample_rows: int = 100_000
+) -> List[str]:
+    """
+    Các cột dùng được làm nhãn: 2..max_classes giá trị khác nhau (số, bool, chữ, category).
+    Cột liên tục bị loại ngay trên một mẫu rải đều sample_rows dòng, không phải đếm cả cột.
+    """
+    step = max(len(df) // sample_rows, 1)
+    out = []
+    for c in df.columns:
+        if str(c).strip().lower() in ignored:
+            continue
+        s = df[c]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            continue
+        if s.iloc[::step].nunique(dropna=True) > max_classes:
+            continue
+        if 2 <= s.nunique(dropna=True) <= max_classes:
+            out.append(c)
+    return out
+
+
+def default_label_target(columns: List[str]) -> Optional[str]:
+    """Tag trạng thái (sootblower, alarm, trip, status ...) nếu có, không thì cột đầu tiên."""
+    for c in columns:
+        if _LABEL_HINT.search(str(c)):
+            return c
+    return columns[0] if columns else None
+
+
+def class_balance(y: pd.Series, top: int = 6) -> str:
+    """'0: 95.1%, 1: 4.9%' — tỉ lệ các lớp (nhiều nhất trước) để hiện trên dialog."""
+    share = y.value_counts(normalize=True, dropna=True)
+    text = ", ".join(f"{k}: {v:.1%}" for k, v in share.iloc[:top].items())
+    return text + (f", … (+{len(share) - top})" if len(share) > top else "")
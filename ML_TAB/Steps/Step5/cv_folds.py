@@ -0,0 +1,210 @@
+# ML_TAB/Steps/Step5/cv_folds.py
+from __future__ import annotations
+
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.model_selection import StratifiedKFold, TimeSeriesSplit
+
+from ML_TAB.Steps.Step3.outlier_tools import _infer_timestamp_col, _sorted_time_positions
+from ML_TAB.Steps.Step3.pipelines import data_fingerprint, fit_numeric_pipeline
+
+# Số bộ fold đã tiền xử lý giữ trong bộ nhớ (mỗi bộ có thể vài trăm MB với dữ liệu lớn)
+FOLD_CACHE_SIZE = 1
+
+# Kiểu chia fold: "time" = TimeSeriesSplit (train trước test), "stratified" = StratifiedKFold
+CV_METHODS = ("time", "stratified")
+
+# Tham số pipeline Step 3 mặc định khi training: điền NaN chỉ bằng giá trị quá khứ (ffill).
+# "interpolate" / "rolling_median" dùng điểm phía sau -> CV lạc quan, không dùng được lúc dự báo
+TRAINING_PIPELINE_DEFAULTS: Dict = {"ts_impute": "ffill"}
+
+
+@dataclass
+class FoldData:
+    """
+    Một fold CV đã tiền xử lý xong: X float32 C-contiguous (pipeline Step 3 fit trên
+    phần train của fold), y theo cùng thứ tự dòng. Dùng chung cho mọi model ứng viên.
+    """
+    X_train: np.ndarray
+    y_train: np.ndarray
+    X_test: np.ndarray
+    y_test: np.ndarray
+    test_index: np.ndarray        # nhãn index của df cho các dòng test
+    prep_seconds: float
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.X_train.nbytes + self.X_test.nbytes + self.y_train.nbytes + self.y_test.nbytes)
+
+
+@dataclass
+class PreparedFolds:
+    """Các fold + thông tin chung (cột đặc trưng, cột thời gian, tham số pipeline, nhãn lớp)."""
+    folds: List[FoldData]
+    features: List[str]
+    target: str
+    datetime_col: Optional[str]
+    pipeline_params: Dict
+    cv: str = "time"
+    classes: Optional[np.ndarray] = None      # classification: các nhãn (sort) trên toàn bộ dữ liệu
+
+    @property
+    def nbytes(self) -> int:
+        return sum(f.nbytes for f in self.folds)
+
+    def describe(self) -> str:
+        tr = [len(f.y_train) for f in self.folds]
+        return (
+            f"{len(self.folds)} folds ({self.cv}), {len(self.features)} features, "
+            f"train {min(tr)}–{max(tr)} rows, test {len(self.folds[0].y_test)} rows, "
+            f"{self.nbytes / 1e6:.0f} MB"
+        )
+
+
+def ordered_frame(
+    df: pd.DataFrame, target: str, features: List[str], datetime_col: Optional[str] = None,
+    categorical: bool = False,
+) -> Tuple[pd.DataFrame, np.ndarray, Optional[str]]:
+    """
+    Các cột cần cho training (features + target + cột thời gian), dòng theo thứ tự thời gian
+    (bỏ NaT) và bỏ dòng thiếu target. Không có cột thời gian -> giữ thứ tự gốc.
+    Trả về (frame, y, tên cột thời gian | None); y là float64, hoặc nhãn gốc nếu categorical.
+    """
+    if target in features:
+        raise ValueError(f"Target '{target}' không được nằm trong danh sách feature")
+    ts_col = _infer_timestamp_col(df, datetime_col)
+    cols = list(features) + [target] + ([ts_col] if ts_col and ts_col not in features else [])
+    if ts_col is not None:
+        order, _ = _sorted_time_positions(df, ts_col)
+        if len(order) == len(df) and (order[1:] > order[:-1]).all():
+            work = df[cols]
+        else:
+            work = df[cols].iloc[order]
+    else:
+        work = df[cols]
+
+    if categorical:
+        y = work[target].to_numpy()
+        keep = work[target].notna().to_numpy()
+    else:
+        y = pd.to_numeric(work[target], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        keep = np.isfinite(y)
+    if not keep.all():
+        work, y = work.iloc[np.flatnonzero(keep)], y[keep]
+    return work, y, ts_col
+
+
+def _prepare_one(
+    work: pd.DataFrame, y: np.ndarray, train: np.ndarray, test: np.ndarray,
+    features: List[str], params: Dict, data_fp: str,
+) -> FoldData:
+    t0 = time.perf_counter()
+    # pipeline của fold lấy từ cache đĩa theo (dữ liệu, vị trí dòng train, tham số)
+    fold_fp = f"{data_fp}:{hashlib.sha1(np.ascontiguousarray(train)).hexdigest()}"
+    part = work.iloc[train]
+    pipe = fit_numeric_pipeline(part, fingerprint=fold_fp, columns=features, **params)
+    X_train = np.ascontiguousarray(pipe.transform(part))
+    X_test = np.ascontiguousarray(pipe.transform(work.iloc[test]))
+    return FoldData(
+        X_train=X_train, y_train=y[train],
+        X_test=X_test, y_test=y[test],
+        test_index=work.index.to_numpy()[test],
+        prep_seconds=time.perf_counter() - t0,
+    )
+
+
+def _splits(y: np.ndarray, cv: str, n_splits: int, gap: int, max_train_size: Optional[int],
+            categorical: bool) -> List[Tuple[np.ndarray, np.ndarray]]:
+    if cv == "time":
+        splitter = TimeSeriesSplit(n_splits=n_splits, gap=gap, max_train_size=max_train_size)
+        splits = list(splitter.split(np.empty((len(y), 0))))
+        if categorical:
+            for k, (tr, _) in enumerate(splits):
+                if len(np.unique(y[tr])) < 2:
+                    raise ValueError(
+                        f"Fold {k + 1}: phần train chỉ có một lớp (lớp hiếm chỉ xuất hiện về sau) "
+                        f"— giảm số fold hoặc dùng Stratified K-fold"
+                    )
+        return splits
+    if cv == "stratified":
+        if not categorical:
+            raise ValueError("Stratified K-fold chỉ dùng cho classification")
+        labels, counts = np.unique(y, return_counts=True)
+        if counts.min() < n_splits:
+            raise ValueError(
+                f"Lớp '{labels[counts.argmin()]}' chỉ có {counts.min()} dòng (< {n_splits} folds)"
+            )
+        # không xáo trộn: mỗi fold test là các đoạn liền nhau theo thời gian của từng lớp
+        return list(StratifiedKFold(n_splits=n_splits, shuffle=False).split(np.empty((len(y), 0)), y))
+    raise ValueError(f"cv must be one of {CV_METHODS}")
+
+
+_FOLD_CACHE: "OrderedDict[Tuple, PreparedFolds]" = OrderedDict()
+
+
+def prepare_cv_folds(
+    df: pd.DataFrame,
+    target: str,
+    features: List[str],
+    *,
+    version: Optional[int] = None,
+    cv: str = "time",
+    categorical: bool = False,
+    n_splits: int = 5,
+    gap: int = 0,
+    max_train_size: Optional[int] = None,
+    datetime_col: Optional[str] = None,
+    pipeline_params: Optional[Dict] = None,
+    n_jobs: int = -1,
+) -> PreparedFolds:
+    """
+    Chia fold theo thứ tự thời gian rồi tiền xử lý từng fold:
+        cv="time"       -> TimeSeriesSplit (train luôn nằm trước test, cách `gap` dòng)
+        cv="stratified" -> StratifiedKFold không xáo trộn (categorical: giữ tỉ lệ các lớp hiếm)
+    Mỗi fold fit pipeline số của Step 3 (fit_numeric_pipeline, cache đĩa theo vị trí dòng train)
+    CHỈ trên phần train rồi transform phần test -> không rò rỉ thống kê của test vào tiền xử lý.
+
+    Các fold được tiền xử lý song song (thread) đúng một lần; mọi model ứng viên dùng lại
+    cùng các mảng này. version != None -> cache theo (version, target, features, tham số),
+    bấm "Run CV" lại với model khác không phải tiền xử lý lại.
+    """
+    params = {**TRAINING_PIPELINE_DEFAULTS, **(pipeline_params or {})}
+    key = None
+    if version is not None:
+        key = (version, target, tuple(features), cv, categorical, n_splits, gap, max_train_size,
+               datetime_col, tuple(sorted((k, repr(v)) for k, v in params.items())))
+        hit = _FOLD_CACHE.get(key)
+        if hit is not None:
+            _FOLD_CACHE.move_to_end(key)
+            return hit
+
+    work, y, ts_col = ordered_frame(df, target, features, datetime_col, categorical=categorical)
+    if len(y) < n_splits + 1:
+        raise ValueError(f"Không đủ dòng có target ({len(y)}) cho {n_splits} folds")
+    classes = np.unique(y) if categorical else None
+    if classes is not None and len(classes) < 2:
+        raise ValueError(f"Target '{target}' chỉ có một lớp")
+
+    splits = _splits(y, cv, n_splits, gap, max_train_size, categorical)
+    data_fp = data_fingerprint(work)
+    folds = Parallel(n_jobs=min(len(splits), n_jobs if n_jobs > 0 else len(splits)), prefer="threads")(
+        delayed(_prepare_one)(work, y, tr, te, features, params, data_fp) for tr, te in splits
+    )
+    prepared = PreparedFolds(list(folds), list(features), target, ts_col, params, cv=cv, classes=classes)
+
+    if key is not None:
+        _FOLD_CACHE[key] = prepared
+        while len(_FOLD_CACHE) > FOLD_CACHE_SIZE:
+            _FOLD_CACHE.popitem(last=False)
+    return prepared
+
+
+def clear_fold_cache():
+    _FOLD_CACHE.clear()
@@ -0,0 +1,61 @@
+# ML_TAB/Steps/Step5/regression.py
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import Lasso, LinearRegression, Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+from .training_engine import Scorer
+
+# Tên target hay dùng, ưu tiên theo thứ tự (so khớp không phân biệt hoa thường)
+PREFERRED_TARGETS = ("NET MW", "GROSS MW", "MW")
+
+# Metric CV: tên -> (y_true, y_pred) -> float; RMSE là metric chính (nhỏ hơn = tốt hơn)
+REGRESSION_SCORERS: Dict[str, Scorer] = {
+    "RMSE": lambda y, p: float(np.sqrt(mean_squared_error(y, p))),
+    "MAE": mean_absolute_error,
+    "R2": r2_score,
+}
+REGRESSION_SORT = ("RMSE", True)
+
+# Số dòng tối đa mỗi cây RandomForest bootstrap (dữ liệu hàng triệu dòng)
+RF_MAX_SAMPLES = 100_000
+
+
+def regression_candidates(n_train: Optional[int] = None, random_state: int = 0) -> Dict[str, BaseEstimator]:
+    """
+    Các model ứng viên. n_jobs=1 bên trong: song song ở mức (model, fold) của joblib.
+    n_train = số dòng train lớn nhất -> giới hạn max_samples của RandomForest.
+    """
+    max_samples = None
+    if n_train and n_train > RF_MAX_SAMPLES:
+        max_samples = RF_MAX_SAMPLES / n_train
+    return {
+        "Linear": LinearRegression(),
+        "Ridge": Ridge(alpha=1.0),
+        "Lasso": Lasso(alpha=0.01, max_iter=5000),
+        "HistGradientBoosting": HistGradientBoostingRegressor(
+            max_iter=300, learning_rate=0.1, early_stopping="auto", random_state=random_state
+        ),
+        "RandomForest": RandomForestRegressor(
+            n_estimators=100, min_samples_leaf=10, max_features=0.5,
+            max_samples=max_samples, n_jobs=1, random_state=random_state,
+        ),
+    }
+
+
+def default_target(columns: List[str]) -> Optional[str]:
+    """'NET MW' (hoặc tag MW / nhiệt độ khác) nếu có, không thì cột đầu tiên."""
+    norm = {re.sub(r"[\s_\-]+", " ", c).strip().upper(): c for c in columns}
+    for name in PREFERRED_TARGETS:
+        if name in norm:
+            return norm[name]
+    for c in columns:
+        if re.search(r"\bMW\b|TEMP", c, re.I):
+            return c
+    return columns[0] if columns else None
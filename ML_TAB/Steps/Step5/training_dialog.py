@@ -0,0 +1,472 @@
+# ML_TAB/Steps/Step5/training_dialog.py
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PySide6.QtCore import Qt, QThread
+from PySide6.QtWidgets import (
+    QDialog,
+    QVBoxLayout,
+    QHBoxLayout,
+    QGridLayout,
+    QGroupBox,
+    QLabel,
+    QComboBox,
+    QCheckBox,
+    QSpinBox,
+    QPushButton,
+    QProgressBar,
+    QTableWidget,
+    QTableWidgetItem,
+    QHeaderView,
+    QAbstractItemView,
+    QMessageBox,
+    QFileDialog,
+)
+
+from ML_TAB.Steps.Step3.detection_worker import BackgroundJobs, default_background_jobs
+from ML_TAB.Steps.Step4.variable_selector_dialog import VariableSelectorDialog
+from .classification import (
+    CLASSIFICATION_PROBA_SCORERS,
+    CLASSIFICATION_SCORERS,
+    CLASSIFICATION_SORT,
+    class_balance,
+    classification_candidates,
+    default_label_target,
+    label_columns,
+)
+from .cv_folds import PreparedFolds, prepare_cv_folds
+from .regression import REGRESSION_SCORERS, REGRESSION_SORT, default_target, regression_candidates
+from .training_engine import (
+    ProbaScorer,
+    Scorer,
+    cross_validate_candidates,
+    default_model_path,
+    fit_final_model,
+    save_model_bundle,
+    summarize_cv,
+)
+from .training_worker import TrainingJob, TrainingWorker
+
+
+@dataclass
+class TrainingTask:
+    """Phần riêng của từng bài toán (regression / classification) mà dialog dùng."""
+    title: str
+    candidates: Callable[[Optional[int]], Dict[str, Any]]   # n_train -> {tên: estimator}
+    scorers: Dict[str, Scorer]
+    sort: Tuple[str, bool]                                   # (metric chính, ascending)
+    default_target: Callable[[List[str]], Optional[str]]
+    proba_scorers: Dict[str, ProbaScorer] = field(default_factory=dict)
+    categorical: bool = False                                # target là nhãn lớp
+    cv_methods: Tuple[str, ...] = ("time",)                  # xem cv_folds.CV_METHODS
+    # (df, cột bỏ qua) -> các cột dùng được làm target; None = mọi cột số
+    target_columns: Optional[Callable[[pd.DataFrame, Collection[str]], List[str]]] = None
+    describe_target: Optional[Callable[[pd.Series], str]] = None
+
+
+TASKS: Dict[str, TrainingTask] = {
+    "regression": TrainingTask(
+        title="Regression",
+        candidates=regression_candidates,
+        scorers=REGRESSION_SCORERS,
+        sort=REGRESSION_SORT,
+        default_target=default_target,
+    ),
+    "classification": TrainingTask(
+        title="Classification",
+        candidates=classification_candidates,
+        scorers=CLASSIFICATION_SCORERS,
+        proba_scorers=CLASSIFICATION_PROBA_SCORERS,
+        sort=CLASSIFICATION_SORT,
+        default_target=default_label_target,
+        categorical=True,
+        cv_methods=("stratified", "time"),
+        target_columns=lambda df, ignored: label_columns(df, ignored=ignored),
+        describe_target=class_balance,
+    ),
+}
+
+_CV_LABELS = {"time": "Time-series split", "stratified": "Stratified K-fold"}
+
+# Cách điền NaN theo thời gian (pipeline Step 3); mục đầu là mặc định, chỉ dùng quá khứ
+_IMPUTE_CHOICES = (
+    ("Forward fill (causal)", "ffill"),
+    ("Median only", None),
+    ("Interpolate (look-ahead)", "interpolate"),
+)
+
+# Cột không dùng làm feature / target (giống Step 4)
+_IGNORED = {"datetime", "date", "time", "sourcefolder"}
+
+
+class ModelTrainingDialog(QDialog):
+    """
+    Step 5 — training:
+    - chọn target + features (mặc định: mọi cột số còn lại), model ứng viên
+    - Run CV: TimeSeriesSplit (hoặc Stratified K-fold cho classification); mỗi fold tiền xử lý
+      một lần bằng pipeline Step 3 (fit trên train), rồi mọi (model, fold) chạy song song bằng
+      joblib trong QThread -> bảng kết quả điền dần (metric mean ± std, thời gian fit / predict,
+      số vòng boosting sau early stopping)
+    - Train & Save: fit pipeline + model đã chọn trên toàn bộ dữ liệu, lưu .pkl cho Step 7
+    """
+
+    def __init__(self, df: pd.DataFrame, task: str = "regression", data_version: Optional[int] = None, parent=None,
+                 jobs: Optional[BackgroundJobs] = None):
+        super().__init__(parent)
+        self.task = TASKS[task]
+        self.df = df
+        self.data_version = data_version
+        self.setWindowFlags(self.windowFlags() | Qt.WindowMinMaxButtonsHint | Qt.WindowSystemMenuHint)
+        self.setWindowTitle(f"Step 5 — {self.task.title}")
+        self.resize(980, 640)
+
+        self.columns = [c for c in df.select_dtypes(include=[np.number]).columns
+                        if str(c).strip().lower() not in _IGNORED]
+        self.features: List[str] = []
+        self._custom_features = False
+        self.prepared: Optional[PreparedFolds] = None
+        self.per_fold: List[Dict[str, Any]] = []
+        self.summary = pd.DataFrame()
+        self._thread: Optional[QThread] = None
+        self._worker: Optional[TrainingWorker] = None
+        self._on_done: Callable[[Any], None] = lambda result: None
+        # Nhận thread còn chạy khi dialog đóng (tab giữ tham chiếu tới khi thread tự kết thúc)
+        self._jobs = jobs
+
+        layout = QVBoxLayout(self)
+
+        # === Target / features ===
+        top = QHBoxLayout()
+        targets = (self.task.target_columns(df, _IGNORED) if self.task.target_columns is not None
+                   else self.columns)
+        self.cboTarget = QComboBox()
+        self.cboTarget.addItems([str(c) for c in targets])
+        target = self.task.default_target(targets)
+        if target is not None:
+            self.cboTarget.setCurrentText(target)
+        self.cboTarget.currentTextChanged.connect(self._on_target_changed)
+        self.btnFeatures = QPushButton("Features...")
+        self.btnFeatures.clicked.connect(self._choose_features)
+        self.lblFeatures = QLabel("")
+        top.addWidget(QLabel("Target:"))
+        top.addWidget(self.cboTarget, 1)
+        top.addWidget(self.btnFeatures)
+        top.addWidget(self.lblFeatures)
+        layout.addLayout(top)
+        self.lblClasses = QLabel("")
+        self.lblClasses.setVisible(self.task.describe_target is not None)
+        layout.addWidget(self.lblClasses)
+
+        # === Cross-validation + tiền xử lý ===
+        grp_cv = QGroupBox("Cross-validation")
+        g = QGridLayout(grp_cv)
+        self.cboCV = QComboBox()
+        for method in self.task.cv_methods:
+            self.cboCV.addItem(_CV_LABELS[method], userData=method)
+        self.cboCV.currentIndexChanged.connect(self._on_cv_changed)
+        self.spnFolds = QSpinBox(); self.spnFolds.setRange(2, 20); self.spnFolds.setValue(5)
+        self.spnGap = QSpinBox(); self.spnGap.setRange(0, 1_000_000); self.spnGap.setValue(0)
+        self.spnGap.setToolTip("Số dòng bỏ giữa train và test (tránh rò rỉ do tự tương quan)")
+        self.spnMaxTrain = QSpinBox(); self.spnMaxTrain.setRange(0, 100_000_000)
+        self.spnMaxTrain.setSingleStep(100_000); self.spnMaxTrain.setSpecialValueText("không giới hạn")
+        self.spnJobs = QSpinBox(); self.spnJobs.setRange(-1, 256); self.spnJobs.setValue(-1)
+        self.spnJobs.setSpecialValueText("tất cả CPU")
+        self.cboScaler = QComboBox()
+        self.cboScaler.addItem("Robust", userData="robust")
+        self.cboScaler.addItem("Standard", userData="standard")
+        self.cboScaler.addItem("None", userData=None)
+        self.chkCapping = QCheckBox("Outlier capping (IQR)"); self.chkCapping.setChecked(True)
+        self.cboImpute = QComboBox()
+        for label, method in _IMPUTE_CHOICES:
+            self.cboImpute.addItem(label, userData=method)
+        self.cboImpute.setToolTip("Điền NaN theo thời gian; interpolate dùng giá trị phía sau -> CV lạc quan")
+        g.addWidget(QLabel("Folds:"), 0, 0); g.addWidget(self.spnFolds, 0, 1)
+        g.addWidget(QLabel("Gap (rows):"), 0, 2); g.addWidget(self.spnGap, 0, 3)
+        g.addWidget(QLabel("Max train rows:"), 0, 4); g.addWidget(self.spnMaxTrain, 0, 5)
+        g.addWidget(QLabel("Jobs:"), 1, 0); g.addWidget(self.spnJobs, 1, 1)
+        g.addWidget(QLabel("Scaler:"), 1, 2); g.addWidget(self.cboScaler, 1, 3)
+        g.addWidget(self.chkCapping, 1, 4, 1, 2)
+        g.addWidget(QLabel("NaN fill:"), 2, 4); g.addWidget(self.cboImpute, 2, 5)
+        if self.cboCV.count() > 1:          # regression: chỉ có time-series split
+            g.addWidget(QLabel("Split:"), 2, 0); g.addWidget(self.cboCV, 2, 1, 1, 3)
+        else:
+            self.cboCV.setVisible(False)
+        layout.addWidget(grp_cv)
+        self._on_cv_changed()
+
+        # === Model ứng viên ===
+        grp_models = QGroupBox("Models")
+        hm = QHBoxLayout(grp_models)
+        self.model_checks: Dict[str, QCheckBox] = {}
+        for name in self.task.candidates(None):
+            chk = QCheckBox(name)
+            chk.setChecked(True)
+            hm.addWidget(chk)
+            self.model_checks[name] = chk
+        hm.addStretch(1)
+        layout.addWidget(grp_models)
+
+        # === Chạy ===
+        run_row = QHBoxLayout()
+        self.btnRun = QPushButton("▶ Run CV")
+        self.btnRun.clicked.connect(self._run_cv)
+        self.btnCancel = QPushButton("Cancel")
+        self.btnCancel.setEnabled(False)
+        self.btnCancel.clicked.connect(self._cancel)
+        self.progress = QProgressBar()
+        self.progress.setTextVisible(True)
+        run_row.addWidget(self.btnRun)
+        run_row.addWidget(self.btnCancel)
+        run_row.addWidget(self.progress, 1)
+        layout.addLayout(run_row)
+        self.lblStatus = QLabel("")
+        layout.addWidget(self.lblStatus)
+
+        # === Bảng kết quả (mỗi model một dòng) ===
+        self.table = QTableWidget(0, 0)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table, 1)
+
+        bottom = QHBoxLayout()
+        self.btnSave = QPushButton("💾 Train && Save selected model")
+        self.btnSave.setEnabled(False)
+        self.btnSave.clicked.connect(self._train_and_save)
+        btnClose = QPushButton("Close")
+        btnClose.clicked.connect(self.reject)
+        bottom.addStretch(1)
+        bottom.addWidget(self.btnSave)
+        bottom.addWidget(btnClose)
+        layout.addLayout(bottom)
+
+        self._on_target_changed(self.cboTarget.currentText())
+
+    # ---------- target / features ----------
+    def _on_target_changed(self, target: str):
+        if self._custom_features:
+            self.features = [c for c in self.features if c != target]
+        else:
+            self.features = [c for c in self.columns if c != target]
+        self._update_feature_label()
+        if self.task.describe_target is not None and target in self.df.columns:
+            self.lblClasses.setText(f"Classes: {self.task.describe_target(self.df[target])}")
+
+    def _on_cv_changed(self, *_):
+        # gap / max train rows chỉ có nghĩa với time-series split
+        time_split = self.cboCV.currentData() == "time"
+        self.spnGap.setEnabled(time_split)
+        self.spnMaxTrain.setEnabled(time_split)
+
+    def _choose_features(self):
+        target = self.cboTarget.currentText()
+        cols = [c for c in self.columns if c != target]
+        dlg = VariableSelectorDialog(cols, selected_vars=self.features, parent=self)
+        dlg.setWindowTitle("Chọn features")
+        if dlg.exec() == QDialog.Accepted:
+            self.features = dlg.get_selected_variables()
+            self._custom_features = True
+            self._update_feature_label()
+
+    def _update_feature_label(self):
+        n = len(self.columns) - (self.cboTarget.currentText() in self.columns)
+        self.lblFeatures.setText(f"{len(self.features)} / {n} features")
+
+    def _pipeline_params(self) -> Dict[str, Any]:
+        return dict(scaler=self.cboScaler.currentData(), outlier_capping=self.chkCapping.isChecked(),
+                    ts_impute=self.cboImpute.currentData())
+
+    # ---------- chạy job trong QThread ----------
+    def _start(self, job: TrainingJob, on_done: Callable[[Any], None]):
+        self._set_running(True)
+        # Không gắn parent là dialog: thread có thể sống lâu hơn dialog (xem done())
+        self._thread = QThread()
+        self._worker = TrainingWorker(job)
+        self._worker.moveToThread(self._thread)
+        self._thread.started.connect(self._worker.run)
+        # chỉ nối vào method của dialog (slot chạy trên GUI thread, không chạy trong worker thread)
+        self._on_done = on_done
+        self._worker.progress.connect(self._on_progress)
+        self._worker.done.connect(self._on_job_done)
+        self._worker.failed.connect(self._on_failed)
+        self._worker.finished.connect(self._thread.quit)
+        self._worker.finished.connect(self._on_job_finished)
+        self._thread.start()
+
+    def _on_job_done(self, result):
+        self._on_done(result)
+
+    def _on_job_finished(self):
+        if self._thread is not None:
+            self._release_thread()
+        self._set_running(False)
+
+    def _release_thread(self):
+        # Thread + worker được deleteLater khi thread dừng hẳn (ngay, nếu đã dừng)
+        jobs = self._jobs if self._jobs is not None else default_background_jobs()
+        jobs.adopt(self._thread, self._worker)
+        self._thread = self._worker = None
+
+    def _set_running(self, running: bool):
+        self.btnRun.setEnabled(not running)
+        self.btnCancel.setEnabled(running)
+        self.btnSave.setEnabled(not running and not self.summary.empty)
+        if not running and self.progress.maximum() == 0:
+            self.progress.setRange(0, 1)        # xong job không xác định tiến độ (Train & Save)
+            self.progress.setValue(1)
+
+    def _cancel(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self.lblStatus.setText("Đang dừng sau task hiện tại...")
+
+    def done(self, result: int):
+        # Đóng dialog không chờ model đang fit: ngắt tín hiệu tới dialog, job dừng sau task
+        # hiện tại; thread + worker được giao cho BackgroundJobs tới khi tự xong
+        if self._thread is not None:
+            w = self._worker
+            w.progress.disconnect(self._on_progress)
+            w.done.disconnect(self._on_job_done)
+            w.failed.disconnect(self._on_failed)
+            w.finished.disconnect(self._on_job_finished)
+            w.cancel()
+            self._release_thread()
+        super().done(result)
+
+    def _on_failed(self, msg: str):
+        self.lblStatus.setText("Lỗi.")
+        QMessageBox.critical(self, f"Lỗi {self.task.title}", msg)
+
+    def _on_progress(self, kind: str, payload):
+        if kind == "status":
+            self.lblStatus.setText(str(payload))
+        elif kind == "prepared":
+            self.prepared = payload
+            prep = sum(f.prep_seconds for f in payload.folds)
+            self.lblStatus.setText(f"Folds: {payload.describe()} — tiền xử lý {prep:.1f} s (dùng chung mọi model)")
+        elif kind == "fold":
+            self.per_fold.append(payload)
+            self.progress.setValue(len(self.per_fold))
+            self._refresh_table()
+        elif kind == "final":
+            self.lblStatus.setText(str(payload))
+
+    # ---------- CV ----------
+    def _run_cv(self):
+        target = self.cboTarget.currentText()
+        models = [n for n, chk in self.model_checks.items() if chk.isChecked()]
+        if not target or not self.features:
+            QMessageBox.warning(self, "Thiếu dữ liệu", "Chọn target và ít nhất một feature.")
+            return
+        if not models:
+            QMessageBox.warning(self, "Chưa chọn model", "Chọn ít nhất một model.")
+            return
+
+        df, features, version = self.df, list(self.features), self.data_version
+        n_splits = self.spnFolds.value()
+        cv = self.cboCV.currentData()
+        kw = dict(
+            version=version, cv=cv, categorical=self.task.categorical, n_splits=n_splits,
+            gap=self.spnGap.value() if cv == "time" else 0,
+            max_train_size=(self.spnMaxTrain.value() or None) if cv == "time" else None,
+            pipeline_params=self._pipeline_params(),
+        )
+        n_jobs = self.spnJobs.value() or -1
+        task = self.task
+
+        def job(progress, should_stop):
+            progress("status", "Tiền xử lý các fold...")
+            prepared = prepare_cv_folds(df, target, features, n_jobs=n_jobs, **kw)
+            progress("prepared", prepared)
+            n_train = max(len(f.y_train) for f in prepared.folds)
+            candidates = {n: est for n, est in task.candidates(n_train).items() if n in models}
+            return cross_validate_candidates(
+                candidates, prepared, task.scorers, proba_scorers=task.proba_scorers, n_jobs=n_jobs,
+                on_result=lambda row: progress("fold", row), should_stop=should_stop,
+            )
+
+        self.per_fold = []
+        self.summary = pd.DataFrame()
+        self.table.setRowCount(0)
+        self.progress.setRange(0, len(models) * n_splits)
+        self.progress.setValue(0)
+        print(f"[UI] Step 5 - {task.title}: target={target}, {len(features)} features, "
+              f"{len(models)} models x {n_splits} folds")
+        self._start(job, self._on_cv_done)
+
+    def _on_cv_done(self, per_fold: pd.DataFrame):
+        self.per_fold = per_fold.to_dict("records")
+        self._refresh_table()
+        if not self.summary.empty:
+            best = self.summary.iloc[0]
+            metric = self.task.sort[0]
+            self.lblStatus.setText(
+                f"{self.lblStatus.text()}\nTốt nhất: {best['model']} ({metric} = {best[metric]:.4g})"
+            )
+            self.table.selectRow(0)
+
+    def _refresh_table(self):
+        metrics = list(self.task.scorers) + list(self.task.proba_scorers)
+        metric, ascending = self.task.sort
+        self.summary = summarize_cv(pd.DataFrame(self.per_fold), metrics, metric, ascending)
+        s = self.summary
+        iters = "n_iter_mean" in s.columns
+        headers = ["Model", "Folds"] + metrics + ["Fit total (s)", "Fit / fold (s)", "Predict / fold (s)"]
+        if iters:
+            headers.append("Iterations")
+        self.table.setColumnCount(len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        self.table.setRowCount(len(s))
+        for r, d in enumerate(s.to_dict("records")):
+            values = [d["model"], str(d["folds"])]
+            values += [f"{d[m]:.4g} ± {d[m + '_std']:.2g}" for m in metrics]
+            values += [f"{d['fit_s_total']:.2f}", f"{d['fit_s_mean']:.2f}", f"{d['predict_s_mean']:.3f}"]
+            if iters:
+                values.append("" if pd.isna(d["n_iter_mean"]) else f"{d['n_iter_mean']:.0f}")
+            for c, text in enumerate(values):
+                item = QTableWidgetItem(text)
+                if c > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(r, c, item)
+
+    # ---------- model cuối ----------
+    def _train_and_save(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows or self.summary.empty:
+            QMessageBox.information(self, "Chưa chọn model", "Chọn một dòng trong bảng kết quả.")
+            return
+        name = self.table.item(rows[0].row(), 0).text()
+        target = self.cboTarget.currentText()
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Lưu model", default_model_path(target, name), "Model files (*.pkl)"
+        )
+        if not path:
+            return
+
+        df, features = self.df, list(self.features)
+        params = self._pipeline_params()
+        datetime_col = self.prepared.datetime_col if self.prepared is not None else None
+        cv_row = self.summary[self.summary["model"] == name].iloc[0].to_dict()
+        task = self.task
+
+        def job(progress, should_stop):
+            progress("final", f"Đang train {name} trên toàn bộ dữ liệu...")
+            estimator = task.candidates(len(df))[name]
+            bundle = fit_final_model(df, target, features, estimator, datetime_col=datetime_col,
+                                     pipeline_params=params, categorical=task.categorical)
+            bundle.update(task=task.title.lower(), model_name=name, cv=cv_row)
+            return save_model_bundle(bundle, path), bundle["fit_seconds"]
+
+        def on_done(res):
+            saved, secs = res
+            self.lblStatus.setText(f"Đã lưu {name} ({secs:.1f} s)")
+            QMessageBox.information(self, "Hoàn tất", f"Đã train {name} và lưu model vào:\n{saved}")
+
+        self.progress.setRange(0, 0)     # không biết trước thời gian -> thanh chạy vô định
+        self._start(job, on_done)
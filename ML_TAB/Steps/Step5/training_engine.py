@@ -0,0 +1,158 @@
+# ML_TAB/Steps/Step5/training_engine.py
+from __future__ import annotations
+
+import os
+import pickle
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, clone
+
+from ML_TAB.Steps.Step3.pipelines import fit_numeric_pipeline
+from .cv_folds import TRAINING_PIPELINE_DEFAULTS, FoldData, PreparedFolds, ordered_frame
+
+# scorer: (y_true, y_pred) -> float
+Scorer = Callable[[np.ndarray, np.ndarray], float]
+# scorer theo xác suất: (y_true, predict_proba, classes_) -> float (vd. ROC AUC)
+ProbaScorer = Callable[[np.ndarray, np.ndarray, np.ndarray], float]
+
+
+def _safe_score(fn: Callable[..., float], *args) -> float:
+    # fold không tính được metric (vd. AUC khi test chỉ có một lớp) -> NaN, không hỏng cả CV
+    try:
+        return float(fn(*args))
+    except ValueError:
+        return float("nan")
+
+
+def _fit_score(name: str, estimator: BaseEstimator, i: int, fold: FoldData,
+               scorers: Dict[str, Scorer],
+               proba_scorers: Optional[Dict[str, ProbaScorer]] = None) -> Dict[str, Any]:
+    """Fit một model trên một fold (chạy trong worker của joblib) -> một dòng kết quả."""
+    est = clone(estimator)
+    t0 = time.perf_counter()
+    est.fit(fold.X_train, fold.y_train)
+    t1 = time.perf_counter()
+    pred = est.predict(fold.X_test)
+    proba = est.predict_proba(fold.X_test) if proba_scorers and hasattr(est, "predict_proba") else None
+    t2 = time.perf_counter()
+    row = {"model": name, "fold": i, "fit_s": t1 - t0, "predict_s": t2 - t1,
+           "n_train": len(fold.y_train), "n_test": len(fold.y_test)}
+    # số vòng thực sự chạy (boosting dừng sớm, solver lặp)
+    n_iter = getattr(est, "n_iter_", None)
+    if n_iter is not None:
+        row["n_iter"] = int(np.max(n_iter))
+    for metric, fn in scorers.items():
+        row[metric] = _safe_score(fn, fold.y_test, pred)
+    for metric, fn in (proba_scorers or {}).items():
+        row[metric] = float("nan") if proba is None else _safe_score(fn, fold.y_test, proba, est.classes_)
+    return row
+
+
+def cross_validate_candidates(
+    candidates: Dict[str, BaseEstimator],
+    prepared: PreparedFolds,
+    scorers: Dict[str, Scorer],
+    *,
+    proba_scorers: Optional[Dict[str, ProbaScorer]] = None,
+    n_jobs: int = -1,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> pd.DataFrame:
+    """
+    Đánh giá mọi (model, fold) song song bằng joblib (process, loky).
+    Các fold đã tiền xử lý một lần (PreparedFolds) -> mỗi task chỉ fit + predict;
+    mảng lớn được joblib memmap, các worker đọc chung thay vì mỗi task một bản copy.
+    proba_scorers chỉ tính cho model có predict_proba (còn lại NaN).
+
+    on_result(row) được gọi ngay khi một task xong (thứ tự hoàn thành, không theo thứ tự nộp);
+    should_stop() -> True thì bỏ các kết quả còn lại. Trả về bảng kết quả theo từng fold.
+    """
+    tasks = [(name, est, i, fold) for name, est in candidates.items()
+             for i, fold in enumerate(prepared.folds)]
+    rows: List[Dict[str, Any]] = []
+    if not tasks:
+        return pd.DataFrame(rows)
+    results = Parallel(n_jobs=n_jobs, return_as="generator_unordered")(
+        delayed(_fit_score)(name, est, i, fold, scorers, proba_scorers) for name, est, i, fold in tasks
+    )
+    for row in results:
+        rows.append(row)
+        if on_result is not None:
+            on_result(row)
+        if should_stop is not None and should_stop():
+            break
+    return pd.DataFrame(rows).sort_values(["model", "fold"], ignore_index=True)
+
+
+def summarize_cv(per_fold: pd.DataFrame, metrics: List[str], sort_by: str, ascending: bool) -> pd.DataFrame:
+    """
+    Gộp kết quả theo model: mean / std của từng metric, thời gian fit (tổng + trung bình
+    mỗi fold), thời gian predict và số vòng trung bình (nếu có). Sắp theo sort_by (mean).
+    """
+    if per_fold.empty:
+        return pd.DataFrame()
+    g = per_fold.groupby("model", sort=False)
+    out = pd.DataFrame({"folds": g.size()})
+    for m in metrics:
+        out[m] = g[m].mean()
+        out[f"{m}_std"] = g[m].std(ddof=0)
+    out["fit_s_total"] = g["fit_s"].sum()
+    out["fit_s_mean"] = g["fit_s"].mean()
+    out["predict_s_mean"] = g["predict_s"].mean()
+    if "n_iter" in per_fold.columns:
+        out["n_iter_mean"] = g["n_iter"].mean()
+    return out.sort_values(sort_by, ascending=ascending).reset_index()
+
+
+# ---------- Model cuối cùng ----------
+def fit_final_model(
+    df: pd.DataFrame,
+    target: str,
+    features: List[str],
+    estimator: BaseEstimator,
+    *,
+    datetime_col: Optional[str] = None,
+    pipeline_params: Optional[Dict] = None,
+    categorical: bool = False,
+) -> Dict[str, Any]:
+    """
+    Fit pipeline Step 3 (fit_numeric_pipeline, có cache đĩa) + model trên toàn bộ dòng có target.
+    Trả về bundle dạng Step 7 đọc được: {"model", "scaler": pipeline, ...}
+    (predict_from_model gọi scaler.transform(data) rồi model.predict).
+    """
+    work, y, ts_col = ordered_frame(df, target, features, datetime_col, categorical=categorical)
+    params = {**TRAINING_PIPELINE_DEFAULTS, **(pipeline_params or {})}
+    t0 = time.perf_counter()
+    pipe = fit_numeric_pipeline(work, columns=features, **params)
+    X = pipe.transform(work)
+    model = clone(estimator).fit(X, y)
+    bundle = {
+        "model": model,
+        "scaler": pipe,
+        "features": list(features),
+        "target": target,
+        "datetime_col": ts_col,
+        "pipeline_params": params,
+        "n_rows": len(y),
+        "fit_seconds": time.perf_counter() - t0,
+    }
+    if categorical:
+        bundle["classes"] = list(model.classes_)
+    return bundle
+
+
+def default_model_path(target: str, model_name: str, models_dir: str = "models") -> str:
+    slug = re.sub(r"[^\w.-]+", "_", f"{target}_{model_name}").strip("_")
+    return os.path.join(os.path.abspath(models_dir), f"{slug}.pkl")
+
+
+def save_model_bundle(bundle: Dict[str, Any], path: str) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return os.path.abspath(path)
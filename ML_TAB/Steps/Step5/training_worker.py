@@ -0,0 +1,43 @@
+# ML_TAB/Steps/Step5/training_worker.py
+from __future__ import annotations
+
+import traceback
+from typing import Any, Callable
+
+from PySide6.QtCore import QObject, Signal, Slot
+
+# Một job: fn(progress, should_stop) -> kết quả
+#   progress(kind, payload) phát tín hiệu về GUI (vd. ("fold", row) cho mỗi (model, fold) xong)
+TrainingJob = Callable[[Callable[[str, object], None], Callable[[], bool]], Any]
+
+
+class TrainingWorker(QObject):
+    """
+    Chạy một job training (CV hoặc fit model cuối) trong QThread riêng.
+    Job tự song song hoá bằng joblib; worker chỉ chuyển tiến độ / kết quả về GUI thread.
+    """
+
+    progress = Signal(str, object)    # (loại, dữ liệu)
+    done = Signal(object)             # kết quả của job
+    failed = Signal(str)              # thông báo lỗi
+    finished = Signal()
+
+    def __init__(self, job: TrainingJob):
+        super().__init__()
+        self.job = job
+        self._cancelled = False
+
+    def cancel(self):
+        """Bỏ các kết quả còn lại sau task đang chạy (không ngắt giữa chừng một lần fit)."""
+        self._cancelled = True
+
+    @Slot()
+    def run(self):
+        try:
+            res = self.job(self.progress.emit, lambda: self._cancelled)
+            if not self._cancelled:
+                self.done.emit(res)
+        except Exception as e:
+            traceback.print_exc()
+            self.failed.emit(str(e))
+        self.finished.emit()
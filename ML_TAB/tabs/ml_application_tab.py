@@ -1,6 +1,6 @@
 # tabs/ml_application_tab.py
 from __future__ import annotations
-from typing import Optional
+from typing import Dict, Optional
 import os, traceback
 from PySide6.QtCore import Qt
 from PySide6.QtGui import QFont
@@ -19,6 +19,8 @@ from ML_TAB.Steps.Step3.outlier_tools import (
     detect_outliers_iqr,
     detect_outliers_zscore,
     detect_outliers_modified_zscore,
+    detect_outliers_iqr_window,
+    detect_outliers_robust_z_window,
     detect_outliers_isoforest,
     detect_outliers_lof,
     detect_outliers_ecod,
@@ -26,8 +28,11 @@ from ML_TAB.Steps.Step3.outlier_tools import (
     detect_outliers_knn,
     combine_outlier_results,
 )
+from ML_TAB.Steps.Step3.feature_matrix import get_feature_matrix
 from ML_TAB.Steps.Step4.line_visualization_dialog import DataLinePlotDialog
 from ML_TAB.Steps.Step3.outlier_dialog import OutlierResultsDialog
+from ML_TAB.Steps.Step3.detection_worker import BackgroundJobs
+from ML_TAB.Steps.Step5.training_dialog import ModelTrainingDialog
 from PySide6.QtWidgets import QDialog, QMessageBox, QComboBox
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
@@ -70,6 +75,12 @@ class MLApplicationTab(QWidget):
         self.Rawdata = None
         self.raw_df = None
         self.cleaned_df = None
+        # Tăng mỗi khi raw_df / cleaned_df đổi -> khoá cache theo phiên bản dữ liệu
+        self.data_version = 0
+        # Kết quả Detect Outlier gần nhất {detector: OutlierResultStore} -> marker ở Step 4
+        self.outlier_stores: Dict[str, object] = {}
+        # Thread của dialog đã đóng khi worker còn chạy (detector / training) -> giữ tới khi xong
+        self.background_jobs = BackgroundJobs(self)
 
 
         # HBox chứa các StepCard
@@ -191,6 +202,8 @@ class MLApplicationTab(QWidget):
                 # Gán cho raw_df & cleaned_df để dùng cho bước clean
                 self.raw_df = self.Rawdata.copy()
                 self.cleaned_df = self.Rawdata.copy()
+                self.data_version += 1
+                self.outlier_stores = {}
 
 
                 # Thông báo kết quả (5 dòng đầu, shape)
@@ -272,36 +285,68 @@ class MLApplicationTab(QWidget):
         df = self.cleaned_df
 
         try:
-            # 2) Tính outlier trên df
-            iqr_df   = detect_outliers_iqr(df, factor=1.5)
-            zs_df    = detect_outliers_zscore(df, z=3.0)
-            modz_df  = detect_outliers_modified_zscore(df, threshold=3.5)
-
-            iso_df   = detect_outliers_isoforest(df, contamination=0.05)
-            lof_df   = detect_outliers_lof(df, n_neighbors=20, contamination=0.05)
-
-            ecod_df  = detect_outliers_ecod(df, contamination=0.05)
-            copod_df = detect_outliers_copod(df, contamination=0.05)
-            knn_df   = detect_outliers_knn(df, n_neighbors=20, contamination=0.05)
-
-            df_inter = combine_outlier_results(iqr_df, zs_df, how="intersection")
-            if df_inter is not None and not df_inter.empty:
-                df_inter = df_inter.copy()
-                df_inter["method"] = "IQR + Z-Score"
-
-            # 3) Hiển thị dialog
-            dlg = OutlierResultsDialog(self)
-            dlg.add_tab("IQR + Z-Score", df_inter)
-            dlg.add_tab("IQR", iqr_df)
-            dlg.add_tab("Z-score", zs_df)
-            dlg.add_tab("Modified Z-score", modz_df)
-            dlg.add_tab("IsolationForest", iso_df)
-            dlg.add_tab("LOF", lof_df)
-            dlg.add_tab("ECOD", ecod_df)
-            dlg.add_tab("COPOD", copod_df)
-            dlg.add_tab("KNN", knn_df)
+            version = self.data_version
+
+            def _inter(r):
+                df_inter = combine_outlier_results(r.get("IQR"), r.get("Z-score"), how="intersection")
+                if df_inter is not None and not df_inter.empty:
+                    df_inter = df_inter.copy()
+                    df_inter["method"] = "IQR + Z-Score"
+                return df_inter
+
+            # Biến thể cục bộ theo thời gian (cần cột Datetime)
+            def _rolling(fn, **kw):
+                def run(r):
+                    try:
+                        return fn(df, window="6h", **kw)
+                    except ValueError:
+                        return None
+                return run
+
+            # Một ma trận float32 C-contiguous dùng chung cho mọi detector row-level
+            # (cache theo data_version -> chỉ dựng một lần cho cả 5 detector)
+            def _fm():
+                return get_feature_matrix(df, version, dtype="float32", nan_policy="median")
+
+            # Dữ liệu lớn: fit trên mẫu con, chấm điểm theo chunk song song
+            def _isoforest(r):
+                out = detect_outliers_isoforest(
+                    df, contamination=0.05, fm=_fm(),
+                    fit_rows=200_000 if len(df) > 200_000 else None,
+                    chunk_size=100_000, return_json=False,
+                )
+                if "rows_per_sec" in out.attrs:
+                    print(f"[UI] Step 3 - IsolationForest scored {len(df)} rows — "
+                          f"{out.attrs['rows_per_sec']:,.0f} rows/s")
+                return out
+
+            # 2) Danh sách detector, chạy lần lượt trong background (thứ tự chạy != thứ tự tab)
+            tasks = [
+                ("IQR",              lambda r: detect_outliers_iqr(df, factor=1.5)),
+                ("Z-score",          lambda r: detect_outliers_zscore(df, z=3.0)),
+                ("IQR + Z-Score",    _inter),
+                ("Modified Z-score", lambda r: detect_outliers_modified_zscore(df, threshold=3.5)),
+                ("Rolling IQR (6h)",      _rolling(detect_outliers_iqr_window, factor=1.5)),
+                ("Rolling robust-Z (6h)", _rolling(detect_outliers_robust_z_window, threshold=3.5)),
+                ("IsolationForest",  _isoforest),
+                ("LOF",   lambda r: detect_outliers_lof(df, n_neighbors=20, contamination=0.05, fm=_fm())),
+                ("ECOD",  lambda r: detect_outliers_ecod(df, contamination=0.05, fm=_fm(), return_json=False)),
+                ("COPOD", lambda r: detect_outliers_copod(df, contamination=0.05, fm=_fm(), return_json=False)),
+                ("KNN",   lambda r: detect_outliers_knn(df, n_neighbors=20, contamination=0.05, fm=_fm(), return_json=False)),
+            ]
+
+            # 3) Mở dialog ngay với các tab placeholder, kết quả điền dần khi có
+            dlg = OutlierResultsDialog(self, jobs=self.background_jobs)
+            for name in ("IQR + Z-Score", "IQR", "Z-score", "Modified Z-score",
+                         "Rolling IQR (6h)", "Rolling robust-Z (6h)",
+                         "IsolationForest", "LOF", "ECOD", "COPOD", "KNN"):
+                dlg.add_pending_tab(name, derived=(name == "IQR + Z-Score"))
+            print(f"[UI] Step 3 - {len(df)} rows, {len(tasks)} detectors (background)")
+            dlg.run_detectors(tasks)
 
             result = dlg.exec()
+            # giữ lại kết quả (row_index là nhãn dòng -> vẫn khớp sau khi xoá bớt dòng)
+            self.outlier_stores = dict(dlg.stores)
 
             # 4) Chỉ khi bấm Delete mới ghi đè Cleaned
             if result == QDialog.Accepted and getattr(dlg, "rows_to_delete", []):
@@ -311,6 +356,7 @@ class MLApplicationTab(QWidget):
                 cleaned = self.cleaned_df.drop(index=rows_to_delete, errors="ignore").copy()
 
                 self.cleaned_df = cleaned
+                self.data_version += 1
 
                 QMessageBox.information(
                     self,
@@ -323,9 +369,8 @@ class MLApplicationTab(QWidget):
             QMessageBox.critical(self, "Lỗi Detect Outlier", str(e))
     def _on_regression_clicked(self):
         """
-        Handler cho nút Regression dưới Step 5.
-        Tạm thời chỉ hiện thông báo để test UI.
-        Sau này sẽ gọi dialog / pipeline Regression ở đây.
+        Handler cho nút Regression dưới Step 5:
+        mở dialog training (CV time-series song song, so sánh model, lưu model cho Step 7).
         """
         if self.cleaned_df is None:
             QMessageBox.warning(
@@ -336,17 +381,19 @@ class MLApplicationTab(QWidget):
             return
 
         print("[UI] Step 5 - Regression clicked")
-        QMessageBox.information(
-            self,
-            "Regression",
-            "Regression button clicked (Step 5). Logic training sẽ được thêm sau."
-        )
+        try:
+            dlg = ModelTrainingDialog(self.cleaned_df, task="regression",
+                                      data_version=self.data_version, parent=self,
+                                      jobs=self.background_jobs)
+            dlg.exec()
+        except Exception as e:
+            QMessageBox.critical(self, "Lỗi Regression", str(e))
 
     def _on_classification_clicked(self):
         """
-        Handler cho nút Classification dưới Step 5.
-        Tạm thời chỉ hiện thông báo để test UI.
-        Sau này sẽ gọi dialog / pipeline Classification ở đây.
+        Handler cho nút Classification dưới Step 5:
+        mở dialog training (target = tag trạng thái / alarm, class_weight cho lớp hiếm,
+        CV stratified hoặc time-series song song, lưu model cho Step 7).
         """
         if self.cleaned_df is None:
             QMessageBox.warning(
@@ -357,11 +404,19 @@ class MLApplicationTab(QWidget):
             return
 
         print("[UI] Step 5 - Classification clicked")
-        QMessageBox.information(
-            self,
-            "Classification",
-            "Classification button clicked (Step 5). Logic training sẽ được thêm sau."
-        )
+        try:
+            dlg = ModelTrainingDialog(self.cleaned_df, task="classification",
+                                      data_version=self.data_version, parent=self,
+                                      jobs=self.background_jobs)
+            if dlg.cboTarget.count() == 0:
+                QMessageBox.information(
+                    self, "Classification",
+                    "Không có cột nào dùng được làm nhãn lớp (2–20 giá trị khác nhau)."
+                )
+                return
+            dlg.exec()
+        except Exception as e:
+            QMessageBox.critical(self, "Lỗi Classification", str(e))
 
     def _show_line_visualization(self):
         # Chọn nguồn dữ liệu: ưu tiên raw_df / cleaned_df
@@ -369,5 +424,9 @@ class MLApplicationTab(QWidget):
             QMessageBox.warning(self, "Chưa có dữ liệu", "Hãy chạy Step 1 để nạp dữ liệu trước.")
             return
 
-        dlg = DataLinePlotDialog(self.raw_df, self.cleaned_df, parent=self)
+        dlg = DataLinePlotDialog(
+            self.raw_df, self.cleaned_df, parent=self,
+            data_version=self.data_version, outlier_stores=self.outlier_stores,
+            jobs=self.background_jobs,
+        )
         dlg.exec()
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Chạy pytest từ thư mục gốc của app (nơi có main.py) -> import được ML_TAB
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
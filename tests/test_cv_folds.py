@@ -0,0 +1,49 @@
+# tests/test_cv_folds.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from ML_TAB.Steps.Step5.cv_folds import prepare_cv_folds
+
+
+def _data(n=400, seed=0):
+    """Target = số phút từ mốc đầu -> so y_train / y_test là so thời gian; dòng bị xáo trộn."""
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2024-01-01", periods=n, freq="min")
+    df = pd.DataFrame({
+        "Datetime": ts,
+        "f1": rng.normal(size=n),
+        "f2": rng.normal(size=n),
+        "t": np.arange(n, dtype=float),
+    })
+    df.loc[rng.choice(n, 20, replace=False), "f1"] = np.nan
+    return df.iloc[rng.permutation(n)]
+
+
+@pytest.mark.parametrize("gap", [0, 7])
+def test_time_cv_trains_strictly_before_test(tmp_path, gap):
+    df = _data()
+    prepared = prepare_cv_folds(
+        df, "t", ["f1", "f2"], cv="time", n_splits=4, gap=gap,
+        pipeline_params={"cache_dir": str(tmp_path)}, n_jobs=1,
+    )
+    assert len(prepared.folds) == 4
+    for fold in prepared.folds:
+        assert fold.y_train.max() < fold.y_test.min()
+        assert fold.y_test.min() - fold.y_train.max() == gap + 1
+        # test_index là nhãn dòng của df gốc (không phải vị trí sau khi sắp theo thời gian)
+        np.testing.assert_array_equal(df.loc[fold.test_index, "t"].to_numpy(), fold.y_test)
+        assert not np.isnan(fold.X_train).any()
+
+
+def test_time_cv_ignores_rows_without_timestamp(tmp_path):
+    df = _data()
+    df.loc[df.index[:10], "Datetime"] = pd.NaT
+    prepared = prepare_cv_folds(
+        df, "t", ["f1", "f2"], cv="time", n_splits=3,
+        pipeline_params={"cache_dir": str(tmp_path)}, n_jobs=1,
+    )
+    dropped = set(df.index[:10])
+    for fold in prepared.folds:
+        assert fold.y_train.max() < fold.y_test.min()
+        assert not dropped & set(fold.test_index)
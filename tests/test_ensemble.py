@@ -0,0 +1,95 @@
+# tests/test_ensemble.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from ML_TAB.Steps.Step3.outlier_tools import combine_outlier_ensemble
+
+
+def _cells(cells, method, seed=0):
+    """DF kết quả column-level từ list (row_index, column)."""
+    rng = np.random.default_rng(seed)
+    rows = [r for r, _ in cells]
+    return pd.DataFrame({
+        "row_index": rows,
+        "timestamp": pd.Timestamp("2024-01-01") + pd.to_timedelta(rows, unit="min"),
+        "column": [c for _, c in cells],
+        "value": rng.normal(size=len(cells)),
+        "score": rng.normal(size=len(cells)) * 4,
+        "method": method,
+    })
+
+
+def _rows(rows, method, seed=0):
+    """DF kết quả row-level (column='<row>') từ list row_index."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "row_index": rows,
+        "timestamp": pd.Timestamp("2024-01-01") + pd.to_timedelta(rows, unit="min"),
+        "column": "<row>",
+        "value": None,
+        "score": -rng.random(len(rows)),
+        "method": method,
+    })
+
+
+def _random_cells(rng, n_rows=200, cols=("a", "b", "c"), size=80):
+    return sorted({(int(r), str(c)) for r, c in zip(rng.integers(0, n_rows, size), rng.choice(cols, size))})
+
+
+def _random_rows(rng, n_rows=200, size=30):
+    return sorted({int(r) for r in rng.integers(0, n_rows, size)})
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cell_level_matches_set_operations(seed):
+    rng = np.random.default_rng(seed)
+    sets = [set(_random_cells(rng)) for _ in range(3)]
+    results = {f"d{i}": _cells(sorted(s), f"M{i}", seed=i) for i, s in enumerate(sets)}
+
+    union = combine_outlier_ensemble(results, how="union")
+    inter = combine_outlier_ensemble(results, how="intersection")
+    vote = combine_outlier_ensemble(results, how="vote", k=2)
+
+    keys = lambda df: set(zip(df["row_index"], df["column"]))
+    assert keys(union) == set.union(*sets)
+    assert keys(inter) == set.intersection(*sets)
+    assert keys(vote) == {c for c in set.union(*sets) if sum(c in s for s in sets) >= 2}
+    assert not union.duplicated(["row_index", "column"]).any()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_row_level_matches_set_operations(seed):
+    rng = np.random.default_rng(seed)
+    cells = _random_cells(rng)
+    rows = [set(_random_rows(rng)) for _ in range(2)]
+    results = {"IQR": _cells(cells, "IQR"), "ISOFOR": _rows(sorted(rows[0]), "ISOFOR"),
+               "LOF": _rows(sorted(rows[1]), "LOF")}
+    sets = [{r for r, _ in cells}] + rows
+
+    union = combine_outlier_ensemble(results, how="union", level="row")
+    inter = combine_outlier_ensemble(results, how="intersection", level="row")
+    assert set(union["row_index"]) == set.union(*sets)
+    assert set(inter["row_index"]) == set.intersection(*sets)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_mixed_cell_union_keeps_rows_flagged_only_by_row_detectors(seed):
+    rng = np.random.default_rng(seed)
+    cells = set(_random_cells(rng))
+    flagged = set(_random_rows(rng))
+    results = {"IQR": _cells(sorted(cells), "IQR"), "ISOFOR": _rows(sorted(flagged), "ISOFOR")}
+    cell_rows = {r for r, _ in cells}
+
+    union = combine_outlier_ensemble(results, how="union", level="cell")
+    assert set(union["row_index"]) == cell_rows | flagged
+    # ô của IQR giữ nguyên; dòng chỉ ISOFOR gắn cờ có một key '<row>'
+    only_rows = union[union["column"] == "<row>"]
+    assert set(only_rows["row_index"]) == flagged - cell_rows
+    assert set(zip(union["row_index"], union["column"])) - {(r, "<row>") for r in flagged} == cells
+    # ô thuộc dòng ISOFOR cũng gắn cờ -> 2 phiếu
+    both = union[union["row_index"].isin(flagged) & (union["column"] != "<row>")]
+    assert (both["n_votes"] == 2).all()
+
+    inter = combine_outlier_ensemble(results, how="intersection", level="cell")
+    assert set(zip(inter["row_index"], inter["column"])) == {c for c in cells if c[0] in flagged}
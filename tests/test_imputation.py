@@ -0,0 +1,71 @@
+# tests/test_imputation.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from ML_TAB.Steps.Step3.imputation import TimeSeriesImputer, impute_time_series
+
+GAP = pd.Timedelta("10min")
+
+
+def _series_data(seed: int = 0, n: int = 400, m: int = 3):
+    """Lưới 1 phút có các đoạn dòng bị xoá (như Step 3) + NaN rải rác / thành cụm."""
+    rng = np.random.default_rng(seed)
+    t = pd.date_range("2024-01-01", periods=n, freq="1min")
+    keep = np.ones(n, bool)
+    keep[50:58] = False            # khoảng trống 8 phút (ngắn hơn GAP)
+    keep[200:230] = False          # khoảng trống 30 phút (dài hơn GAP)
+    t = t[keep]
+    X = rng.normal(size=(len(t), m))
+    X[rng.random(X.shape) < 0.1] = np.nan
+    X[100:115, 0] = np.nan         # cụm NaN dài 15 phút
+    X[:3, 1] = np.nan              # NaN ở đầu
+    X[-4:, 2] = np.nan             # NaN ở cuối
+    return X, t
+
+
+def _reference(X: np.ndarray, t: pd.DatetimeIndex, method: str) -> np.ndarray:
+    """Kết quả mong đợi tính bằng pandas (từng cột)."""
+    out = np.empty_like(X)
+    for j in range(X.shape[1]):
+        s = pd.Series(X[:, j], index=t)
+        valid_t = pd.Series(t.where(s.notna()), index=t)
+        prev_t = valid_t.ffill()
+        if method == "ffill":
+            filled = s.ffill()
+            ok = s.notna() | ((t - prev_t) <= GAP)
+        else:
+            filled = s.interpolate(method="time", limit_area="inside")
+            ok = s.notna() | ((valid_t.bfill() - prev_t) <= GAP)
+        out[:, j] = filled.where(ok).to_numpy()
+    return out
+
+
+@pytest.mark.parametrize("method", ["ffill", "interpolate"])
+@pytest.mark.parametrize("chunk_size", [1_000_000, 37])
+def test_impute_matches_pandas(method, chunk_size):
+    X, t = _series_data()
+    expected = _reference(X, t, method)
+    got = X.copy()
+    n_filled = impute_time_series(got, t.asi8, method=method, max_gap=GAP, chunk_size=chunk_size)
+    np.testing.assert_allclose(got, expected, rtol=1e-12, equal_nan=True)
+    assert n_filled == int(np.isnan(X).sum() - np.isnan(expected).sum())
+
+
+def test_gap_is_measured_in_time_not_rows():
+    # 2 dòng liền nhau nhưng cách 30 phút (dòng giữa đã bị xoá) -> không điền với max_gap 10 phút
+    t = pd.to_datetime(["2024-01-01 00:00", "2024-01-01 00:30", "2024-01-01 00:31"])
+    X = np.array([[1.0], [np.nan], [3.0]])
+    impute_time_series(X, t.asi8, method="ffill", max_gap=GAP)
+    assert np.isnan(X[1, 0])
+
+
+def test_time_series_imputer_restores_row_order():
+    X, t = _series_data(seed=1)
+    df = pd.DataFrame(X, columns=["a", "b", "c"])
+    df.insert(0, "Datetime", t)
+    shuffled = df.sample(frac=1.0, random_state=0)
+    imp = TimeSeriesImputer(columns=["a", "b", "c"], dtype="float64", method="ffill", max_gap=GAP)
+    out = imp.fit(shuffled).transform(shuffled)
+    expected = pd.DataFrame(_reference(X, t, "ffill"), index=df.index).loc[shuffled.index].to_numpy()
+    np.testing.assert_allclose(out, expected, equal_nan=True)
@@ -0,0 +1,69 @@
+# tests/test_result_store.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from ML_TAB.Steps.Step3.outlier_tools import detect_outliers_iqr, detect_outliers_isoforest
+from ML_TAB.Steps.Step3.result_store import OutlierResultStore
+
+pytest.importorskip("pyarrow")
+
+
+def _data(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Datetime": pd.date_range("2024-01-01", periods=n, freq="min"),
+        "a": rng.normal(size=n),
+        "b/c": rng.normal(size=n) * 10,
+        "d": rng.normal(size=n),
+    })
+    df.loc[rng.choice(n, 15, replace=False), "a"] += 12
+    df.loc[rng.choice(n, 5, replace=False), "Datetime"] = pd.NaT
+    return df
+
+
+def _assert_same(a: OutlierResultStore, b: OutlierResultStore):
+    assert len(a) == len(b)
+    for name in ("row_index", "timestamp", "score", "value"):
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name))
+    np.testing.assert_array_equal(a.column_names(), b.column_names())
+    np.testing.assert_array_equal(a.method_names(), b.method_names())
+    assert a.has_causes == b.has_causes
+    if a.has_causes:
+        np.testing.assert_array_equal(a.cause_value, b.cause_value)
+        np.testing.assert_array_equal(a.cause_rz, b.cause_rz)
+        assert [a.causes_records(i) for i in range(len(a))] == [b.causes_records(i) for i in range(len(b))]
+
+
+@pytest.fixture
+def store():
+    df = _data()
+    iso = detect_outliers_isoforest(df, contamination=0.05, timestamp_col="Datetime", return_json=False)
+    iqr = detect_outliers_iqr(df, factor=1.5)
+    return OutlierResultStore.concat([OutlierResultStore.from_frame(iso), OutlierResultStore.from_frame(iqr)])
+
+
+def test_parquet_round_trip(store, tmp_path):
+    assert store.has_causes and len(store) > 0
+    back = OutlierResultStore.read_parquet(store.to_parquet(str(tmp_path / "out.parquet")))
+    _assert_same(store, back)
+
+
+def test_parquet_round_trip_empty(tmp_path):
+    back = OutlierResultStore.read_parquet(OutlierResultStore.empty().to_parquet(str(tmp_path / "e.parquet")))
+    assert len(back) == 0 and not back.has_causes
+
+
+def test_cause_arrays_match_causes_json():
+    # Mảng ở attrs (return_json=False) phải cho cùng giải thích với cột causes_json (mặc định)
+    df = _data()
+    fast = detect_outliers_isoforest(df, contamination=0.05, timestamp_col="Datetime", return_json=False)
+    full = detect_outliers_isoforest(df, contamination=0.05, timestamp_col="Datetime")
+    assert "causes_json" not in fast.columns and "causes_json" in full.columns
+
+    store = OutlierResultStore.from_frame(fast)
+    assert store.has_causes
+    for i, recs in enumerate(full["causes_json"]):
+        got = store.causes_records(i)
+        assert [r["feature"] for r in got] == [r["feature"] for r in recs]
+        np.testing.assert_allclose([r["robust_z"] for r in got], [r["robust_z"] for r in recs], rtol=1e-5)
@@ -0,0 +1,52 @@
+# tests/test_rolling_window.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from ML_TAB.Steps.Step3.outlier_tools import _window_quantiles, detect_outliers_iqr_window
+
+QS = (0.25, 0.5, 0.75)
+
+
+def _series(n=700, seed=0):
+    """Thời gian không đều (khoảng 1–120 s) + NaN rải rác."""
+    rng = np.random.default_rng(seed)
+    t_ns = np.cumsum(rng.integers(1, 120, n)).astype(np.int64) * 1_000_000_000
+    x = rng.normal(size=n)
+    x[rng.choice(n, 40, replace=False)] = np.nan
+    return t_ns, x
+
+
+def _reference(t_ns, x, window_ns, step_ns, center, min_periods):
+    """np.nanquantile trên cửa sổ bao quanh khối `step` của từng dòng (vòng lặp Python)."""
+    out = np.full((len(QS), len(t_ns)), np.nan)
+    for i, t in enumerate(t_ns):
+        b_start = t_ns[0] + (t - t_ns[0]) // step_ns * step_ns
+        lo = b_start + step_ns // 2 - window_ns // 2 if center else b_start + step_ns - window_ns
+        w = x[(t_ns >= lo) & (t_ns < lo + window_ns)]
+        w = w[~np.isnan(w)]
+        if len(w) >= min_periods:
+            out[:, i] = np.quantile(w, QS)
+    return out
+
+
+@pytest.mark.parametrize("center", [True, False])
+@pytest.mark.parametrize("max_cells", [8_000_000, 500])
+def test_window_quantiles_match_nanquantile(center, max_cells):
+    t_ns, x = _series()
+    window_ns, step_ns = 3600 * 10**9, 900 * 10**9
+    got = _window_quantiles(t_ns, x, QS, window_ns, step_ns, center, 10, max_cells=max_cells)
+    np.testing.assert_allclose(got, _reference(t_ns, x, window_ns, step_ns, center, 10), equal_nan=True)
+
+
+def test_iqr_window_ignores_level_shift():
+    # Bậc thang tải: IQR toàn cục gắn cờ cả đoạn cao, IQR theo cửa sổ chỉ gắn cờ spike
+    n = 2000
+    rng = np.random.default_rng(1)
+    x = np.where(np.arange(n) < n // 2, 0.0, 50.0) + rng.normal(scale=0.5, size=n)
+    x[1500] += 20
+    df = pd.DataFrame({"Datetime": pd.date_range("2024-01-01", periods=n, freq="min"), "v": x})
+    out = detect_outliers_iqr_window(df, window="1h", factor=3.0)
+    flagged = set(out["row_index"])
+    assert 1500 in flagged
+    assert len(flagged) < 50